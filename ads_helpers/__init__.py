@@ -0,0 +1,5 @@
+"""
+Small helpers shared by the examples and by ads_report.py, the single command
+line entry point to all of them. The examples do not need these to run on
+their own.
+"""
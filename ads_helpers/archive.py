@@ -0,0 +1,214 @@
+"""
+Record the responses of the API into an archive, and make reports again from
+it later without a request (e.g., to go back over months of snapshots):
+
+    python ads_report.py facet --query star --save-to-file csv --record star-2024-05.jsonl.gz
+    python ads_report.py facet --query star --save-to-file csv --replay star-2024-05.jsonl.gz
+
+The archive is gzipped JSON lines, one per response:
+
+    {"key": "GET search/query?fl=bibcode&q=star&rows=2000", "time": "2024-05-01T12:00:00",
+     "status": 200, "content_type": "application/json", "body": "{...}"}
+
+The key is the method, the path of the end point (without the API's URL, so
+an archive of the API can be replayed against any ADS_API_URL), the sorted
+parameters and, for POSTs, a hash of the body. Tokens are never recorded.
+When replaying, a request that is not in the archive is an error, and the
+latest response of a key is the one used.
+
+Responses are read in whole to be recorded, so large responses are not
+parsed as they are downloaded while recording (see decoding.py).
+"""
+
+import os
+import gzip
+import json
+import base64
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+from ads_helpers import http, http_cache
+
+
+class ArchiveException(Exception):
+    pass
+
+
+def request_key(request):
+    """
+    :param request: requests.PreparedRequest
+
+    :return: key of the request in an archive
+    """
+    url = request.url
+    if url.startswith(http.API_URL):
+        path = url[len(http.API_URL):]
+    else:
+        parsed = urlparse(url)
+        path = '{}://{}{}'.format(parsed.scheme, parsed.netloc, parsed.path)
+        path = path if not parsed.query else '{}?{}'.format(path, parsed.query)
+    path, _, query = path.lstrip('/').partition('?')
+
+    key = '{} {}'.format(request.method, path)
+    if query:
+        key = '{}?{}'.format(key, urlencode(sorted(parse_qsl(query, keep_blank_values=True))))
+    if request.body:
+        body = request.body if isinstance(request.body, bytes) else request.body.encode('utf-8')
+        key = '{} body:{}'.format(key, hashlib.sha1(body).hexdigest())
+    return key
+
+
+class Recorder(object):
+    """
+    Appends the responses to an archive
+
+    :param path: archive, added to if it exists
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.count = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        # Each run is a new gzip member, which gzip reads as one file
+        self._file = gzip.open(self.path, 'at', encoding='utf-8')
+
+    def record(self, request, response):
+        entry = {
+            'key': request_key(request),
+            'time': datetime.utcnow().isoformat(),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type'),
+        }
+        content = response.content
+        try:
+            entry['body'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['body_base64'] = base64.b64encode(content).decode('ascii')
+
+        line = json.dumps(entry)
+        with self._lock:
+            self._file.write(line)
+            self._file.write('\n')
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Replayer(object):
+    """
+    Answers requests from an archive
+
+    :param path: archive made by Recorder
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        if not os.path.exists(self.path):
+            raise ArchiveException('No archive at: {}'.format(self.path))
+
+        self.entries = {}
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry['key']] = entry
+
+    def response(self, request):
+        """
+        :return: requests.Response recorded for the request
+        """
+        key = request_key(request)
+        entry = self.entries.get(key)
+        if entry is None:
+            raise ArchiveException('Not in the archive {}: {}'.format(self.path, key))
+
+        if 'body' in entry:
+            content = entry['body'].encode('utf-8')
+        else:
+            content = base64.b64decode(entry['body_base64'])
+        headers = {}
+        if entry.get('content_type'):
+            headers['Content-Type'] = entry['content_type']
+        return http_cache.build_response(request, entry['status'], headers, content)
+
+
+_recorder = None
+_replayer = None
+
+
+@contextmanager
+def use_archive(record=None, replay=None):
+    """
+    Record the responses of the API into an archive, or answer the requests
+    from one, inside the block
+
+    :param record: archive to add the responses to
+    :param replay: archive to answer from
+    """
+    global _recorder, _replayer
+    if record and replay:
+        raise ArchiveException('Cannot record and replay at the same time')
+
+    previous = _recorder, _replayer
+    _recorder = Recorder(record) if record else None
+    _replayer = Replayer(replay) if replay else None
+    try:
+        yield _recorder or _replayer
+    finally:
+        if _recorder is not None:
+            _recorder.close()
+            print('Recorded {} responses to: {}'.format(_recorder.count, _recorder.path))
+        _recorder, _replayer = previous
+
+
+class ArchivingAdapter(http_cache.CachingAdapter):
+    """
+    Transport adapter that records the responses into the archive, or
+    answers from it (see use_archive)
+    """
+    def send(self, request, **kwargs):
+        if _replayer is not None:
+            return _replayer.response(request)
+
+        response = super(ArchivingAdapter, self).send(request, **kwargs)
+        if _recorder is not None:
+            _recorder.record(request, response)
+        return response
+
+
+def add_arguments(parser):
+    """
+    Add the archive options to an argparse parser
+    """
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--record',
+        dest='record',
+        help='Add the responses of the API to this archive (gzipped JSON '
+             'lines) [default: None]',
+        default=None,
+        type=str
+    )
+    group.add_argument(
+        '--replay',
+        dest='replay',
+        help='Answer every request from this archive, rather than the API '
+             '[default: None]',
+        default=None,
+        type=str
+    )
+
+
+def from_args(args):
+    """
+    :return: context manager recording into, or replaying from, the archive
+        given by the options, see use_archive
+    """
+    return use_archive(record=getattr(args, 'record', None), replay=getattr(args, 'replay', None))
@@ -0,0 +1,558 @@
+"""
+Run many reports (e.g., the metrics of everyone in an institute) on several
+machines at once, from a queue of jobs kept in an SQLite file on a disk they
+all share. There is nothing else to run: each worker takes the next job from
+the file itself.
+
+    python ads_report.py batch --queue /shared/jobs.sqlite add jobs.txt
+    python ads_report.py batch --queue /shared/jobs.sqlite work --output /shared/reports --workers 4
+    python ads_report.py batch --queue /shared/jobs.sqlite status
+
+A job is a line of options for one of the examples, as given to ads_report.py:
+
+    metrics --orcid 0000-0001-8043-4965 --save-to-file csv
+    facet --query "star" --save-to-file csv --plot
+    library --token TOKEN_OF_AN_ACCOUNT
+
+  - The same job is only added once, and always writes to the same folder,
+    <output>/<example>-<hash of its options>, so running the queue again (or
+    a job twice) does not make more reports. The report is made in a
+    temporary folder, which is renamed once it is complete, so the folder is
+    either missing or whole.
+  - A worker holds a lease on its job, which it renews while the job runs. If
+    the worker stops (e.g., its machine goes down), the lease runs out and
+    another worker takes the job.
+  - A job that fails is tried again later (RETRY_DELAY, doubled each time),
+    up to --max-attempts times. Jobs are checked with the options of their
+    example when they are added, and a job the example exits on (e.g.,
+    parser.error) fails straight away, as it would exit again.
+
+Each worker is a process of its own, as the examples keep some of their state
+(the budget, the archive, matplotlib) per process. Taking a job is one short
+transaction, so adding workers or machines adds to the number of reports made
+until the API is the limit. The queue does not use SQLite's write-ahead log,
+which does not work on network file systems.
+"""
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import shutil
+import socket
+import sqlite3
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from contextlib import contextmanager, redirect_stdout
+
+from ads_helpers import examples
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    example TEXT,
+    argv TEXT,
+    state TEXT,
+    attempts INTEGER,
+    worker TEXT,
+    lease_until REAL,
+    not_before REAL,
+    error TEXT,
+    added REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, not_before);
+"""
+
+STATES = ['pending', 'running', 'done', 'failed']
+
+# Seconds a worker holds a job for without renewing its lease
+LEASE = 300
+
+# Seconds before a failed job is tried again, doubled after each attempt
+RETRY_DELAY = 30
+
+MAX_ATTEMPTS = 3
+
+# Seconds a worker waits before looking for jobs again, while the jobs left
+# are held by other workers or waiting to be tried again. Looking is one short
+# transaction, so this can be short without slowing the queue down.
+POLL = 1
+
+# Options the worker sets itself, as they decide where the report goes
+RESERVED_OPTIONS = ['--output', '-o']
+RESERVED_LIBRARY_OPTIONS = ['--save-to-file', '-s']
+
+# Options of which a job needs at least one, as without them the example
+# prints its help and exits
+TARGET_OPTIONS = {
+    'metrics': ['--orcid', '--query', '--bibcodes', '--bibcodes-file'],
+    'search': ['--orcid', '--query', '--from-store', '--bibcodes-file'],
+    'facet': ['--orcid', '--query', '--bibcodes-file', '--orcids-file'],
+    'library': [],
+}
+
+
+class BatchException(Exception):
+    pass
+
+
+def parse_job(line):
+    """
+    :param line: options of a job, e.g., metrics --orcid X --save-to-file csv
+
+    :return: name of the example, list of options
+    """
+    argv = shlex.split(line)
+    if not argv or argv[0] not in examples.EXAMPLES:
+        raise BatchException(
+            'A job starts with one of {}: {}'.format(', '.join(sorted(examples.EXAMPLES)), line)
+        )
+
+    name, argv = argv[0], argv[1:]
+    reserved = RESERVED_OPTIONS + (RESERVED_LIBRARY_OPTIONS if name == 'library' else [])
+    for option in argv:
+        if option.split('=')[0] in reserved:
+            raise BatchException('Option is set by the worker, and cannot be given: {}'.format(line))
+
+    # Check the options now, rather than when a worker gets to the job
+    try:
+        args = job_parser(name).parse_args(argv)
+    except SystemExit:
+        raise BatchException('Bad options: {}'.format(line))
+    targets = TARGET_OPTIONS[name]
+    if targets and all(getattr(args, option[2:].replace('-', '_')) is None for option in targets):
+        raise BatchException('A job of {} needs one of {}: {}'.format(name, ', '.join(targets), line))
+    return name, argv
+
+
+def job_parser(name):
+    """
+    :return: argparse parser of the options of an example
+    """
+    parser = argparse.ArgumentParser(prog=name)
+    examples.load(name).add_arguments(parser)
+    return parser
+
+
+def job_id(name, argv):
+    """
+    The same for the same job, however often it is added
+    """
+    digest = hashlib.sha1(json.dumps([name, argv]).encode('utf-8')).hexdigest()
+    return '{}-{}'.format(name, digest[:16])
+
+
+def read_jobs(paths):
+    """
+    :param paths: files with a job a line ('-' for stdin), blank lines and
+        lines starting with # are skipped
+
+    :return: list of (name, argv)
+    """
+    jobs = []
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path)
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    jobs.append(parse_job(line))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return jobs
+
+
+class JobQueue(object):
+    """
+    Jobs kept in an SQLite file, shared by every worker
+
+    :param path: SQLite file, made if it does not exist
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        A connection holding the write lock of the queue until it commits,
+        so two workers never take the same job
+        """
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def add(self, jobs):
+        """
+        :param jobs: list of (name, argv)
+
+        :return: number of jobs that were not in the queue already
+        """
+        now = time.time()
+        added = 0
+        with self.transaction() as db:
+            for name, argv in jobs:
+                cursor = db.execute(
+                    'INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, 0, NULL, NULL, ?, NULL, ?, NULL)',
+                    (job_id(name, argv), name, json.dumps(argv), 'pending', now, now)
+                )
+                added += cursor.rowcount
+        return added
+
+    def claim(self, worker, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        """
+        Take the next job that is ready: one that is pending, or whose worker
+        let its lease run out
+
+        :return: id, name, argv, attempt of the job, or None if there is none
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'failed', error = 'Lease ran out on the last attempt', finished = ? "
+                "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, max_attempts)
+            )
+            row = db.execute(
+                "SELECT id, example, argv, attempts FROM jobs "
+                "WHERE (state = 'pending' AND not_before <= ?) OR (state = 'running' AND lease_until < ?) "
+                "ORDER BY added, id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (worker, now + lease, row[0])
+            )
+        return row[0], row[1], json.loads(row[2]), row[3] + 1
+
+    def renew(self, id, worker, lease=LEASE):
+        """
+        :return: whether the worker still holds the job
+        """
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time() + lease, id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, id):
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'done', error = NULL, finished = ? WHERE id = ?",
+                (time.time(), id)
+            )
+
+    def fail(self, id, worker, error, retry=True, max_attempts=MAX_ATTEMPTS, delay=RETRY_DELAY):
+        """
+        Try the job again after a delay, unless it has had all its attempts
+        (or is not worth trying again). Nothing is done if another worker has
+        taken the job since.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND state = 'running'", (id, worker)
+            ).fetchone()
+            if row is None:
+                return
+            attempts = row[0]
+            if retry and attempts < max_attempts:
+                db.execute(
+                    "UPDATE jobs SET state = 'pending', worker = NULL, not_before = ?, error = ? WHERE id = ?",
+                    (now + delay * 2 ** (attempts - 1), error, id)
+                )
+            else:
+                db.execute(
+                    "UPDATE jobs SET state = 'failed', error = ?, finished = ? WHERE id = ?",
+                    (error, now, id)
+                )
+
+    def retry_failed(self):
+        """
+        Put the failed jobs back in the queue, with all their attempts
+
+        :return: number of jobs
+        """
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, worker = NULL, not_before = ? "
+                "WHERE state = 'failed'",
+                (time.time(),)
+            )
+            return cursor.rowcount
+
+    def counts(self):
+        """
+        :return: {state: number of jobs}
+        """
+        with self.transaction() as db:
+            rows = db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        counts = dict((state, 0) for state in STATES)
+        counts.update(rows)
+        return counts
+
+    def failed(self):
+        """
+        :return: list of (id, example, argv, error) of the failed jobs
+        """
+        with self.transaction() as db:
+            return db.execute(
+                "SELECT id, example, argv, error FROM jobs WHERE state = 'failed' ORDER BY added, id"
+            ).fetchall()
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Renews the lease of a job while it runs
+    """
+    def __init__(self, queue, id, worker, lease=LEASE):
+        super(LeaseKeeper, self).__init__(daemon=True)
+        self.queue = queue
+        self.id = id
+        self.worker = worker
+        self.lease = lease
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.lease / 3.):
+            try:
+                if not self.queue.renew(self.id, self.worker, lease=self.lease):
+                    # Another worker has it, whichever finishes first is kept
+                    return
+            except sqlite3.Error:
+                # Tried again at the next renewal, well before the lease runs out
+                pass
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_job(name, argv, folder):
+    """
+    Make the report of a job in a folder, with what it prints in job.log
+    """
+    if name == 'library':
+        argv = argv + ['--save-to-file', os.path.join(folder, 'libraries.csv')]
+    else:
+        argv = argv + ['--output', folder]
+
+    parser = job_parser(name)
+    with io.open(os.path.join(folder, 'job.log'), 'w') as log, redirect_stdout(log):
+        examples.load(name).run(parser.parse_args(argv), parser)
+
+
+def work(queue_path, output, worker=None, lease=LEASE, max_attempts=MAX_ATTEMPTS, wait=False):
+    """
+    Make the reports of the queue, one job at a time, until there are none
+    left (or forever, if wait)
+
+    :param queue_path: SQLite file of the queue
+    :param output: folder the report of each job is saved in
+    :param worker: name of the worker, host:pid if None
+    :param lease: seconds a job is held for between renewals
+    :param max_attempts: number of times a job is tried
+    :param wait: keep looking for new jobs once the queue is empty
+
+    :return: number of jobs done
+    """
+    queue = JobQueue(queue_path)
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    done = 0
+
+    while True:
+        job = queue.claim(worker, lease=lease, max_attempts=max_attempts)
+        if job is None:
+            counts = queue.counts()
+            if not wait and not counts['pending'] and not counts['running']:
+                return done
+            time.sleep(POLL)
+            continue
+
+        id, name, argv, attempt = job
+        final = os.path.join(output, id)
+        if os.path.isdir(final):
+            # Made by a worker that lost its lease before it could say so
+            queue.complete(id)
+            continue
+
+        folder = os.path.join(output, '.{}.{}.tmp'.format(id, worker.replace(':', '-')))
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+
+        keeper = LeaseKeeper(queue, id, worker, lease=lease)
+        keeper.start()
+        error = None
+        try:
+            run_job(name, argv, folder)
+        except SystemExit as e:
+            # The options were checked when the job was added, so this is the
+            # example giving up (e.g., parser.error), which it would do again
+            error, retry = 'Exited with {!r}'.format(e.code), False
+        except Exception as e:
+            error, retry = repr(e), True
+        finally:
+            keeper.stop()
+
+        if error is not None:
+            shutil.rmtree(folder, ignore_errors=True)
+            queue.fail(id, worker, error, retry=retry, max_attempts=max_attempts)
+            if retry and attempt < max_attempts:
+                print('{} failed (attempt {} of {}), to be tried again: {}'.format(id, attempt, max_attempts, error))
+            else:
+                print('{} failed: {}'.format(id, error))
+            continue
+
+        try:
+            os.rename(folder, final)
+        except OSError:
+            # Another worker finished the same job first, its report is kept
+            shutil.rmtree(folder, ignore_errors=True)
+        # Left behind by workers that stopped while making it
+        for stale in glob.glob(os.path.join(output, '.{}.*.tmp'.format(id))):
+            shutil.rmtree(stale, ignore_errors=True)
+        queue.complete(id)
+        done += 1
+        print('{} done: {}'.format(id, final))
+
+
+def format_counts(counts):
+    return ', '.join('{}: {}'.format(state, counts[state]) for state in STATES)
+
+
+def add_arguments(parser):
+    """
+    Add the command line options of the batch runner to an argparse parser
+    """
+    parser.add_argument(
+        'action',
+        choices=['add', 'work', 'status', 'retry'],
+        help='add jobs to the queue, work through it, show how far it has '
+             'got, or put its failed jobs back in it'
+    )
+    parser.add_argument(
+        'jobs',
+        nargs='*',
+        help='Files of jobs to add, one a line (- for stdin)'
+    )
+    parser.add_argument(
+        '--queue',
+        dest='queue',
+        help='SQLite file of the queue, on a disk every machine can reach '
+             '[default: ADS_BATCH_QUEUE]',
+        default=os.getenv('ADS_BATCH_QUEUE'),
+        type=str
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='output',
+        help='Folder the reports are saved in [default: reports]',
+        default='reports',
+        type=str
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        help='Number of jobs run at the same time on this machine [default: 1]',
+        default=1,
+        type=int
+    )
+    parser.add_argument(
+        '--lease',
+        dest='lease',
+        help='Seconds a job is given back to the queue after, if its worker '
+             'stops renewing it [default: {}]'.format(LEASE),
+        default=LEASE,
+        type=float
+    )
+    parser.add_argument(
+        '--max-attempts',
+        dest='max_attempts',
+        help='Number of times a job is tried [default: {}]'.format(MAX_ATTEMPTS),
+        default=MAX_ATTEMPTS,
+        type=int
+    )
+    parser.add_argument(
+        '--wait',
+        dest='wait',
+        help='Keep looking for new jobs once the queue is empty',
+        action='store_true',
+        default=False
+    )
+
+
+def run(args, parser):
+    """
+    Run the batch runner for the command line options that were parsed
+    """
+    if not args.queue:
+        parser.error('--queue (or ADS_BATCH_QUEUE) is needed')
+    if args.jobs and args.action != 'add':
+        parser.error('Files of jobs are only used by add')
+
+    queue = JobQueue(args.queue)
+
+    if args.action == 'add':
+        try:
+            jobs = read_jobs(args.jobs or ['-'])
+        except BatchException as error:
+            parser.error(str(error))
+        added = queue.add(jobs)
+        print('Added {} jobs ({} already in the queue)'.format(added, len(jobs) - added))
+
+    elif args.action == 'status':
+        print(format_counts(queue.counts()))
+        for id, name, argv, error in queue.failed():
+            print('{} ({} {}): {}'.format(id, name, ' '.join(json.loads(argv)), error))
+
+    elif args.action == 'retry':
+        print('Put {} failed jobs back in the queue'.format(queue.retry_failed()))
+
+    else:
+        # There is no display to draw on
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+        # Other machines may be making it at the same time
+        os.makedirs(args.output, exist_ok=True)
+
+        options = dict(lease=args.lease, max_attempts=args.max_attempts, wait=args.wait)
+        if args.workers <= 1:
+            work(args.queue, args.output, **options)
+        else:
+            processes = [
+                multiprocessing.Process(target=work, args=(args.queue, args.output), kwargs=options)
+                for _ in range(args.workers)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+        print(format_counts(queue.counts()))
@@ -0,0 +1,295 @@
+"""
+Search within a list of bibcodes, rather than with a query, through the
+bigquery end point (POST /search/bigquery), which takes the bibcodes in the
+body of the request instead of a very long q:
+
+    bibcodes = bigquery.read_bibcodes(['mylist.txt', '-'])  # - is stdin
+    data = bigquery.search(session, headers, {'q': '*:*', 'fl': 'bibcode'}, bibcodes)
+
+The bibcodes are sent CHUNK_SIZE at a time, and the responses are merged into
+one: numFound and the documents are added up, and so are the counts of facet
+pivots and JSON facets, so the facets of the whole list can be requested the
+same way as those of a query.
+"""
+
+import sys
+import json
+from collections import OrderedDict
+
+from ads_helpers import decoding, http, profiling
+
+# Largest number of bibcodes sent in a request
+CHUNK_SIZE = 2000
+
+
+class BigQueryException(Exception):
+    pass
+
+
+class Document(object):
+    """
+    A document returned by the search end point, with the same attributes as
+    an ads.Article for the fields that were requested
+    """
+    def __init__(self, doc):
+        self.year = None
+        self.pubdate = None
+        self.property = []
+        self.citation_count = 0
+        self.read_count = 0
+        self.__dict__.update(doc)
+
+    def __repr__(self):
+        return '<Document {}>'.format(getattr(self, 'bibcode', None))
+
+
+def read_list(sources):
+    """
+    Read values (e.g., bibcodes or ORCiD iDs) from files (- for stdin), one
+    or more a line, separated by white space or commas. Lines starting with #
+    are left out, as are values that were already read.
+
+    :param sources: list of file names
+
+    :return: list of values, in the order they were first read
+    """
+    values = OrderedDict()
+    for source in sources:
+        if source == '-':
+            lines = sys.stdin.readlines()
+        else:
+            with open(source) as f:
+                lines = f.readlines()
+
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for value in line.replace(',', ' ').split():
+                values[value] = None
+
+    return list(values)
+
+
+def read_bibcodes(sources):
+    """
+    Read bibcodes from files, see read_list
+
+    :param sources: list of file names (- for stdin)
+
+    :return: list of bibcodes, in the order they were first read
+    """
+    return read_list(sources)
+
+
+def chunks(bibcodes, size=CHUNK_SIZE):
+    for i in range(0, len(bibcodes), size):
+        yield bibcodes[i:i+size]
+
+
+def request(session, headers, params, bibcodes, stream=False):
+    """
+    Make one request to the bigquery end point
+
+    :param stream: return before the body is received
+
+    :return: requests.Response
+    """
+    request_headers = dict(headers)
+    request_headers['Content-Type'] = 'big-query/csv'
+
+    with profiling.stage('fetch'):
+        r = session.post(
+            http.api_url('search/bigquery'),
+            params=params,
+            headers=request_headers,
+            data='bibcode\n{}'.format('\n'.join(bibcodes)),
+            stream=stream
+        )
+    if not r:
+        raise BigQueryException('An API error occurred, status: {}, {}'.format(
+            r.status_code, r.text[:200]
+        ))
+    return r
+
+
+def post(session, headers, params, bibcodes):
+    """
+    Make one request to the bigquery end point
+
+    :return: decoded response
+    """
+    r = request(session, headers, params, bibcodes)
+    with profiling.stage('decode'):
+        return decoding.decode(r)
+
+
+def merge_pivots(pivots):
+    """
+    Add up the counts of facet pivots (lists of {field, value, count, pivot})
+    """
+    merged = OrderedDict()
+    for pivot in pivots:
+        for entry in pivot:
+            if entry['value'] not in merged:
+                merged[entry['value']] = dict(entry, count=0, pivot=[])
+            target = merged[entry['value']]
+            target['count'] += entry['count']
+            target['pivot'].append(entry.get('pivot', []))
+
+    result = []
+    for entry in merged.values():
+        inner = merge_pivots(entry.pop('pivot'))
+        if inner:
+            entry['pivot'] = inner
+        result.append(entry)
+    return result
+
+
+def merge_facets(facets, request):
+    """
+    Add up JSON facets (json.facet): counts, sums and buckets are added, min
+    and max are taken over every response, and averages are weighted by the
+    number of papers they are over
+
+    :param facets: the facets of each response
+    :param request: the facets that were requested (json.facet)
+    """
+    facets = [f for f in facets if f]
+    if not facets:
+        return {}
+
+    merged = OrderedDict()
+    merged['count'] = sum(f.get('count', 0) for f in facets)
+    if 'val' in facets[0]:
+        merged['val'] = facets[0]['val']
+
+    for name, facet in request.items():
+        values = [f[name] for f in facets if f.get(name) is not None]
+        if not values:
+            continue
+
+        if isinstance(facet, str):
+            function = facet.partition('(')[0].strip()
+            if function == 'min':
+                merged[name] = min(values)
+            elif function == 'max':
+                merged[name] = max(values)
+            elif function == 'avg':
+                weights = [f.get('count', 1) for f in facets if f.get(name) is not None]
+                merged[name] = sum(v * w for v, w in zip(values, weights)) / float(max(sum(weights), 1))
+            else:
+                merged[name] = sum(values)
+        elif facet.get('type', 'terms') == 'terms':
+            buckets = OrderedDict()
+            for value in values:
+                for bucket in value.get('buckets', []):
+                    buckets.setdefault(bucket['val'], []).append(bucket)
+            merged_buckets = [merge_facets(b, facet.get('facet', {})) for b in buckets.values()]
+            if str(facet.get('sort', '')).startswith('index'):
+                merged_buckets.sort(key=lambda b: b['val'], reverse=facet['sort'].endswith('desc'))
+            else:
+                merged_buckets.sort(key=lambda b: -b['count'])
+            merged[name] = {'buckets': merged_buckets}
+        else:
+            merged[name] = merge_facets(values, facet.get('facet', {}))
+    return merged
+
+
+def merge_responses(responses, facet_request=None):
+    """
+    Merge the responses of the chunks of a list of bibcodes into one
+
+    :param facet_request: the JSON facets that were requested, if any
+    """
+    merged = {
+        'responseHeader': responses[0].get('responseHeader', {}),
+        'response': {
+            'numFound': sum(r['response']['numFound'] for r in responses),
+            'start': 0,
+            'docs': [doc for r in responses for doc in r['response'].get('docs', [])],
+        },
+    }
+
+    pivots = [r['facet_counts']['facet_pivot'] for r in responses if 'facet_counts' in r]
+    if pivots:
+        merged['facet_counts'] = {'facet_pivot': OrderedDict(
+            (name, merge_pivots([p.get(name, []) for p in pivots])) for name in pivots[0]
+        )}
+
+    facets = [r['facets'] for r in responses if 'facets' in r]
+    if facets:
+        merged['facets'] = merge_facets(facets, facet_request or {})
+
+    return merged
+
+
+def search(session, headers, params, bibcodes, chunk_size=CHUNK_SIZE):
+    """
+    Search within a list of bibcodes, a chunk of them at a time
+
+    :param session: HTTP session to use
+    :param headers: headers of the request (token)
+    :param params: parameters of the request, as for /search/query (rows is
+        set to the size of each chunk, unless given)
+    :param bibcodes: list of bibcodes
+
+    :return: decoded response, merged over the chunks
+    """
+    responses = []
+    for chunk in chunks(bibcodes, chunk_size):
+        chunk_params = dict(params)
+        chunk_params.setdefault('q', '*:*')
+        chunk_params.setdefault('rows', len(chunk))
+        responses.append(post(session, headers, chunk_params, chunk))
+
+    if not responses:
+        return {'response': {'numFound': 0, 'start': 0, 'docs': []}}
+    facet_request = json.loads(params['json.facet']) if 'json.facet' in params else None
+    return merge_responses(responses, facet_request=facet_request)
+
+
+def search_documents(session, headers, bibcodes, fl, chunk_size=CHUNK_SIZE):
+    """
+    The documents of a list of bibcodes
+
+    :param fl: fields of the documents
+
+    :return: list of Document
+    """
+    # Each document is made as it is parsed, rather than after the whole
+    # response is decoded
+    documents = []
+    for chunk in chunks(bibcodes, chunk_size):
+        params = {'q': '*:*', 'fl': ','.join(fl), 'rows': len(chunk)}
+        r = request(session, headers, params, chunk, stream=True)
+        try:
+            with profiling.stage('decode'):
+                documents.extend(Document(doc) for doc in decoding.iter_docs(r))
+        finally:
+            r.close()
+    return documents
+
+
+def add_arguments(parser):
+    """
+    Add the option to read bibcodes from files to an argparse parser
+    """
+    parser.add_argument(
+        '--bibcodes-file',
+        dest='bibcodes_file',
+        nargs='+',
+        help='Use the bibcodes in these files (- for stdin), one or more a '
+             'line, instead of a query [default: None]',
+        default=None,
+        type=str
+    )
+
+
+def from_args(args):
+    """
+    :return: list of the bibcodes in the files given, or None if none were
+    """
+    if not getattr(args, 'bibcodes_file', None):
+        return None
+    return read_bibcodes(args.bibcodes_file)
@@ -0,0 +1,177 @@
+"""
+Decode the API's JSON responses quicker, and with less memory, than
+response.json():
+
+  - decode(response) uses orjson when it is installed, which decodes the
+    large responses several times quicker than the json module
+  - facet pivots are read into numpy arrays, and documents are given one at
+    a time. Responses larger than STREAM_ABOVE (or of unknown length) are
+    parsed as they are downloaded, with ijson when it is installed, so the
+    whole response is never held as Python dicts: this takes a fraction of
+    the memory, but 2 to 4 times longer than orjson, which is used for the
+    rest.
+
+A pivot read this way is compact: one entry per value of the first field,
+with the values of the second field and their counts as numpy arrays,
+
+    [{'field': 'property', 'value': 'refereed', 'count': 120,
+      'values': array([...]), 'counts': array([...])}, ...]
+
+Without orjson or ijson, the json module is used, and gives the same results.
+"""
+
+import io
+import json
+
+import numpy
+
+from ads_helpers import profiling
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Responses larger than this many bytes are parsed as they are downloaded
+STREAM_ABOVE = 16 * 1024 * 1024
+
+
+def loads(data):
+    """
+    Decode JSON (bytes or str) with the quickest backend installed
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode(response):
+    """
+    Decode the JSON body of a requests.Response, see loads
+    """
+    return loads(response.content)
+
+
+def body_of(response):
+    """
+    A file to parse the body of a response from: the stream itself, if it has
+    not been read yet, otherwise what was read
+    """
+    if getattr(response, '_content_consumed', True) or response.raw is None:
+        return io.BytesIO(response.content)
+    response.raw.decode_content = True
+    return response.raw
+
+
+def should_stream(response):
+    """
+    :return: whether a response is large enough to be parsed as it is
+        downloaded (see STREAM_ABOVE)
+    """
+    if ijson is None:
+        return False
+    if getattr(response, '_content_consumed', True):
+        size = len(response.content)
+    else:
+        size = response.headers.get('Content-Length')
+    return size is None or int(size) > STREAM_ABOVE
+
+
+def compact_pivot(entries):
+    """
+    Compact a decoded facet pivot of two fields (see the module docstring)
+
+    :param entries: pivot entries, as in facet_counts.facet_pivot
+    """
+    compact = []
+    for entry in entries:
+        inner = entry.get('pivot', [])
+        compact.append({
+            'field': entry.get('field'),
+            'value': entry['value'],
+            'count': entry['count'],
+            'values': numpy.array([i['value'] for i in inner]),
+            'counts': numpy.array([i['count'] for i in inner], dtype=numpy.int64),
+        })
+    return compact
+
+
+def sum_counts(values, counts):
+    """
+    Add up the counts of values that appear more than once
+
+    :return: values (sorted), counts
+    """
+    if not len(values):
+        return values, counts
+    unique, inverse = numpy.unique(values, return_inverse=True)
+    return unique, numpy.bincount(inverse.ravel(), weights=counts, minlength=len(unique)).astype(numpy.int64)
+
+
+def read_pivot(response, pivot):
+    """
+    Read a facet pivot of two fields into compact entries. Large responses
+    are parsed as they are downloaded, without decoding the rest of the
+    response into dicts.
+
+    :param response: requests.Response of a search with facet.pivot
+    :param pivot: the pivot, e.g., property,citation_count
+
+    :return: number of papers found, compact pivot entries
+    """
+    if not should_stream(response):
+        data = decode(response)
+        return data['response']['numFound'], compact_pivot(data['facet_counts']['facet_pivot'][pivot])
+
+    top = 'facet_counts.facet_pivot.{}.item'.format(pivot)
+    inner_value = '{}.pivot.item.value'.format(top)
+    inner_count = '{}.pivot.item.count'.format(top)
+    top_keys = dict(('{}.{}'.format(top, key), key) for key in ['field', 'value', 'count'])
+
+    num_found = None
+    entries = []
+    values, counts = [], []
+    for prefix, event, value in ijson.parse(body_of(response), use_float=True):
+        # The values of the second field are by far the most common events
+        if prefix == inner_value:
+            values.append(value)
+        elif prefix == inner_count:
+            counts.append(value)
+        elif prefix == top and event == 'start_map':
+            entry = {'field': None, 'value': None, 'count': 0}
+            values, counts = [], []
+        elif prefix == top and event == 'end_map':
+            entry['values'] = numpy.array(values)
+            entry['counts'] = numpy.array(counts, dtype=numpy.int64)
+            entries.append(entry)
+        elif prefix in top_keys:
+            entry[top_keys[prefix]] = value
+        elif prefix == 'response.numFound':
+            num_found = value
+    profiling.count_stream_bytes(response)
+    return num_found, entries
+
+
+def iter_docs(response):
+    """
+    The documents of a search response (response.docs), one at a time, as
+    the response is parsed
+
+    :param response: requests.Response of a search
+    """
+    if not should_stream(response):
+        for doc in decode(response)['response']['docs']:
+            yield doc
+        return
+
+    for doc in ijson.items(body_of(response), 'response.docs.item', use_float=True):
+        yield doc
+    profiling.count_stream_bytes(response)
+
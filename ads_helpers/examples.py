@@ -0,0 +1,46 @@
+"""
+Find and import the example scripts. Two of them share the same file name
+(plot_search.py), so they are imported from their path under their own
+module name, rather than by adding their folders to sys.path.
+"""
+
+import os
+import sys
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Name of the sub-command: (folder, script)
+EXAMPLES = {
+    'metrics': ('metrics', 'plot_metrics'),
+    'search': ('search_facet', 'plot_search'),
+    'facet': ('search_facet_optimised', 'plot_search'),
+    'library': ('library_csv', 'lib_2_csv'),
+}
+
+
+def load(name):
+    """
+    Import an example script, once per process
+
+    :param name: name of the example, one of EXAMPLES
+    :type name: str
+
+    :return: module
+    """
+    module_name = 'ads_examples_{}'.format(name)
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    folder, script = EXAMPLES[name]
+    path = os.path.join(ROOT, folder, '{}.py'.format(script))
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        del sys.modules[module_name]
+        raise
+    return module
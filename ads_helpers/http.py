@@ -0,0 +1,93 @@
+"""
+One HTTP session, with its connection pool, shared by every request the
+examples make in a process. Running a single report, this changes nothing, but
+a long-lived process (see server.py) keeps its connections to the API open
+between reports.
+
+The examples talk to the API at ADS_API_URL, if it is set (e.g., to the
+stand-in server of mock_api.py), rather than to https://api.adsabs.harvard.edu.
+"""
+
+import os
+import threading
+
+from ads_helpers import profiling
+
+# Number of connections kept open to each host
+POOL_SIZE = 16
+
+DEFAULT_API_URL = 'https://api.adsabs.harvard.edu/v1'
+API_URL = os.getenv('ADS_API_URL', DEFAULT_API_URL).rstrip('/')
+
+_session = None
+_lock = threading.Lock()
+
+
+def api_url(path):
+    """
+    :param path: path of an end point, e.g., search/query
+
+    :return: URL of the end point
+    """
+    return '{}/{}'.format(API_URL, path.lstrip('/'))
+
+
+def mount(session, pool_size=None):
+    """
+    Send every request of a session through the adapter that records into,
+    or answers from, an archive (see archive.py), answers from the HTTP cache
+    (see http_cache.py), and times, hedges and gives up on requests (see
+    latency.py)
+    """
+    from ads_helpers import archive
+
+    if pool_size is None:
+        adapter = archive.ArchivingAdapter()
+    else:
+        adapter = archive.ArchivingAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Return the session shared by the examples, creating it on first use
+
+    :return: requests.Session
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+
+            session = requests.Session()
+            mount(session, pool_size=POOL_SIZE)
+            session.hooks['response'].append(profiling.count_response_bytes)
+            _session = session
+    return _session
+
+
+def share_ads_session():
+    """
+    Make every query of Andy Casey's client use the same session (the client
+    otherwise opens a new session for every query it makes), and send its
+    queries to ADS_API_URL
+    """
+    from ads.base import BaseQuery
+    from ads.search import SearchQuery
+    from ads.metrics import MetricsQuery
+
+    if API_URL != DEFAULT_API_URL:
+        SearchQuery.HTTP_ENDPOINT = api_url('search/query')
+        MetricsQuery.HTTP_ENDPOINT = api_url('metrics')
+
+    with _lock:
+        if BaseQuery._session is None:
+            # The first session made by the client carries its headers (token,
+            # user agent), so it is the one that is shared
+            session = BaseQuery().session
+            mount(session)
+            session.hooks['response'].append(profiling.count_response_bytes)
+            BaseQuery._session = session
+    return BaseQuery._session
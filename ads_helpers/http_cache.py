@@ -0,0 +1,328 @@
+"""
+A cache of the API's responses on disk, in front of every GET the examples
+make, that follows the response headers:
+
+  - Cache-Control: max-age=N responses are used as they are for N seconds,
+    no-cache ones are checked with the API every time, and no-store ones are
+    not kept
+  - ETag and Last-Modified are sent back (If-None-Match, If-Modified-Since)
+    once a response is no longer fresh, so an unchanged response costs a 304
+    without a body rather than the whole response again
+
+Responses without either validator or a max-age are not kept. A response
+asked for as a stream (see decoding.py) is read in whole to be kept, so it is
+not parsed as it is downloaded while the cache is used. The bodies are
+kept compressed (zlib) in an SQLite file, and once they take up more than
+max_size bytes, those used least recently are dropped.
+
+    http_cache.set_cache(http_cache.HttpCache('~/.ads/http_cache.sqlite'))
+
+The examples use it when given --http-cache (or ADS_HTTP_CACHE is set).
+Responses depend on the token they were asked for with (e.g., the libraries),
+so each token has its own entries.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from ads_helpers import latency
+
+# Largest size of the bodies kept, in MB
+DEFAULT_MAX_SIZE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT,
+    status INTEGER,
+    headers TEXT,
+    body BLOB,
+    size INTEGER,
+    stored REAL,
+    expires REAL,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+
+# Headers of a 304 that replace those kept
+UPDATED_HEADERS = ['Cache-Control', 'ETag', 'Expires', 'Last-Modified', 'Date']
+
+# Headers that are about how the body was sent, not kept as the body is kept
+# decoded
+TRANSFER_HEADERS = ['Content-Encoding', 'Content-Length', 'Transfer-Encoding', 'Connection']
+
+
+def cache_control(headers):
+    """
+    :return: {directive: value or True} of the Cache-Control header
+    """
+    directives = {}
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') if value else True
+    return directives
+
+
+def freshness(headers):
+    """
+    :return: seconds a response can be used without asking the API again
+    """
+    directives = cache_control(headers)
+    if 'no-cache' in directives:
+        return 0
+    try:
+        return max(int(directives.get('max-age', 0)), 0)
+    except ValueError:
+        return 0
+
+
+def cacheable(response):
+    if response.status_code != 200 or 'no-store' in cache_control(response.headers):
+        return False
+    return bool(
+        freshness(response.headers) or
+        'ETag' in response.headers or
+        'Last-Modified' in response.headers
+    )
+
+
+def cache_key(request):
+    """
+    The URL of the request, and a hash of its token
+    """
+    token = request.headers.get('Authorization', '')
+    return hashlib.sha256('{} {}'.format(request.url, token).encode('utf-8')).hexdigest()
+
+
+def build_response(request, status, headers, content):
+    """
+    A requests.Response made from what was kept
+    """
+    response = requests.models.Response()
+    response.status_code = status
+    response.reason = 'OK'
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    response.elapsed = timedelta(0)
+    response._content = content
+    response._content_consumed = True
+    response.from_cache = True
+    return response
+
+
+class HttpCache(object):
+    """
+    Responses kept in an SQLite file
+    """
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE*1024*1024):
+        """
+        :param path: SQLite file, made if it does not exist
+        :param max_size: bytes of (compressed) bodies kept at most
+        """
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        with self.connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        """
+        A connection that commits on success, used by one thread at a time
+        """
+        with self._lock:
+            db = sqlite3.connect(self.path, timeout=30)
+            try:
+                with db:
+                    yield db
+            finally:
+                db.close()
+
+    def get(self, key):
+        """
+        :return: status, headers, body, expires of the response kept, or None
+        """
+        with self.connect() as db:
+            row = db.execute(
+                'SELECT status, headers, body, expires FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE responses SET used = ? WHERE key = ?', (time.time(), key))
+        status, headers, body, expires = row
+        return status, json.loads(headers), zlib.decompress(body), expires
+
+    def put(self, key, url, status, headers, content):
+        """
+        Keep a response, then drop those used least recently while the
+        bodies take up more than max_size
+        """
+        body = zlib.compress(content, 6)
+        headers = dict((k, v) for k, v in headers.items() if k.title() not in TRANSFER_HEADERS)
+        now = time.time()
+        with self.connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, url, status, json.dumps(headers), body, len(body), now,
+                 now + freshness(CaseInsensitiveDict(headers)), now)
+            )
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.max_size:
+                dropped = 0
+                for old_key, size in db.execute(
+                        'SELECT key, size FROM responses ORDER BY used').fetchall():
+                    if total - dropped <= self.max_size:
+                        break
+                    db.execute('DELETE FROM responses WHERE key = ?', (old_key,))
+                    dropped += size
+
+    def refresh(self, key, headers):
+        """
+        The API said a response has not changed (304): take its new headers
+        and start its freshness again
+        """
+        with self.connect() as db:
+            row = db.execute('SELECT headers FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return
+            kept = CaseInsensitiveDict(json.loads(row[0]))
+            for name in UPDATED_HEADERS:
+                if name in headers:
+                    kept[name] = headers[name]
+            now = time.time()
+            db.execute(
+                'UPDATE responses SET headers = ?, stored = ?, expires = ?, used = ? WHERE key = ?',
+                (json.dumps(dict(kept)), now, now + freshness(kept), now, key)
+            )
+            return dict(kept)
+
+    def size(self):
+        """
+        :return: number of responses, bytes of their bodies
+        """
+        with self.connect() as db:
+            return db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+
+
+_cache = None
+
+
+def get_cache():
+    return _cache
+
+
+def set_cache(cache):
+    """
+    Use a cache for every GET that follows (None to stop)
+    """
+    global _cache
+    _cache = cache
+
+
+@contextmanager
+def use_cache(cache):
+    """
+    Use a cache for every GET inside the block, and put the previous one back
+    after it
+
+    :param cache: HttpCache, or None for no cache
+    """
+    previous = _cache
+    set_cache(cache)
+    try:
+        yield cache
+    finally:
+        set_cache(previous)
+
+
+class CachingAdapter(latency.HedgingAdapter):
+    """
+    Transport adapter that answers from the cache when it can, and asks the
+    API whether a response has changed once it is no longer fresh
+    """
+    def send(self, request, **kwargs):
+        cache = _cache
+        if cache is None or request.method != 'GET':
+            return super(CachingAdapter, self).send(request, **kwargs)
+
+        key = cache_key(request)
+        kept = cache.get(key)
+        if kept is not None:
+            status, headers, content, expires = kept
+            if time.time() < expires:
+                cache.hits += 1
+                return build_response(request, status, headers, content)
+
+            headers = CaseInsensitiveDict(headers)
+            if 'ETag' in headers:
+                request.headers['If-None-Match'] = headers['ETag']
+            if 'Last-Modified' in headers:
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+
+        response = super(CachingAdapter, self).send(request, **kwargs)
+
+        if kept is not None and response.status_code == 304:
+            response.close()
+            cache.revalidated += 1
+            headers = cache.refresh(key, response.headers) or kept[1]
+            return build_response(request, kept[0], headers, kept[2])
+
+        cache.misses += 1
+        if cacheable(response):
+            cache.put(key, request.url, response.status_code, response.headers, response.content)
+        return response
+
+
+def add_arguments(parser):
+    """
+    Add the HTTP cache options to an argparse parser
+    """
+    parser.add_argument(
+        '--http-cache',
+        dest='http_cache',
+        help='Keep the responses of the API in this SQLite file, and ask the '
+             'API only whether they have changed [default: ADS_HTTP_CACHE or None]',
+        default=os.getenv('ADS_HTTP_CACHE'),
+        type=str
+    )
+    parser.add_argument(
+        '--http-cache-size',
+        dest='http_cache_size',
+        help='MB of responses kept in the HTTP cache [default: {}]'.format(DEFAULT_MAX_SIZE),
+        default=DEFAULT_MAX_SIZE,
+        type=float
+    )
+
+
+def from_args(args):
+    """
+    :return: context manager using the cache given by the command line
+        options inside the block, if any, see use_cache
+    """
+    if not getattr(args, 'http_cache', None):
+        return use_cache(get_cache())
+    return use_cache(HttpCache(args.http_cache, max_size=int(args.http_cache_size*1024*1024)))
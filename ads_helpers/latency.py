@@ -0,0 +1,357 @@
+"""
+Keep the slowest requests of a report from setting how long it takes. Every
+request the examples make goes through HedgingAdapter (see http.py), which
+
+  - times each request, per end point, and once a request has taken longer
+    than the 95th percentile of those before it, sends the same request
+    again (a hedge); whichever response comes back first is used
+  - gives up on a request after a deadline (--request-timeout)
+
+A report can also be given a budget (--budget, in seconds). Parts of a report
+that are not needed (e.g., the read rank panel) check it before they start,
+and are left out if what is left of the budget is less than they are expected
+to take:
+
+    with latency.report_budget(10):
+        ...
+        if latency.allows('read rank', cost=seconds):
+            ...
+
+Only requests that do not change anything are hedged (GET, and the searches
+and metrics that are POSTed), and no more than HEDGE_RATIO of the requests, so
+a slow API is not made slower by twice the requests.
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import numpy
+import requests
+
+# Number of the latest requests to each end point that are timed, and how many
+# are needed before the percentile is trusted
+WINDOW = 200
+MIN_SAMPLES = 10
+
+# Percentile of the latency after which a request is hedged
+HEDGE_QUANTILE = 95
+
+# Largest fraction of the requests that are hedged, on top of the first few
+HEDGE_RATIO = 0.1
+HEDGE_BURST = 2
+
+# End points that are POSTed to without changing anything
+READ_ONLY_POSTS = ('search/bigquery', 'metrics')
+
+# Number of requests in flight at once, hedges included
+MAX_WORKERS = 32
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+
+class LatencyStats(object):
+    """
+    The latest latencies of each end point
+    """
+    def __init__(self, window=WINDOW, min_samples=MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, q=HEDGE_QUANTILE):
+        """
+        :return: the q-th percentile of the latency of the end point, in
+            seconds, or None if too few of its requests have been timed
+        """
+        with self._lock:
+            latencies = list(self._latencies.get(key, []))
+        if len(latencies) < self.min_samples:
+            return None
+        return float(numpy.percentile(latencies, q))
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def take_hedge(self, ratio=HEDGE_RATIO, burst=HEDGE_BURST):
+        """
+        :return: whether another request can be hedged
+        """
+        with self._lock:
+            if self.hedges + 1 > ratio * self.requests + burst:
+                return False
+            self.hedges += 1
+            return True
+
+    def count_hedge_won(self):
+        with self._lock:
+            self.hedges_won += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedges_won': self.hedges_won,
+            }
+
+
+class Budget(object):
+    """
+    The time a report is allowed to take
+
+    :param seconds: length of the budget
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start = time.time()
+        self.skipped = []
+
+    def remaining(self):
+        return self.seconds - (time.time() - self.start)
+
+    def allows(self, name, cost=0):
+        """
+        :param name: part of the report, printed if it is left out
+        :param cost: seconds it is expected to take
+
+        :return: whether what is left of the budget covers it
+        """
+        if self.remaining() >= cost:
+            return True
+        self.skipped.append(name)
+        print('Leaving out the {} to keep within the budget of {} s'.format(name, self.seconds))
+        return False
+
+
+stats = LatencyStats()
+
+# Set from the command line options, see configure
+_options = {
+    'hedge': True,
+    'hedge_after': None,
+    'request_timeout': None,
+}
+# The budget of the report made by each thread (e.g., of the server)
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def configure(hedge=True, hedge_after=None, request_timeout=None):
+    """
+    :param hedge: whether slow requests are hedged
+    :param hedge_after: seconds after which a request is hedged while too
+        few requests to its end point have been timed to know its percentile
+    :param request_timeout: seconds after which a request is given up on
+    """
+    _options.update(hedge=hedge, hedge_after=hedge_after, request_timeout=request_timeout)
+
+
+def get_budget():
+    return getattr(_local, 'budget', None)
+
+
+@contextmanager
+def report_budget(seconds=None):
+    """
+    Give the report made inside the block, by this thread, a budget (no
+    budget if None)
+    """
+    previous = get_budget()
+    _local.budget = Budget(seconds) if seconds else None
+    try:
+        yield _local.budget
+    finally:
+        _local.budget = previous
+
+
+@contextmanager
+def report_options(hedge=True, hedge_after=None, request_timeout=None, budget=None):
+    """
+    Configure the requests (see configure) and give the report a budget (see
+    report_budget) inside the block, and put the options back as they were
+    after it
+    """
+    previous = dict(_options)
+    configure(hedge=hedge, hedge_after=hedge_after, request_timeout=request_timeout)
+    try:
+        with report_budget(budget) as report:
+            yield report
+    finally:
+        _options.update(previous)
+
+
+def allows(name, cost=0):
+    """
+    Whether an optional part of the report fits in its budget, see
+    Budget.allows. Without a budget, everything does.
+    """
+    budget = get_budget()
+    if budget is None:
+        return True
+    return budget.allows(name, cost=cost)
+
+
+def endpoint(request):
+    """
+    :return: what requests are timed by: method, path
+    """
+    return request.method, urlparse(request.url).path.rstrip('/')
+
+
+def can_hedge(request):
+    if request.method in ('GET', 'HEAD'):
+        return True
+    return request.method == 'POST' and endpoint(request)[1].endswith(READ_ONLY_POSTS)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class HedgingAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter that times requests, hedges the slow ones and gives up
+    on them after the deadline (see the module docstring)
+    """
+    def send(self, request, **kwargs):
+        key = endpoint(request)
+        stats.count_request()
+
+        deadline = _options['request_timeout']
+        if deadline is not None and kwargs.get('timeout') is None:
+            kwargs['timeout'] = deadline
+
+        delay = None
+        if _options['hedge'] and can_hedge(request):
+            delay = stats.percentile(key)
+            if delay is None:
+                delay = _options['hedge_after']
+
+        if delay is None and deadline is None:
+            start = time.time()
+            response = super(HedgingAdapter, self).send(request, **kwargs)
+            stats.record(key, time.time() - start)
+            return response
+
+        def attempt(prepared):
+            start = time.time()
+            response = super(HedgingAdapter, self).send(prepared, **kwargs)
+            stats.record(key, time.time() - start)
+            return response
+
+        start = time.time()
+        executor = get_executor()
+        primary = executor.submit(attempt, request)
+        pending = {primary}
+
+        def time_left():
+            return None if deadline is None else deadline - (time.time() - start)
+
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay if deadline is None else min(delay, deadline))
+            if not done and (deadline is None or time_left() > 0) and stats.take_hedge():
+                pending.add(executor.submit(attempt, request.copy()))
+
+        # The first response wins, unless it is an error and another request
+        # is still on its way
+        error = None
+        while pending:
+            timeout = time_left()
+            if timeout is not None and timeout <= 0:
+                break
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        stats.count_hedge_won()
+                    for other in pending:
+                        other.add_done_callback(close_response)
+                    return future.result()
+                error = future.exception()
+
+        for other in pending:
+            other.add_done_callback(close_response)
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded('No response from {} {} within {} s'.format(key[0], key[1], deadline))
+
+
+def add_arguments(parser, budget=True):
+    """
+    Add the latency options to an argparse parser
+
+    :param budget: whether to add --budget, only for examples that have parts
+        to leave out (see allows)
+    """
+    if budget:
+        parser.add_argument(
+            '--budget',
+            dest='budget',
+            help='Seconds the report should take, parts of it that are not '
+                 'needed are left out when it would take longer [default: None]',
+            default=None,
+            type=float
+        )
+    parser.add_argument(
+        '--request-timeout',
+        dest='request_timeout',
+        help='Seconds after which a request is given up on [default: None]',
+        default=None,
+        type=float
+    )
+    parser.add_argument(
+        '--hedge-after',
+        dest='hedge_after',
+        help='Seconds after which a request is sent again, until enough '
+             'requests have been timed to use the {}th percentile of their '
+             'latency [default: None]'.format(HEDGE_QUANTILE),
+        default=None,
+        type=float
+    )
+    parser.add_argument(
+        '--no-hedge',
+        dest='hedge',
+        help='Never send a slow request again',
+        action='store_false',
+        default=True
+    )
+
+
+def from_args(args):
+    """
+    :return: context manager configuring the requests from the options, and
+        giving the report its budget, see report_options
+    """
+    return report_options(
+        hedge=getattr(args, 'hedge', True),
+        hedge_after=getattr(args, 'hedge_after', None),
+        request_timeout=getattr(args, 'request_timeout', None),
+        budget=getattr(args, 'budget', None)
+    )
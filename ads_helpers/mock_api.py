@@ -0,0 +1,616 @@
+"""
+A stand-in for the parts of the ADS API that the examples use, so they can be
+tested and benchmarked without a network connection (or an API quota):
+
+    GET  /v1/search/query             documents (rows, start, sort, fl,
+                                      cursorMark), facet pivots and JSON
+                                      facets, or the documents of a list
+                                      of bibcodes (q=bibcode:(... OR ...)),
+                                      and indexstamp:[<date> TO *] for the
+                                      papers indexed since a date
+    POST /v1/search/bigquery          the same, within a list of bibcodes
+    POST /v1/metrics                  metrics of a list of bibcodes
+    GET  /v1/biblib/libraries         the user's libraries
+    GET  /v1/biblib/libraries/<id>    a page of the documents of a library
+
+Responses are made up (see synthetic.py): every query gets its own set of
+--papers papers, which is the same every time the query is made. Recorded
+responses can be served instead, by putting them in a --fixtures folder as
+JSON files of the form
+
+    {
+        "request": {"method": "GET", "path": "/v1/search/query",
+                    "params": {"q": ["star"], "rows": ["10"]}},
+        "response": {"status": 200, "headers": {}, "body": {...}}
+    }
+
+The server can be made to behave like a busy one, with a latency (--latency,
+--jitter, and a slow tail with --slow-rate/--slow-latency), a rate limit with
+the same X-RateLimit-* headers as the API (--rate-limit), and errors
+(--error-rate).
+
+To run an example against it:
+
+    python ads_report.py mock-api --port 5000 &
+    export ADS_API_URL=http://127.0.0.1:5000/v1 ADS_DEV_KEY=anything
+    python ads_report.py facet --query star --save-to-file csv
+"""
+
+import os
+import re
+import json
+import time
+import calendar
+import random
+import zlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+import numpy
+
+from ads_helpers import synthetic
+
+
+class RateLimiter(object):
+    """
+    Allow limit requests in every window of seconds
+    """
+    def __init__(self, limit, window=86400):
+        self.limit = limit
+        self.window = window
+        self._reset = time.time() + window
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        :return: whether the request is allowed, and the X-RateLimit headers
+        """
+        with self._lock:
+            now = time.time()
+            if now >= self._reset:
+                self._reset = now + self.window
+                self._used = 0
+            allowed = self._used < self.limit
+            if allowed:
+                self._used += 1
+            headers = {
+                'X-RateLimit-Limit': str(self.limit),
+                'X-RateLimit-Remaining': str(self.limit - self._used),
+                'X-RateLimit-Reset': str(int(self._reset)),
+            }
+        return allowed, headers
+
+
+# Papers indexed since a date, as asked for by an incremental refresh
+INDEXSTAMP = re.compile(r'^\((?P<query>.*)\) AND indexstamp:\["?(?P<since>[^"\s]+)"? TO \*\]$')
+
+# Several ORCiD iDs searched at once, orcid:(A OR B OR ...)
+ORCIDS = re.compile(r'^orcid:\((?P<orcids>[^()]+)\)$')
+
+
+def fixture_key(method, path, params):
+    """
+    :param params: {name: [values]}
+    """
+    return (
+        method.upper(),
+        path.rstrip('/'),
+        tuple(sorted((k, tuple(v)) for k, v in params.items()))
+    )
+
+
+def load_fixtures(folder):
+    """
+    Load the recorded responses in a folder, see the module documentation
+    """
+    fixtures = {}
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(folder, name)) as f:
+            fixture = json.load(f)
+        request = fixture['request']
+        params = dict(
+            (k, v if isinstance(v, list) else [v])
+            for k, v in request.get('params', {}).items()
+        )
+        fixtures[fixture_key(request.get('method', 'GET'), request['path'], params)] = \
+            fixture['response']
+    return fixtures
+
+
+def sort_order(corpus, sort):
+    """
+    Order of the papers for a Solr sort, e.g., 'citation_count desc', or
+    'random_<seed> asc' for a random order that is the same for a seed
+    """
+    field, _, direction = (sort or 'score desc').split(',')[0].strip().partition(' ')
+    if field.startswith('random_'):
+        seed = zlib.crc32(field.encode('utf-8'))
+        order = numpy.random.RandomState(seed).permutation(corpus.n)
+        return order[::-1] if direction.strip() == 'desc' else order
+    values = {
+        'citation_count': corpus.citation_count,
+        'read_count': corpus.read_count,
+        'date': corpus.year,
+        'year': corpus.year,
+    }.get(field)
+    if values is None:
+        return numpy.arange(corpus.n)
+    if direction.strip() == 'desc':
+        return numpy.argsort(-values.astype(numpy.int64), kind='stable')
+    return numpy.argsort(values, kind='stable')
+
+
+def split_indexstamp(q):
+    """
+    Split '(<query>) AND indexstamp:["<date>" TO *]' into the query and the
+    time (in seconds) of the date, which is None for other queries
+    """
+    match = INDEXSTAMP.match(q)
+    if match is None:
+        return q, None
+    since = datetime.strptime(match.group('since'), '%Y-%m-%dT%H:%M:%SZ')
+    return match.group('query'), calendar.timegm(since.timetuple())
+
+
+def search_docs_by_bibcode(corpus, index, fl):
+    """
+    Documents of some papers of a corpus, keyed by bibcode
+    """
+    bibcodes = corpus.bibcodes(index).tolist()
+    docs = synthetic.search_docs(corpus, index, sorted(set(fl) | {'bibcode'}))
+    for doc in docs:
+        if 'bibcode' not in fl:
+            doc.pop('bibcode')
+    return dict(zip(bibcodes, docs))
+
+
+class MockAPI(object):
+    """
+    Answers the requests made to the stand-in server
+    """
+    def __init__(self, papers=500, libraries=5, library_size=200, seed=0, fixtures=None,
+                 latency=0, jitter=0, slow_rate=0, slow_latency=0,
+                 error_rate=0, error_status=503, rate_limit=5000):
+        self.papers = papers
+        self.seed = seed
+        self.fixtures = load_fixtures(fixtures) if fixtures else {}
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limiter = RateLimiter(rate_limit)
+        # Either the largest number of documents, or (smallest, largest)
+        if not isinstance(library_size, tuple):
+            library_size = (0, library_size)
+        self.libraries = synthetic.libraries(libraries, seed=seed, documents=library_size)
+
+        # Papers were last indexed some days before the server started
+        self.started = time.time()
+        self._corpora = OrderedDict()
+        self._library_corpora = {}
+        self._lock = threading.Lock()
+
+    def corpus(self, q):
+        """
+        The papers found by a query, the same every time it is asked. Those of
+        several ORCiD iDs are the papers of each of them together.
+        """
+        match = ORCIDS.match(q)
+        if match:
+            return synthetic.UnionCorpus(OrderedDict(
+                ('orcid:{}'.format(orcid), self.corpus('orcid:{}'.format(orcid)))
+                for orcid in match.group('orcids').split(' OR ')
+            ))
+
+        with self._lock:
+            if q not in self._corpora:
+                self._corpora[q] = synthetic.Corpus(
+                    self.papers, seed=synthetic.seed_for(q, self.seed)
+                )
+                while len(self._corpora) > 16:
+                    self._corpora.popitem(last=False)
+            return self._corpora[q]
+
+    def wait(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.slow_rate and random.random() < self.slow_rate:
+            delay += self.slow_latency
+        if delay > 0:
+            time.sleep(delay / 1000.)
+
+    def handle(self, method, path, params, body):
+        """
+        :param method: GET or POST
+        :param path: path of the request
+        :param params: {name: [values]} from the query string
+        :param body: body of the request
+
+        :return: status, headers, body
+        """
+        self.wait()
+
+        allowed, headers = self.rate_limiter.acquire()
+        if not allowed:
+            return 429, headers, {'error': 'Too many requests'}
+
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, headers, {'error': 'Injected error'}
+
+        key = fixture_key(method, path, params)
+        if key in self.fixtures:
+            fixture = self.fixtures[key]
+            headers.update(fixture.get('headers', {}))
+            return fixture.get('status', 200), headers, fixture['body']
+
+        path = path.rstrip('/')
+        try:
+            if method == 'GET' and path == '/v1/search/query':
+                return 200, headers, self.search(params)
+            if method == 'POST' and path == '/v1/search/bigquery':
+                return 200, headers, self.bigquery(params, body)
+            if method == 'POST' and path == '/v1/metrics':
+                return 200, headers, self.metrics(json.loads(body or b'{}'))
+            if method == 'GET' and path == '/v1/biblib/libraries':
+                return 200, headers, {'libraries': self.libraries}
+            if method == 'GET' and path.startswith('/v1/biblib/libraries/'):
+                return self.library(path.split('/')[-1], params, headers)
+        except (KeyError, ValueError) as error:
+            return 400, headers, {'error': 'Bad request: {}'.format(error)}
+
+        return 404, headers, {'error': 'Not found: {} {}'.format(method, path)}
+
+    def search(self, params, corpus=None):
+        first = lambda name, default=None: params.get(name, [default])[0]
+
+        q = first('q')
+        if not q:
+            raise ValueError('no q given')
+        if corpus is None and q.startswith('bibcode:'):
+            return self.search_bibcodes(q, params)
+        q, since = split_indexstamp(q)
+        if corpus is None:
+            corpus = self.corpus(q)
+
+        rows = int(first('rows', 10))
+        fl = first('fl', 'id').split(',')
+        order = sort_order(corpus, first('sort'))
+        if since is not None:
+            indexed = self.started - corpus.indexed_days_ago * 86400.
+            order = order[indexed[order] >= since]
+
+        cursor = first('cursorMark')
+        start = int(first('start', 0)) if cursor is None else (0 if cursor == '*' else int(cursor))
+        index = order[start:start + rows]
+
+        response = {
+            'responseHeader': {
+                'status': 0,
+                'QTime': 1,
+                'params': dict((k, v[0]) for k, v in params.items()),
+            },
+            'response': {
+                'numFound': len(order),
+                'start': start,
+                'docs': synthetic.search_docs(corpus, index, fl),
+            },
+        }
+        if cursor is not None:
+            response['nextCursorMark'] = str(start + len(index)) if len(index) else cursor
+
+        if 'json.facet' in params:
+            response['facets'] = synthetic.json_facet(corpus, json.loads(first('json.facet')))
+
+        if first('facet') == 'true' and 'facet.pivot' in params:
+            facet_pivot = {}
+            for pivot in params['facet.pivot']:
+                fields = pivot.split(',')
+                options = {}
+                for field in fields:
+                    option = options[field] = {}
+                    for name in ['limit', 'offset', 'sort', 'mincount']:
+                        value = first(
+                            'f.{}.facet.{}'.format(field, name),
+                            first('facet.{}'.format(name))
+                        )
+                        if value is not None:
+                            option[name] = value
+                facet_pivot[pivot] = synthetic.facet_pivot(corpus, fields, options=options)
+            response['facet_counts'] = {
+                'facet_queries': {},
+                'facet_fields': {},
+                'facet_ranges': {},
+                'facet_intervals': {},
+                'facet_heatmaps': {},
+                'facet_pivot': facet_pivot,
+            }
+
+        return response
+
+    def bigquery(self, params, body):
+        """
+        Search within the bibcodes in the body (a line each, after a header
+        line), which get their own made up papers, the same for the same list
+        """
+        lines = (body or b'').decode('utf-8').split('\n')
+        bibcodes = [line.strip() for line in lines[1:] if line.strip()]
+        corpus = synthetic.ListedCorpus(
+            bibcodes, seed=synthetic.seed_for(','.join(bibcodes), self.seed)
+        )
+        return self.search(params, corpus=corpus)
+
+    def search_bibcodes(self, q, params):
+        """
+        Documents of a list of bibcodes, bibcode:("..." OR "..."), looked up in
+        the papers of the queries that were made before
+        """
+        first = lambda name, default=None: params.get(name, [default])[0]
+        fl = first('fl', 'id').split(',')
+        wanted = [b for b in re.findall(r'[^\s"()]+', q[len('bibcode:'):]) if b != 'OR']
+
+        with self._lock:
+            corpora = list(self._corpora.values())[::-1]
+
+        docs = {}
+        for corpus in corpora:
+            missing = [b for b in wanted if b not in docs]
+            index = corpus.find(missing)
+            if index.size == 0:
+                continue
+            found = search_docs_by_bibcode(corpus, index, fl)
+            for bibcode, doc in found.items():
+                if bibcode in missing:
+                    docs[bibcode] = doc
+
+        start = int(first('start', 0))
+        rows = int(first('rows', 10))
+        result = [docs[b] for b in wanted if b in docs]
+        return {
+            'responseHeader': {
+                'status': 0,
+                'QTime': 1,
+                'params': dict((k, v[0]) for k, v in params.items()),
+            },
+            'response': {
+                'numFound': len(result),
+                'start': start,
+                'docs': result[start:start + rows],
+            },
+        }
+
+    def metrics(self, data):
+        bibcodes = data['bibcodes']
+        corpus = synthetic.Corpus(
+            len(bibcodes), seed=synthetic.seed_for(','.join(sorted(bibcodes)), self.seed)
+        )
+        return synthetic.metrics(corpus)
+
+    def library(self, library_id, params, headers):
+        for library in self.libraries:
+            if library['id'] == library_id:
+                with self._lock:
+                    if library_id not in self._library_corpora:
+                        self._library_corpora[library_id] = synthetic.library_corpus(library)
+                return 200, headers, synthetic.library_page(
+                    library,
+                    start=int(params.get('start', [0])[0]),
+                    rows=int(params.get('rows', [20])[0]),
+                    corpus=self._library_corpora[library_id]
+                )
+        return 404, headers, {'error': 'Library does not exist: {}'.format(library_id)}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    def respond(self, method):
+        url = urlparse(self.path)
+        params = {}
+        for key, value in parse_qsl(url.query, keep_blank_values=True):
+            params.setdefault(key, []).append(value)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        status, headers, data = self.server.api.handle(method, url.path, params, body)
+        payload = json.dumps(data).encode('utf-8')
+
+        # Made up papers are the same every time, so the API can be asked
+        # whether they changed (If-None-Match), but must always be asked
+        if method == 'GET' and status == 200:
+            etag = '"{:08x}"'.format(zlib.crc32(payload))
+            headers['ETag'] = etag
+            headers['Cache-Control'] = 'private, no-cache'
+            if self.headers.get('If-None-Match') == etag:
+                status, payload = 304, b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    verbose = False
+
+
+def make_server(api, host='127.0.0.1', port=5000, verbose=False):
+    """
+    Create the server, use port 0 for any free port (see server_address)
+    """
+    server = MockServer((host, port), MockHandler)
+    server.api = api
+    server.verbose = verbose
+    return server
+
+
+def start_server(api, host='127.0.0.1', port=0):
+    """
+    Start the server in a background thread, e.g., for a benchmark
+
+    :return: server, URL of the API to give to the examples (ADS_API_URL)
+    """
+    server = make_server(api, host=host, port=port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://{}:{}/v1'.format(*server.server_address[:2])
+
+
+def add_arguments(parser):
+    """
+    Add the command line options of the stand-in server to an argparse parser
+    """
+    parser.add_argument(
+        '--host',
+        dest='host',
+        help='Interface to listen on [default: 127.0.0.1]',
+        default='127.0.0.1',
+        type=str
+    )
+    parser.add_argument(
+        '--port',
+        dest='port',
+        help='Port to listen on [default: 5000]',
+        default=5000,
+        type=int
+    )
+    parser.add_argument(
+        '--papers',
+        dest='papers',
+        help='Number of papers found by every query [default: 500]',
+        default=500,
+        type=int
+    )
+    parser.add_argument(
+        '--libraries',
+        dest='libraries',
+        help='Number of libraries the user has [default: 5]',
+        default=5,
+        type=int
+    )
+    parser.add_argument(
+        '--library-size',
+        dest='library_size',
+        help='Largest number of documents in a library [default: 200]',
+        default=200,
+        type=int
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        help='Random seed of the made up papers [default: 0]',
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        '--fixtures',
+        dest='fixtures',
+        help='Folder of recorded responses to serve [default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--latency',
+        dest='latency',
+        help='Milliseconds to wait before every response [default: 0]',
+        default=0,
+        type=float
+    )
+    parser.add_argument(
+        '--jitter',
+        dest='jitter',
+        help='Up to this many extra milliseconds, at random [default: 0]',
+        default=0,
+        type=float
+    )
+    parser.add_argument(
+        '--slow-rate',
+        dest='slow_rate',
+        help='Fraction of the responses that are slow [default: 0]',
+        default=0,
+        type=float
+    )
+    parser.add_argument(
+        '--slow-latency',
+        dest='slow_latency',
+        help='Extra milliseconds for a slow response [default: 0]',
+        default=0,
+        type=float
+    )
+    parser.add_argument(
+        '--error-rate',
+        dest='error_rate',
+        help='Fraction of the requests that fail [default: 0]',
+        default=0,
+        type=float
+    )
+    parser.add_argument(
+        '--error-status',
+        dest='error_status',
+        help='HTTP status of a failed request [default: 503]',
+        default=503,
+        type=int
+    )
+    parser.add_argument(
+        '--rate-limit',
+        dest='rate_limit',
+        help='Requests allowed per day [default: 5000]',
+        default=5000,
+        type=int
+    )
+    parser.add_argument(
+        '--verbose',
+        dest='verbose',
+        help='Log every request',
+        action='store_true',
+        default=False
+    )
+
+
+def run(args, parser):
+    """
+    Run the stand-in server until it is interrupted
+    """
+    api = MockAPI(
+        papers=args.papers,
+        libraries=args.libraries,
+        library_size=args.library_size,
+        seed=args.seed,
+        fixtures=args.fixtures,
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        rate_limit=args.rate_limit
+    )
+    server = make_server(api, host=args.host, port=args.port, verbose=args.verbose)
+    print('Stand-in ADS API on http://{}:{}/v1'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
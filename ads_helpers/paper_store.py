@@ -0,0 +1,160 @@
+"""
+Keep the papers of a search as one NumPy file per column, so that they can be
+plotted or exported again without a request to the API:
+
+    <folder>/bibcode.npy         fixed width bytes
+    <folder>/year.npy            int16
+    <folder>/refereed.npy        bool
+    <folder>/citation_count.npy  int32
+    <folder>/read_count.npy      int32
+    <folder>/manifest.json       query, number of papers found, when it was saved
+
+The files are opened memory-mapped, so reopening even millions of papers
+takes no time and no memory until the columns are used.
+
+    paper_store.save_columns('star', columns, query='star', num_found=5000000)
+    columns, manifest = paper_store.load_columns('star')
+"""
+
+import os
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy
+
+STORE_VERSION = 1
+
+# Column: dtype of its file
+COLUMNS = OrderedDict([
+    ('bibcode', 'S'),
+    ('year', numpy.int16),
+    ('refereed', numpy.bool_),
+    ('citation_count', numpy.int32),
+    ('read_count', numpy.int32),
+])
+
+
+class StoreException(Exception):
+    pass
+
+
+def papers_to_columns(papers):
+    """
+    Columns of the papers returned by a search
+
+    :param papers: list of ads.Article (or anything with the same attributes)
+
+    :return: OrderedDict of column: numpy array
+    """
+    bibcode, year, refereed, citation_count, read_count = [], [], [], [], []
+    for article in papers:
+        bibcode.append(article.bibcode)
+        if article.year is None:
+            year.append(article.pubdate.split('-')[0])
+        else:
+            year.append(article.year)
+        refereed.append('REFEREED' in (article.property or []))
+        citation_count.append(article.citation_count or 0)
+        read_count.append(article.read_count or 0)
+
+    return OrderedDict([
+        ('bibcode', numpy.array(bibcode, dtype='S')),
+        ('year', numpy.array(year, dtype=numpy.int16)),
+        ('refereed', numpy.array(refereed, dtype=numpy.bool_)),
+        ('citation_count', numpy.array(citation_count, dtype=numpy.int32)),
+        ('read_count', numpy.array(read_count, dtype=numpy.int32)),
+    ])
+
+
+def merge_columns(columns, changes):
+    """
+    Update the stored papers with the papers that changed since, adding the
+    ones that are new. The papers stay ordered by citations, most first.
+
+    :param columns: columns of the stored papers
+    :param changes: columns of the papers that changed
+
+    :return: merged columns, number of papers updated, number added
+    """
+    bibcode = columns['bibcode']
+    new_bibcode = changes['bibcode']
+
+    # Row of each changed paper in the stored ones, if it is there
+    order = numpy.argsort(bibcode, kind='stable')
+    position = numpy.searchsorted(bibcode, new_bibcode, sorter=order)
+    position = numpy.minimum(position, max(bibcode.size - 1, 0))
+    if bibcode.size:
+        found = bibcode[order[position]] == new_bibcode
+    else:
+        found = numpy.zeros(new_bibcode.size, dtype=bool)
+    rows = order[position[found]]
+
+    # Concatenate first, so a longer bibcode widens the column
+    merged = OrderedDict()
+    for name in COLUMNS:
+        column = numpy.concatenate([numpy.asarray(columns[name]), changes[name][~found]])
+        column[rows] = changes[name][found]
+        merged[name] = column
+
+    by_citations = numpy.argsort(-merged['citation_count'].astype(numpy.int64), kind='stable')
+    for name in merged:
+        merged[name] = merged[name][by_citations]
+
+    return merged, int(found.sum()), int((~found).sum())
+
+
+def save_columns(folder, columns, **manifest):
+    """
+    Save columns (see papers_to_columns) to a folder, replacing what is there
+
+    :param folder: folder to save to, made if it does not exist
+    :param manifest: anything to keep with them, e.g., query and num_found
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    # The manifest goes last, so a half written store is never read
+    manifest_path = os.path.join(folder, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    for name, dtype in COLUMNS.items():
+        column = numpy.asarray(columns[name])
+        if dtype != 'S':
+            column = column.astype(dtype, copy=False)
+        numpy.save(os.path.join(folder, '{}.npy'.format(name)), column)
+
+    manifest = OrderedDict(manifest)
+    manifest['version'] = STORE_VERSION
+    manifest['papers'] = int(len(columns['bibcode']))
+    manifest['saved'] = datetime.utcnow().isoformat()
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_columns(folder, mmap_mode='r'):
+    """
+    Open the columns saved in a folder, memory-mapped
+
+    :param folder: folder given to save_columns
+    :param mmap_mode: see numpy.load, None reads them into memory
+
+    :return: OrderedDict of column: numpy array, manifest
+    """
+    manifest_path = os.path.join(folder, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        raise StoreException('No papers are stored in: {}'.format(folder))
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != STORE_VERSION:
+        raise StoreException('Cannot read version {} of the store in: {}'.format(
+            manifest.get('version'), folder
+        ))
+
+    columns = OrderedDict(
+        (name, numpy.load(os.path.join(folder, '{}.npy'.format(name)), mmap_mode=mmap_mode))
+        for name in COLUMNS
+    )
+    return columns, manifest
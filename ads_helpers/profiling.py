@@ -0,0 +1,266 @@
+"""
+Record where the time goes when a report is made. The examples mark their
+stages (query, fetch, decode, parse, plot, savefig, csv, latex) with
+
+    with profiling.stage('fetch'):
+        r = session.get(...)
+
+which costs nothing unless a Profiler has been installed, either with the
+--profile/--profile-dir options of the examples, or from Python:
+
+    profiler = profiling.Profiler()
+    profiling.set_profiler(profiler)
+    plot_search.main(...)
+    print(profiler.trace())
+
+For every stage, the wall time, CPU time, bytes received from the API and the
+peak memory allocated by Python are recorded, and written out as a JSON trace.
+If a folder is given, each stage is also run under cProfile and its stats are
+dumped to <folder>/<number>_<stage>.prof (e.g., for snakeviz or pstats).
+Tracing memory slows Python down, so only use it to find the slow stages.
+"""
+
+import os
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+class NullProfiler(object):
+    """
+    Used when nothing is being profiled
+    """
+    @contextmanager
+    def stage(self, name):
+        yield None
+
+    def add_bytes(self, n):
+        pass
+
+
+class Profiler(object):
+    """
+    Records each stage of a report
+    """
+    def __init__(self, cprofile_dir=None, trace_memory=True):
+        self.cprofile_dir = cprofile_dir
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.unassigned_bytes = 0
+        self._open = []
+        self._cprofile = None
+        self._lock = threading.RLock()
+        self._start = time.time()
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        record = {
+            'stage': name,
+            'start': time.time() - self._start,
+            'bytes': 0,
+        }
+
+        with self._lock:
+            if self.trace_memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracing = True
+                # Keep the peak of the stages that are still open before it
+                # is reset for this one
+                peak = tracemalloc.get_traced_memory()[1]
+                for parent in self._open:
+                    parent['_peak'] = max(parent['_peak'], peak)
+                tracemalloc.reset_peak()
+                record['_base'] = tracemalloc.get_traced_memory()[0]
+                record['_peak'] = 0
+            self._open.append(record)
+
+            # Only one cProfile can run at a time, so nested stages are
+            # included in the stage they are inside of
+            profile = None
+            if self.cprofile_dir and self._cprofile is None:
+                profile = self._cprofile = cProfile.Profile()
+
+        wall, cpu = time.time(), time.process_time()
+        if profile:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile:
+                profile.disable()
+            record['wall'] = time.time() - wall
+            record['cpu'] = time.process_time() - cpu
+
+            with self._lock:
+                self._open.remove(record)
+                if self.trace_memory:
+                    peak = max(tracemalloc.get_traced_memory()[1], record.pop('_peak'))
+                    record['peak_memory'] = peak - record.pop('_base')
+                    for parent in self._open:
+                        parent['_peak'] = max(parent['_peak'], peak)
+
+                self.stages.append(record)
+
+                if profile:
+                    self._cprofile = None
+                    if not os.path.isdir(self.cprofile_dir):
+                        os.makedirs(self.cprofile_dir)
+                    profile.dump_stats(os.path.join(
+                        self.cprofile_dir,
+                        '{:03d}_{}.prof'.format(len(self.stages), name)
+                    ))
+
+    def add_bytes(self, n):
+        """
+        Add the bytes received from the API to the stage that received them
+        """
+        with self._lock:
+            if self._open:
+                self._open[-1]['bytes'] += n
+            else:
+                self.unassigned_bytes += n
+
+    def trace(self):
+        """
+        :return: every stage in the order they finished, plus the totals for
+            each kind of stage
+        """
+        with self._lock:
+            totals = {}
+            for record in self.stages:
+                total = totals.setdefault(
+                    record['stage'],
+                    {'count': 0, 'wall': 0., 'cpu': 0., 'bytes': 0, 'peak_memory': 0}
+                )
+                total['count'] += 1
+                total['wall'] += record['wall']
+                total['cpu'] += record['cpu']
+                total['bytes'] += record['bytes']
+                total['peak_memory'] = max(total['peak_memory'], record.get('peak_memory', 0))
+
+            return {
+                'wall': time.time() - self._start,
+                'stages': list(self.stages),
+                'totals': totals,
+                'unassigned_bytes': self.unassigned_bytes,
+            }
+
+    def close(self):
+        """
+        Stop tracing memory, if it was started by this profiler
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def dump(self, path):
+        """
+        Write the trace to a JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f, indent=2)
+
+
+_profiler = NullProfiler()
+
+
+def get_profiler():
+    return _profiler
+
+
+def set_profiler(profiler):
+    """
+    Install a profiler for every stage that follows (None to stop profiling)
+
+    :return: the profiler that was installed before
+    """
+    global _profiler
+    previous = _profiler
+    _profiler = profiler if profiler is not None else NullProfiler()
+    return previous
+
+
+def stage(name):
+    """
+    Mark a stage of a report, see Profiler.stage
+    """
+    return _profiler.stage(name)
+
+
+def add_bytes(n):
+    _profiler.add_bytes(n)
+
+
+def count_response_bytes(response, *args, **kwargs):
+    """
+    requests response hook that counts the bytes received (none for the
+    responses answered from the HTTP cache). A response asked for as a stream
+    is not read here, as that would stop it being parsed as it is downloaded:
+    its Content-Length is counted or, without one, what was read once it has
+    been parsed (see count_stream_bytes).
+    """
+    if isinstance(_profiler, NullProfiler) or getattr(response, 'from_cache', False):
+        return
+    if kwargs.get('stream') and not getattr(response, '_content_consumed', True):
+        if 'Content-Length' in response.headers:
+            add_bytes(int(response.headers['Content-Length']))
+        return
+    add_bytes(len(response.content))
+
+
+def count_stream_bytes(response):
+    """
+    Count the bytes of a response that was streamed without a Content-Length,
+    once it has been read (see count_response_bytes)
+    """
+    if isinstance(_profiler, NullProfiler) or getattr(response, 'from_cache', False):
+        return
+    if 'Content-Length' not in response.headers and response.raw is not None:
+        add_bytes(response.raw.tell())
+
+
+@contextmanager
+def profile_to(trace_path=None, cprofile_dir=None):
+    """
+    Profile everything inside the block if a trace file or cProfile folder
+    is given, and write the trace out at the end
+    """
+    if not trace_path and not cprofile_dir:
+        yield None
+        return
+
+    profiler = Profiler(cprofile_dir=cprofile_dir)
+    previous = set_profiler(profiler)
+    try:
+        yield profiler
+    finally:
+        set_profiler(previous)
+        profiler.close()
+        if trace_path:
+            profiler.dump(trace_path)
+            print('Output profile trace: {}'.format(trace_path))
+
+
+def add_arguments(parser):
+    """
+    Add the profiling options to an argparse parser
+    """
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        help='Save a JSON trace of the time spent in each stage to this file [default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--profile-dir',
+        dest='profile_dir',
+        help='Save cProfile stats of each stage to this folder [default: None]',
+        default=None,
+        type=str
+    )
@@ -0,0 +1,405 @@
+"""
+Run the examples from a long-lived local process, rather than starting a new
+Python process for every report. The examples, matplotlib, the templates and
+the connections to the API are loaded once, and the reports that are made are
+kept in memory for a while, so a repeat visitor gets them straight away.
+
+Reports are served over HTTP on localhost, or on a Unix socket:
+
+    GET /health
+    GET /metrics?orcid=0000-0001-8043-4965           metrics JSON
+    GET /csv/<example>?orcid=0000-0001-8043-4965     zip of the CSV files
+    GET /figure/<example>?query=star&format=png      the figure
+
+where <example> is one of metrics, search, facet or library. The other
+parameters are passed on to the example as command line options, e.g.,
+?orcid=X&log=true is the same as `--orcid X --log`, and ?bibcodes=A&bibcodes=B
+is the same as `--bibcodes A B`. Only the options of REQUEST_OPTIONS can be
+given, as the others name files on the server.
+
+Requests are handled by a fixed pool of worker threads. matplotlib is not
+thread safe, so figures are made one at a time.
+"""
+
+import io
+import os
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+from ads_helpers import examples, http
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'zip': 'application/zip',
+    'png': 'image/png',
+    'pdf': 'application/pdf',
+    'ps': 'application/postscript',
+    'svg': 'image/svg+xml',
+}
+
+# Options of each example that can be given in a request. Any other option
+# (e.g., those naming files, or the token) cannot be, as it would let a
+# request read or write files on the server.
+REQUEST_OPTIONS = {
+    'metrics': ['orcid', 'query', 'bibcodes', 'description'],
+    'search': ['orcid', 'query', 'log', 'rows', 'max-pages', 'sample', 'seed', 'confidence'],
+    'facet': ['orcid', 'query', 'log', 'approximate', 'facet-page-size'],
+    'library': [],
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+class ResponseCache(object):
+    """
+    Reports that have already been made, kept for ttl seconds. When it holds
+    more than max_entries, the least recently used report is dropped.
+    """
+    def __init__(self, ttl=300, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def to_argv(name, params):
+    """
+    Turn the parameters of a request into command line options
+
+    :param name: name of the example, one of REQUEST_OPTIONS
+    :param params: (key, value) pairs from the query string
+    :type params: list
+
+    :return: list of str
+    """
+    if name not in REQUEST_OPTIONS:
+        raise BadRequest('Unknown example: {}'.format(name))
+
+    options = OrderedDict()
+    for key, value in params:
+        option = key.replace('_', '-')
+        if option not in REQUEST_OPTIONS[name]:
+            raise BadRequest('Option cannot be set in a request: {}'.format(key))
+        options.setdefault(option, []).append(value)
+
+    argv = []
+    for option, values in options.items():
+        argv.append('--{}'.format(option))
+        if values != ['true']:
+            argv.extend(values)
+    return argv
+
+
+class ReportService(object):
+    """
+    Makes the reports served by the server
+    """
+    def __init__(self, cache_ttl=300, cache_size=256):
+        self.cache = ResponseCache(ttl=cache_ttl, max_entries=cache_size)
+        self._plot_lock = threading.Lock()
+
+    def warm_up(self):
+        """
+        Import everything a report needs before the first request comes in
+        """
+        for name in examples.EXAMPLES:
+            examples.load(name)
+
+        plot_metrics = examples.load('metrics')
+        plot_metrics.get_pyplot()
+        plot_metrics.get_template('mymetrics.txt.template')
+        http.get_session()
+
+    def handle(self, path, params):
+        """
+        Make (or fetch from the cache) the report for a request
+
+        :param path: path of the request, e.g., /csv/facet
+        :param params: (key, value) pairs from the query string
+
+        :return: content type, body
+        """
+        parts = [i for i in path.split('/') if i]
+        if parts == ['health']:
+            return CONTENT_TYPES['json'], b'{"status": "ok"}'
+
+        key = (tuple(parts), tuple(sorted(params)))
+        response = self.cache.get(key)
+        if response is None:
+            if parts == ['metrics']:
+                response = self.metrics(params)
+            elif len(parts) == 2 and parts[0] == 'csv':
+                response = self.csv(parts[1], params)
+            elif len(parts) == 2 and parts[0] == 'figure':
+                response = self.figure(parts[1], params)
+            else:
+                raise BadRequest('Unknown report: {}'.format(path))
+            self.cache.put(key, response)
+        return response
+
+    def metrics(self, params):
+        values = {}
+        for key, value in params:
+            values.setdefault(key, []).append(value)
+        # get_metrics exits without any of them, which would drop the connection
+        if not any(values.get(key) for key in ['orcid', 'query', 'bibcodes']):
+            raise BadRequest('One of orcid, query or bibcodes is needed')
+
+        metrics = examples.load('metrics').get_metrics(
+            orcid=values.get('orcid', [False])[0],
+            query=values.get('query', [False])[0],
+            bibcodes=values.get('bibcodes', False)
+        )
+        return CONTENT_TYPES['json'], json.dumps(metrics).encode('utf-8')
+
+    def run_example(self, name, argv):
+        """
+        Run an example, with its output saved to a new temporary folder
+
+        :return: path to the folder, which the caller has to remove
+        """
+        if name not in examples.EXAMPLES:
+            raise BadRequest('Unknown example: {}'.format(name))
+
+        module = examples.load(name)
+        folder = tempfile.mkdtemp(prefix='ads-report-')
+        if name == 'library':
+            argv = argv + ['--save-to-file', os.path.join(folder, 'libraries.csv')]
+        else:
+            argv = argv + ['--output', folder]
+
+        # No abbreviations, so an option is only ever the one it names
+        parser = argparse.ArgumentParser(prog=name, allow_abbrev=False)
+        module.add_arguments(parser)
+        try:
+            module.run(parser.parse_args(argv), parser)
+        except SystemExit:
+            shutil.rmtree(folder, ignore_errors=True)
+            raise BadRequest('Not enough (or bad) options for {}: {}'.format(name, argv))
+        except Exception:
+            shutil.rmtree(folder, ignore_errors=True)
+            raise
+        return folder
+
+    def csv(self, name, params):
+        argv = to_argv(name, params)
+        if name != 'library':
+            argv += ['--save-to-file', 'csv']
+
+        folder = self.run_example(name, argv)
+        try:
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+                for f in sorted(os.listdir(folder)):
+                    if f.endswith('.csv') or f.endswith('.txt'):
+                        z.write(os.path.join(folder, f), f)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        return CONTENT_TYPES['zip'], buf.getvalue()
+
+    def figure(self, name, params):
+        params = list(params)
+        figure_format = dict(params).get('format', 'png')
+        params = [(k, v) for k, v in params if k != 'format']
+        if figure_format not in ['png', 'pdf', 'ps', 'svg']:
+            raise BadRequest('Unknown figure format: {}'.format(figure_format))
+        if name == 'library':
+            raise BadRequest('The library example does not make figures')
+
+        argv = to_argv(name, params) + ['--plot', '--format', figure_format]
+        with self._plot_lock:
+            folder = self.run_example(name, argv)
+        try:
+            figures = [
+                f for f in os.listdir(folder) if f.endswith('.{}'.format(figure_format))
+            ]
+            with open(os.path.join(folder, figures[0]), 'rb') as f:
+                body = f.read()
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        return CONTENT_TYPES[figure_format], body
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            content_type, body = self.server.service.handle(
+                url.path, parse_qsl(url.query)
+            )
+            status = 200
+        except BadRequest as error:
+            content_type, status = CONTENT_TYPES['json'], 400
+            body = json.dumps({'error': str(error)}).encode('utf-8')
+        except Exception as error:
+            content_type, status = CONTENT_TYPES['json'], 500
+            body = json.dumps({'error': repr(error)}).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix-socket'
+
+
+class PoolMixIn(object):
+    """
+    Like socketserver.ThreadingMixIn, but with a fixed number of threads
+    """
+    pool = None
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super(PoolMixIn, self).server_close()
+        self.pool.shutdown(wait=True)
+
+
+class ReportHTTPServer(PoolMixIn, HTTPServer):
+    pass
+
+
+class ReportUnixServer(PoolMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def make_server(service, host='127.0.0.1', port=8765, socket_path=None, workers=4):
+    """
+    Create the server, listening on a Unix socket if socket_path is given,
+    otherwise on host:port
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ReportUnixServer(socket_path, ReportHandler)
+    else:
+        server = ReportHTTPServer((host, port), ReportHandler)
+
+    server.pool = ThreadPoolExecutor(max_workers=workers)
+    server.service = service
+    return server
+
+
+def add_arguments(parser):
+    """
+    Add the command line options of the server to an argparse parser
+    """
+    parser.add_argument(
+        '--host',
+        dest='host',
+        help='Interface to listen on [default: 127.0.0.1]',
+        default='127.0.0.1',
+        type=str
+    )
+    parser.add_argument(
+        '--port',
+        dest='port',
+        help='Port to listen on [default: 8765]',
+        default=8765,
+        type=int
+    )
+    parser.add_argument(
+        '--socket',
+        dest='socket',
+        help='Listen on this Unix socket instead of a port [default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        help='Number of requests handled at the same time [default: 4]',
+        default=4,
+        type=int
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        dest='cache_ttl',
+        help='Seconds to keep a report for repeat requests [default: 300]',
+        default=300,
+        type=int
+    )
+    parser.add_argument(
+        '--cache-size',
+        dest='cache_size',
+        help='Number of reports kept for repeat requests [default: 256]',
+        default=256,
+        type=int
+    )
+
+
+def run(args, parser):
+    """
+    Run the server until it is interrupted
+    """
+    # There is no display to draw on
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    service = ReportService(cache_ttl=args.cache_ttl, cache_size=args.cache_size)
+    service.warm_up()
+
+    server = make_server(
+        service,
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+        workers=args.workers
+    )
+    print('Serving reports on {}'.format(
+        args.socket or 'http://{}:{}'.format(args.host, args.port)
+    ))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -0,0 +1,574 @@
+"""
+Generate synthetic ADS API payloads: search documents, facet pivots, metrics
+and libraries. They are made from a Corpus, a set of made-up papers stored as
+numpy columns, so they are quick to build for millions of papers, and the same
+seed always gives the same papers.
+
+These are used by the stand-in API server (mock_api.py) and the benchmarks,
+they are not meant to look like any real author.
+"""
+
+import re
+import zlib
+import numpy
+
+# Range of publication years of the made up papers
+FIRST_YEAR = 1980
+LAST_YEAR = 2025
+
+# Fraction of the papers that are refereed
+REFEREED_FRACTION = 0.6
+
+# Mean number of days since a paper was last indexed
+INDEXED_DAYS_AGO = 30
+
+# Values of the property facet, and which papers they apply to
+PROPERTIES = ['article', 'refereed', 'notrefereed']
+
+# Fields that can be asked for with fl, or faceted on
+FIELDS = ['id', 'bibcode', 'year', 'pubdate', 'citation_count', 'read_count', 'property']
+
+
+def seed_for(text, seed=0):
+    """
+    A stable seed for a piece of text, e.g., a query
+    """
+    return (zlib.crc32(text.encode('utf-8')) + seed) % (2**32)
+
+
+class Corpus(object):
+    """
+    A set of made up papers
+
+    :param n: number of papers
+    :type n: int
+    :param seed: random seed
+    :type seed: int
+    """
+    def __init__(self, n, seed=0):
+        rng = numpy.random.RandomState(seed)
+        self.n = n
+        self.seed = seed
+
+        # More papers in recent years
+        weights = numpy.linspace(1, 4, LAST_YEAR - FIRST_YEAR + 1)
+        self.year = (
+            FIRST_YEAR + rng.choice(len(weights), size=n, p=weights/weights.sum())
+        ).astype(numpy.int16)
+        self.refereed = rng.random_sample(n) < REFEREED_FRACTION
+
+        # Heavy tailed citations, older and refereed papers are cited more
+        age = (LAST_YEAR + 1 - self.year).astype(numpy.float64)
+        scale = numpy.where(self.refereed, 1.0, 0.3) * numpy.sqrt(age)
+        self.citation_count = numpy.floor(
+            rng.lognormal(mean=0.5, sigma=1.3, size=n) * scale
+        ).astype(numpy.int32)
+        self.read_count = numpy.floor(
+            (self.citation_count + 1) * rng.lognormal(mean=1.0, sigma=0.8, size=n)
+        ).astype(numpy.int32)
+
+        # Days since each paper was last indexed, most are updated every so often
+        self.indexed_days_ago = rng.exponential(INDEXED_DAYS_AGO, size=n).astype(numpy.float32)
+
+    def __len__(self):
+        return self.n
+
+    def bibcodes(self, index=None):
+        """
+        :param index: papers to return (default: all)
+        :return: numpy array of 19 character bibcodes
+        """
+        index = numpy.arange(self.n) if index is None else numpy.asarray(index)
+        if index.size == 0:
+            # numpy.char.zfill fails on an empty array
+            return numpy.array([], dtype='U19')
+        year = self.year[index].astype('U4')
+        number = numpy.char.zfill(index.astype('U9'), 9)
+        return numpy.char.add(numpy.char.add(year, 'MOCK.'), numpy.char.add(number, 'X'))
+
+    def find(self, bibcodes):
+        """
+        :param bibcodes: bibcodes made by this corpus
+        :return: index of the papers (bibcodes that are not in the corpus are
+            left out)
+        """
+        index = []
+        for bibcode in bibcodes:
+            try:
+                i = int(bibcode[9:18])
+            except ValueError:
+                continue
+            if 0 <= i < self.n and bibcode[9:] == '{:09d}X'.format(i):
+                index.append(i)
+        return numpy.array(index, dtype=numpy.int64)
+
+    def values(self, field, index):
+        """
+        Values of a single valued field, as they appear in a facet
+        """
+        if field == 'year':
+            return self.year[index].astype('U4')
+        if field in ('citation_count', 'read_count'):
+            return getattr(self, field)[index]
+        raise ValueError('Cannot facet on field: {}'.format(field))
+
+    def property_mask(self, value, index):
+        if value == 'article':
+            return numpy.ones(len(index), dtype=bool)
+        if value == 'refereed':
+            return self.refereed[index]
+        if value == 'notrefereed':
+            return ~self.refereed[index]
+        return numpy.zeros(len(index), dtype=bool)
+
+
+class ListedCorpus(Corpus):
+    """
+    Made up papers for a list of bibcodes, e.g., those sent to bigquery
+
+    :param bibcodes: list of bibcodes
+    :param seed: random seed
+    """
+    def __init__(self, bibcodes, seed=0):
+        super(ListedCorpus, self).__init__(len(bibcodes), seed=seed)
+        self._bibcodes = numpy.array(bibcodes, dtype='U')
+        self.year = numpy.array([
+            int(b[:4]) if b[:4].isdigit() else y for b, y in zip(bibcodes, self.year)
+        ], dtype=numpy.int16)
+
+    def bibcodes(self, index=None):
+        return self._bibcodes if index is None else self._bibcodes[numpy.asarray(index, dtype=numpy.int64)]
+
+    def find(self, bibcodes):
+        position = dict((b, i) for i, b in enumerate(self._bibcodes))
+        return numpy.array([position[b] for b in bibcodes if b in position], dtype=numpy.int64)
+
+
+class UnionCorpus(Corpus):
+    """
+    The papers of several queries together, e.g., orcid:(A OR B), where the
+    query of each (orcid:A, orcid:B) can be faceted on
+
+    :param corpora: OrderedDict of query: Corpus
+    """
+    def __init__(self, corpora):
+        self.n = sum(len(c) for c in corpora.values())
+        self.seed = 0
+        self.members = {}
+        start = 0
+        for q, corpus in corpora.items():
+            self.members[q] = (start, start + len(corpus))
+            start += len(corpus)
+
+        for field in ['year', 'refereed', 'citation_count', 'read_count', 'indexed_days_ago']:
+            setattr(self, field, numpy.concatenate([getattr(c, field) for c in corpora.values()]))
+
+
+def search_docs(corpus, index, fl):
+    """
+    The documents of a search response
+
+    :param corpus: Corpus
+    :param index: papers to return, in order
+    :param fl: fields to return
+    :type fl: list
+
+    :return: list of dict
+    """
+    index = numpy.asarray(index, dtype=numpy.int64)
+    columns = {}
+    if 'id' in fl:
+        columns['id'] = [str(i) for i in index]
+    if 'bibcode' in fl:
+        columns['bibcode'] = corpus.bibcodes(index).tolist()
+    if 'year' in fl:
+        columns['year'] = corpus.year[index].astype('U4').tolist()
+    if 'pubdate' in fl:
+        columns['pubdate'] = ['{}-00-00'.format(y) for y in corpus.year[index]]
+    if 'citation_count' in fl:
+        columns['citation_count'] = corpus.citation_count[index].tolist()
+    if 'read_count' in fl:
+        columns['read_count'] = corpus.read_count[index].tolist()
+    if 'property' in fl:
+        columns['property'] = [
+            ['REFEREED', 'ARTICLE'] if r else ['NOT REFEREED', 'ARTICLE']
+            for r in corpus.refereed[index]
+        ]
+
+    return [
+        dict((field, columns[field][i]) for field in fl if field in columns)
+        for i in range(len(index))
+    ]
+
+
+def facet_pivot(corpus, fields, index=None, options=None):
+    """
+    A facet pivot over the papers, as returned in facet_counts.facet_pivot
+
+    :param corpus: Corpus
+    :param fields: fields to pivot on, e.g., ['property', 'year']
+    :param index: papers to include (default: all)
+    :param options: facet options for each field (limit, offset, sort,
+        mincount), as {field: {option: value}}. Like Solr, the default is the
+        100 values with the highest counts.
+
+    :return: list of dict
+    """
+    index = numpy.arange(corpus.n) if index is None else numpy.asarray(index)
+    options = options or {}
+
+    field = fields[0]
+    option = options.get(field, {})
+    limit = int(option.get('limit', 100))
+    offset = int(option.get('offset', 0))
+    mincount = int(option.get('mincount', 1))
+    sort = option.get('sort', 'count' if limit > 0 else 'index')
+
+    if field == 'property':
+        masks = [(value, corpus.property_mask(value, index)) for value in PROPERTIES]
+        entries = [(value, mask, int(mask.sum())) for value, mask in masks]
+    else:
+        values = corpus.values(field, index)
+        unique, inverse, counts = numpy.unique(values, return_inverse=True, return_counts=True)
+        entries = [
+            (unique[i], None if len(fields) == 1 else inverse == i, int(counts[i]))
+            for i in range(len(unique))
+        ]
+
+    entries = [e for e in entries if e[2] >= mincount]
+    if sort == 'count':
+        # Highest count first, ties in index order
+        entries.sort(key=lambda e: -e[2])
+    else:
+        entries.sort(key=lambda e: e[0])
+
+    entries = entries[offset:] if limit < 0 else entries[offset:offset + limit]
+
+    pivot = []
+    for value, mask, count in entries:
+        value = value.item() if hasattr(value, 'item') else value
+        entry = {'field': field, 'value': value, 'count': count}
+        if len(fields) > 1:
+            entry['pivot'] = facet_pivot(corpus, fields[1:], index=index[mask], options=options)
+        pivot.append(entry)
+    return pivot
+
+
+def _facet_query(corpus, q, index):
+    """
+    Papers of index that match a (very) small subset of the query syntax
+    """
+    if q in ('*:*', ''):
+        return numpy.ones(len(index), dtype=bool)
+    if q in getattr(corpus, 'members', {}):
+        start, stop = corpus.members[q]
+        return (index >= start) & (index < stop)
+    field, _, value = q.partition(':')
+    if field == 'property':
+        return corpus.property_mask(value.strip('"').lower(), index)
+
+    # Ranges, e.g., citation_count:[2 TO 4}
+    match = re.match(r'^([\[{])(\S+) TO (\S+)([\]}])$', value)
+    if match and field in ('year', 'citation_count', 'read_count'):
+        values = getattr(corpus, field)[index]
+        mask = numpy.ones(len(index), dtype=bool)
+        if match.group(2) != '*':
+            lower = int(match.group(2))
+            mask &= values >= lower if match.group(1) == '[' else values > lower
+        if match.group(3) != '*':
+            upper = int(match.group(3))
+            mask &= values <= upper if match.group(4) == ']' else values < upper
+        return mask
+    raise ValueError('Cannot facet on query: {}'.format(q))
+
+
+def _facet_stat(corpus, stat, index):
+    function, _, field = stat.rstrip(')').partition('(')
+    values = corpus.values(field, index).astype(numpy.float64)
+    if function == 'sum':
+        return float(values.sum())
+    if not len(values):
+        return None
+    if function == 'avg':
+        return float(values.mean())
+    if function == 'min':
+        return float(values.min())
+    if function == 'max':
+        return float(values.max())
+    raise ValueError('Cannot aggregate with: {}'.format(stat))
+
+
+def _facet_buckets(corpus, facet, index):
+    """
+    The buckets of a terms facet
+    """
+    field = facet['field']
+    if field == 'property':
+        masks = [(value, corpus.property_mask(value, index)) for value in PROPERTIES]
+        entries = [(value, index[mask], int(mask.sum())) for value, mask in masks]
+    else:
+        values = corpus.values(field, index)
+        order = numpy.argsort(values, kind='stable')
+        unique, starts, counts = numpy.unique(values[order], return_index=True, return_counts=True)
+        entries = [
+            (unique[i], index[order[starts[i]:starts[i] + counts[i]]], int(counts[i]))
+            for i in range(len(unique))
+        ]
+
+    entries = [e for e in entries if e[2] >= int(facet.get('mincount', 1))]
+    sort = facet.get('sort', 'count desc')
+    if isinstance(sort, dict):
+        sort = ' '.join(list(sort.items())[0])
+    key, _, direction = sort.partition(' ')
+    if key == 'index':
+        entries.sort(key=lambda e: e[0], reverse=direction == 'desc')
+    else:
+        entries.sort(key=lambda e: e[2], reverse=direction != 'asc')
+
+    limit = int(facet.get('limit', 10))
+    offset = int(facet.get('offset', 0))
+    return entries[offset:] if limit < 0 else entries[offset:offset + limit]
+
+
+def json_facet(corpus, facets, index=None):
+    """
+    A JSON facet (json.facet) over the papers, as returned in facets. Terms
+    and query facets, and the sum, avg, min and max of a field are supported,
+    e.g.,
+
+        {"year": {"type": "terms", "field": "year", "limit": -1,
+                  "facet": {"citations": "sum(citation_count)"}}}
+
+    :param corpus: Corpus
+    :param facets: the facets requested
+    :type facets: dict
+    :param index: papers to include (default: all)
+
+    :return: dict
+    """
+    index = numpy.arange(corpus.n) if index is None else numpy.asarray(index)
+    result = {'count': int(len(index))}
+    for name, facet in facets.items():
+        if isinstance(facet, str):
+            result[name] = _facet_stat(corpus, facet, index)
+        elif facet.get('type') == 'query':
+            result[name] = json_facet(
+                corpus,
+                facet.get('facet', {}),
+                index=index[_facet_query(corpus, facet.get('q', '*:*'), index)]
+            )
+        elif facet.get('type', 'terms') == 'terms':
+            buckets = []
+            for value, bucket_index, count in _facet_buckets(corpus, facet, index):
+                bucket = {'val': value.item() if hasattr(value, 'item') else value}
+                bucket.update(json_facet(corpus, facet.get('facet', {}), index=bucket_index))
+                buckets.append(bucket)
+            result[name] = {'buckets': buckets}
+        else:
+            raise ValueError('Cannot facet with type: {}'.format(facet.get('type')))
+    return result
+
+
+def h_index(citations):
+    c = numpy.sort(numpy.asarray(citations))[::-1]
+    return int((c >= numpy.arange(1, len(c) + 1)).sum())
+
+
+def g_index(citations):
+    c = numpy.sort(numpy.asarray(citations))[::-1]
+    return int((numpy.cumsum(c) >= numpy.arange(1, len(c) + 1)**2).sum())
+
+
+def mean(a):
+    return float(numpy.mean(a)) if len(a) else 0.
+
+
+def median(a):
+    return float(numpy.median(a)) if len(a) else 0.
+
+
+def _stats(corpus, index):
+    """
+    The basic stats, citation stats and indicators of some papers
+    """
+    cites = corpus.citation_count[index]
+    reads = corpus.read_count[index]
+    n = len(index)
+
+    refereed_cites = numpy.floor(cites * 0.8).astype(numpy.int64)
+    h = h_index(cites)
+    first_year = int(corpus.year[index].min()) if n else LAST_YEAR
+    downloads = reads // 2
+
+    return {
+        'basic stats': {
+            'number of papers': n,
+            'normalized paper count': n / 3.,
+            'total number of reads': int(reads.sum()),
+            'average number of reads': mean(reads),
+            'median number of reads': median(reads),
+            'recent number of reads': int(reads.sum() // 10),
+            'total number of downloads': int(downloads.sum()),
+            'average number of downloads': mean(downloads),
+            'median number of downloads': median(downloads),
+            'recent number of downloads': int(downloads.sum() // 10),
+        },
+        'citation stats': {
+            'number of citing papers': int(cites.sum() * 0.8),
+            'total number of citations': int(cites.sum()),
+            'number of self-citations': int(cites.sum() // 10),
+            'average number of citations': mean(cites),
+            'median number of citations': median(cites),
+            'normalized number of citations': float(cites.sum()) / 3.,
+            'total number of refereed citations': int(refereed_cites.sum()),
+            'average number of refereed citations': mean(refereed_cites),
+            'median number of refereed citations': median(refereed_cites),
+            'normalized number of refereed citations': float(refereed_cites.sum()) / 3.,
+        },
+        'indicators': {
+            'h': h,
+            'g': g_index(cites),
+            'i10': int((cites >= 10).sum()),
+            'i100': int((cites >= 100).sum()),
+            'm': float(h) / (LAST_YEAR + 1 - first_year),
+            'tori': float(cites.sum()) / 30.,
+            'riq': int(1000 * numpy.sqrt(cites.sum() / 30.) / (LAST_YEAR + 1 - first_year)),
+            'read10': float(reads.sum()) / 100.,
+        },
+    }
+
+
+def _histogram(years, weights, first, last):
+    counts = numpy.bincount(years - first, weights=weights, minlength=last - first + 1)
+    return dict(
+        (str(first + i), int(c)) for i, c in enumerate(counts[:last - first + 1])
+    )
+
+
+def _spread(years, weights, first, last):
+    """
+    Spread the weight of each paper evenly over the years from when it was
+    published until the last year, e.g., its citations
+    """
+    per_year = numpy.bincount(
+        years - first,
+        weights=weights / (last + 1 - years),
+        minlength=last - first + 1
+    )
+    return dict(
+        (str(first + i), int(round(c))) for i, c in enumerate(numpy.cumsum(per_year))
+    )
+
+
+def metrics(corpus, index=None):
+    """
+    A response of the metrics end point for some of the papers
+
+    :param corpus: Corpus
+    :param index: papers to include (default: all)
+
+    :return: dict
+    """
+    index = numpy.arange(corpus.n) if index is None else numpy.asarray(index)
+    refereed = index[corpus.refereed[index]]
+
+    result = {'skipped bibcodes': []}
+    for suffix, papers in [('', index), (' refereed', refereed)]:
+        for section, values in _stats(corpus, papers).items():
+            result[section + suffix] = values
+
+    years = corpus.year[index].astype(numpy.int64)
+    first = int(years.min()) if len(years) else LAST_YEAR
+    last = LAST_YEAR
+    ref = corpus.refereed[index]
+    cites = corpus.citation_count[index].astype(numpy.float64)
+    reads = corpus.read_count[index].astype(numpy.float64)
+
+    result['histograms'] = {
+        'publications': {
+            'all publications': _histogram(years, None, first, last),
+            'refereed publications': _histogram(years[ref], None, first, last),
+        },
+        'citations': {
+            'refereed to refereed': _spread(years[ref], cites[ref] * 0.6, first, last),
+            'refereed to nonrefereed': _spread(years[~ref], cites[~ref] * 0.6, first, last),
+            'nonrefereed to refereed': _spread(years[ref], cites[ref] * 0.4, first, last),
+            'nonrefereed to nonrefereed': _spread(years[~ref], cites[~ref] * 0.4, first, last),
+        },
+        'reads': {
+            'all reads': _spread(years, reads, first, last),
+            'refereed reads': _spread(years[ref], reads[ref], first, last),
+        },
+    }
+
+    # Indices as they would have been at the end of each year
+    series = dict((k, {}) for k in ['h', 'g', 'i10', 'i100', 'tori', 'read10'])
+    for year in range(first, last + 1):
+        published = years <= year
+        grown = cites[published] * (year + 1 - years[published]) / (last + 1 - years[published])
+        series['h'][str(year)] = h_index(numpy.floor(grown))
+        series['g'][str(year)] = g_index(numpy.floor(grown))
+        series['i10'][str(year)] = int((grown >= 10).sum())
+        series['i100'][str(year)] = int((grown >= 100).sum())
+        series['tori'][str(year)] = float(grown.sum()) / 30.
+        series['read10'][str(year)] = float(reads[published].sum()) / 100.
+    result['time series'] = series
+
+    return result
+
+
+def libraries(n, seed=0, documents=(0, 200)):
+    """
+    Meta data of a user's libraries, as returned by /biblib/libraries
+
+    :param n: number of libraries
+    :param seed: random seed
+    :param documents: (min, max) number of documents in a library
+
+    :return: list of dict
+    """
+    rng = numpy.random.RandomState(seed)
+    alphabet = numpy.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'))
+    result = []
+    for i in range(n):
+        result.append({
+            'id': ''.join(rng.choice(alphabet, 22)),
+            'name': 'Library {}'.format(i + 1),
+            'description': 'Made up library number {}'.format(i + 1),
+            'num_documents': int(rng.randint(documents[0], documents[1] + 1)),
+            'permission': 'owner',
+            'public': False,
+            'date_created': '2017-01-01T00:00:00',
+            'date_last_modified': '2017-01-{:02d}T00:00:00'.format(i % 28 + 1),
+        })
+    return result
+
+
+def library_corpus(library):
+    """
+    The papers in a library
+    """
+    return Corpus(library['num_documents'], seed=seed_for(library['id']))
+
+
+def library_page(library, start=0, rows=25, corpus=None):
+    """
+    A page of the documents in a library, as returned by
+    /biblib/libraries/<id>
+
+    :param library: meta data of the library (see libraries)
+    :param start: first document
+    :param rows: number of documents
+    :param corpus: papers in the library, if already made (see library_corpus)
+
+    :return: dict
+    """
+    if corpus is None:
+        corpus = library_corpus(library)
+    stop = min(start + rows, library['num_documents'])
+    return {
+        'documents': corpus.bibcodes(numpy.arange(start, stop)).tolist() if stop > start else [],
+        'metadata': library,
+        'solr': {'response': {'numFound': library['num_documents']}},
+        'updates': {},
+    }
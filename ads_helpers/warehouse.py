@@ -0,0 +1,427 @@
+"""
+A local SQLite store of what the examples have already fetched from the API,
+so that repeated reports over overlapping sets of papers are mostly answered
+without a request:
+
+    papers          citation_count, read_count, year and properties of each
+                    bibcode (indexed on year)
+    queries         when a query (e.g., orcid:0000-0001-8043-4965) was last
+                    run, and the ORCiD iD it is for (indexed on ORCiD iD)
+    query_papers    the bibcodes each query found, in order
+    libraries       meta data of each private library
+    library_papers  the bibcodes of each library, in order
+
+Rows are refreshed once they are older than max_age seconds. The documents of
+a library are only fetched again when its date_last_modified has changed.
+
+    store = warehouse.Warehouse('~/.ads/warehouse.sqlite', max_age=86400)
+    results = store.query_results('orcid:0000-0001-8043-4965')  # None if stale
+    papers = store.papers(results[0])  # only the rows that are fresh
+
+The examples use it when given --warehouse (or ADS_WAREHOUSE is set).
+Several processes can share the same file.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from ads_helpers import profiling
+
+# Rows older than this many hours are fetched again
+DEFAULT_MAX_AGE = 24
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    bibcode TEXT PRIMARY KEY,
+    year INTEGER,
+    pubdate TEXT,
+    citation_count INTEGER,
+    read_count INTEGER,
+    refereed INTEGER,
+    property TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS papers_year ON papers (year);
+
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    orcid TEXT,
+    sort TEXT,
+    num_found INTEGER,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS queries_orcid ON queries (orcid);
+
+CREATE TABLE IF NOT EXISTS query_papers (
+    query TEXT,
+    position INTEGER,
+    bibcode TEXT,
+    PRIMARY KEY (query, position)
+);
+
+CREATE TABLE IF NOT EXISTS libraries (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    num_documents INTEGER,
+    date_last_modified TEXT,
+    updated REAL
+);
+
+CREATE TABLE IF NOT EXISTS library_papers (
+    library_id TEXT,
+    position INTEGER,
+    bibcode TEXT,
+    PRIMARY KEY (library_id, position)
+);
+"""
+
+# SQLite limits the number of parameters of a statement
+CHUNK_SIZE = 500
+
+
+class Paper(object):
+    """
+    A paper read from the warehouse, with the same attributes as the
+    ads.Article that were stored
+    """
+    def __init__(self, bibcode, year, pubdate, citation_count, read_count, property):
+        self.bibcode = bibcode
+        self.year = year
+        self.pubdate = pubdate
+        self.citation_count = citation_count
+        self.read_count = read_count
+        self.property = property
+
+    def __repr__(self):
+        return '<Paper {}>'.format(self.bibcode)
+
+
+def chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+def orcid_of(query):
+    """
+    ORCiD iD a query is for, e.g., 0000-0001-8043-4965 for
+    orcid:0000-0001-8043-4965
+    """
+    if query.startswith('orcid:') and ' ' not in query:
+        return query[len('orcid:'):]
+    return None
+
+
+class Warehouse(object):
+    """
+    Per-bibcode statistics, query results and libraries kept in an SQLite file
+    """
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE*3600):
+        """
+        :param path: SQLite file, made if it does not exist
+        :param max_age: seconds after which a row is fetched again
+        """
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        with self.connect() as db:
+            # Readers do not block the writer, so reports can share the file
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        """
+        A connection that commits on success, used by one thread at a time
+        """
+        with self._lock:
+            db = sqlite3.connect(self.path, timeout=30)
+            try:
+                with db:
+                    yield db
+            finally:
+                db.close()
+
+    def oldest(self):
+        """
+        Time before which a row is stale
+        """
+        return time.time() - self.max_age
+
+    def papers(self, bibcodes):
+        """
+        :param bibcodes: list of bibcodes
+
+        :return: dict of bibcode: Paper, for the bibcodes with a fresh row
+        """
+        result = {}
+        oldest = self.oldest()
+        with self.connect() as db:
+            for chunk in chunks(list(bibcodes)):
+                rows = db.execute(
+                    'SELECT bibcode, year, pubdate, citation_count, read_count, property '
+                    'FROM papers WHERE updated >= ? AND bibcode IN ({})'
+                    .format(','.join('?' * len(chunk))),
+                    [oldest] + chunk
+                )
+                for bibcode, year, pubdate, citation_count, read_count, prop in rows:
+                    result[bibcode] = Paper(
+                        bibcode,
+                        None if year is None else str(year),
+                        pubdate,
+                        citation_count,
+                        read_count,
+                        json.loads(prop) if prop else []
+                    )
+        return result
+
+    def stale(self, bibcodes):
+        """
+        :param bibcodes: list of bibcodes
+
+        :return: list of the bibcodes that are missing or too old
+        """
+        fresh = self.papers(bibcodes)
+        return [b for b in bibcodes if b not in fresh]
+
+    def add_papers(self, articles):
+        """
+        Store (or refresh) papers
+
+        :param articles: ads.Article, or anything with the same attributes
+        """
+        now = time.time()
+        rows = []
+        for article in articles:
+            prop = getattr(article, 'property', None) or []
+            year = getattr(article, 'year', None)
+            rows.append((
+                article.bibcode,
+                int(year) if year else None,
+                getattr(article, 'pubdate', None),
+                getattr(article, 'citation_count', None),
+                getattr(article, 'read_count', None),
+                int('REFEREED' in prop),
+                json.dumps(list(prop)),
+                now,
+            ))
+        with self.connect() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO papers '
+                '(bibcode, year, pubdate, citation_count, read_count, refereed, property, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def query_results(self, query, limit=None, sort=None):
+        """
+        :param query: ADS query
+        :param limit: number of papers that are wanted (default: every one
+            that was stored)
+        :param sort: order of the papers, which matters when only some of
+            the papers found were stored
+
+        :return: list of the bibcodes the query found and the number of papers
+            found, or None if it has not been run, was run too long ago, or
+            for fewer papers (or another order)
+        """
+        with self.connect() as db:
+            row = db.execute(
+                'SELECT sort, num_found, updated FROM queries WHERE query = ?', (query,)
+            ).fetchone()
+            if row is None or row[2] < self.oldest():
+                return None
+            stored_sort, num_found = row[0], row[1]
+            bibcodes = [b for b, in db.execute(
+                'SELECT bibcode FROM query_papers WHERE query = ? ORDER BY position', (query,)
+            )]
+
+        complete = num_found is None or len(bibcodes) >= num_found
+        if limit is not None:
+            if len(bibcodes) < limit and not complete:
+                return None
+            if not complete and stored_sort != sort:
+                return None
+            bibcodes = bibcodes[:limit]
+        return bibcodes, num_found
+
+    def add_query(self, query, bibcodes, num_found=None, sort=None):
+        """
+        Store the bibcodes a query found, in order
+
+        :param query: ADS query
+        :param bibcodes: list of bibcodes
+        :param num_found: number of papers found, which can be more than were
+            downloaded
+        :param sort: order of the papers
+        """
+        with self.connect() as db:
+            db.execute('DELETE FROM query_papers WHERE query = ?', (query,))
+            db.executemany(
+                'INSERT INTO query_papers (query, position, bibcode) VALUES (?, ?, ?)',
+                [(query, i, b) for i, b in enumerate(bibcodes)]
+            )
+            db.execute(
+                'INSERT OR REPLACE INTO queries (query, orcid, sort, num_found, updated) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (query, orcid_of(query), sort, num_found, time.time())
+            )
+
+    def orcid_bibcodes(self, orcid):
+        """
+        :return: list of every bibcode stored for an ORCiD iD, from any query
+        """
+        with self.connect() as db:
+            return [b for b, in db.execute(
+                'SELECT DISTINCT p.bibcode FROM queries q '
+                'JOIN query_papers p ON p.query = q.query WHERE q.orcid = ?', (orcid,)
+            )]
+
+    def library_bibcodes(self, library):
+        """
+        :param library: meta data of a library, as returned by /biblib/libraries
+
+        :return: list of the bibcodes in the library, or None if it has
+            changed since they were stored
+        """
+        with self.connect() as db:
+            row = db.execute(
+                'SELECT num_documents, date_last_modified, updated FROM libraries WHERE id = ?',
+                (library['id'],)
+            ).fetchone()
+            if row is None:
+                return None
+
+            num_documents, date_last_modified, updated = row
+            if num_documents != library['num_documents']:
+                return None
+            if library.get('date_last_modified') is not None:
+                if date_last_modified != library['date_last_modified']:
+                    return None
+            elif updated < self.oldest():
+                # Without a modification date, the age is all there is to go on
+                return None
+
+            return [b for b, in db.execute(
+                'SELECT bibcode FROM library_papers WHERE library_id = ? ORDER BY position',
+                (library['id'],)
+            )]
+
+    def add_library(self, library, bibcodes):
+        """
+        Store the bibcodes of a library, in order
+        """
+        with self.connect() as db:
+            db.execute('DELETE FROM library_papers WHERE library_id = ?', (library['id'],))
+            db.executemany(
+                'INSERT INTO library_papers (library_id, position, bibcode) VALUES (?, ?, ?)',
+                [(library['id'], i, b) for i, b in enumerate(bibcodes)]
+            )
+            db.execute(
+                'INSERT OR REPLACE INTO libraries '
+                '(id, name, num_documents, date_last_modified, updated) VALUES (?, ?, ?, ?, ?)',
+                (library['id'], library.get('name'), library['num_documents'],
+                 library.get('date_last_modified'), time.time())
+            )
+
+
+def search_bibcodes(store, ads, query, rows, max_pages, sort=None):
+    """
+    Bibcodes found by a query, from the warehouse if they are fresh, or else
+    from the API (asking for the bibcodes alone) and then stored
+
+    :param store: Warehouse
+    :param ads: Andy Casey's ads client (or ads.sandbox)
+
+    :return: list of bibcodes, number of papers found
+    """
+    with profiling.stage('warehouse'):
+        results = store.query_results(query, limit=rows*max_pages, sort=sort)
+    if results is not None:
+        return results
+
+    with profiling.stage('query'):
+        sq = ads.SearchQuery(q=query, fl=['bibcode'], rows=rows, max_pages=max_pages, sort=sort)
+        bibcodes = [i.bibcode for i in sq]
+        num_found = sq.response.numFound
+
+    with profiling.stage('warehouse'):
+        store.add_query(query, bibcodes, num_found=num_found, sort=sort)
+    return bibcodes, num_found
+
+
+def search_papers(store, ads, query, fl, rows, max_pages, sort=None):
+    """
+    Papers found by a query. Only the papers that are not in the warehouse,
+    or are stale, are fetched from the API (by bibcode), and then stored.
+
+    :param store: Warehouse
+    :param ads: Andy Casey's ads client (or ads.sandbox)
+    :param fl: fields of the papers, stored ones are bibcode, year, pubdate,
+        citation_count, read_count and property
+
+    :return: list of Paper and ads.Article, number of papers found
+    """
+    bibcodes, num_found = search_bibcodes(store, ads, query, rows, max_pages, sort=sort)
+
+    with profiling.stage('warehouse'):
+        papers = store.papers(bibcodes)
+    stale = [b for b in bibcodes if b not in papers]
+    print('Papers from the warehouse: {}, from the API: {}'.format(
+        len(bibcodes) - len(stale), len(stale)
+    ))
+
+    # At most rows bibcodes a request, to stay within the length of a URL
+    for chunk in chunks(stale, min(rows, 200)):
+        with profiling.stage('fetch'):
+            sq = ads.SearchQuery(
+                q='bibcode:({})'.format(' OR '.join('"{}"'.format(b) for b in chunk)),
+                fl=fl,
+                rows=len(chunk),
+                max_pages=1
+            )
+            fetched = list(sq)
+        with profiling.stage('warehouse'):
+            store.add_papers(fetched)
+        papers.update((i.bibcode, i) for i in fetched)
+
+    return [papers[b] for b in bibcodes if b in papers], num_found
+
+
+def add_arguments(parser):
+    """
+    Add the warehouse options to an argparse parser
+    """
+    parser.add_argument(
+        '--warehouse',
+        dest='warehouse',
+        help='Keep what is fetched in this SQLite file, and answer from it when '
+             'it is fresh [default: ADS_WAREHOUSE or None]',
+        default=os.getenv('ADS_WAREHOUSE'),
+        type=str
+    )
+    parser.add_argument(
+        '--max-age',
+        dest='max_age',
+        help='Hours after which the warehouse is refreshed from the API [default: {}]'
+             .format(DEFAULT_MAX_AGE),
+        default=DEFAULT_MAX_AGE,
+        type=float
+    )
+
+
+def from_args(args):
+    """
+    :return: Warehouse for the command line options, or None if not asked for
+    """
+    if not getattr(args, 'warehouse', None):
+        return None
+    return Warehouse(args.warehouse, max_age=args.max_age*3600)
@@ -0,0 +1,124 @@
+"""
+One command line entry point for all of the examples:
+
+    python ads_report.py metrics --orcid 0000-0001-8043-4965 --plot
+    python ads_report.py search --query 'author:"Elliott, J"' --save-to-file csv
+    python ads_report.py facet --orcid 0000-0001-8043-4965 --save-to-file csv
+    python ads_report.py library --save-to-file myfile.csv
+    python ads_report.py serve --port 8765
+    python ads_report.py batch --queue jobs.sqlite work --workers 4
+
+Each sub-command takes the same options as the script it runs. `serve` keeps
+all of the examples loaded in one process and serves reports locally (see
+ads_helpers/server.py), and `batch` works through a queue of reports shared
+by several machines (see ads_helpers/batch.py). Only the
+script that is asked for is imported, and the scripts themselves only import
+matplotlib, pandas, jinja2, etc. when they are needed, so a CSV export does
+not pay for loading the plotting libraries.
+
+The time taken to get to the point of running the script is checked against
+a start up budget (--startup-budget), and a warning is printed if it is
+exceeded.
+"""
+
+import time
+_start = time.time()
+
+import os
+import sys
+import argparse
+import importlib
+
+from ads_helpers import examples
+
+# Sub-commands that are not examples: module that runs them
+TOOLS = {
+    'batch': 'ads_helpers.batch',
+    'serve': 'ads_helpers.server',
+    'mock-api': 'ads_helpers.mock_api',
+}
+
+# Milliseconds allowed from start up until the script starts running
+STARTUP_BUDGET = 250
+
+
+def get_parser():
+    """
+    Create the parser with one sub-command per example. The options of each
+    example are only added when that sub-command is used, as they are defined
+    in the example itself.
+    """
+    # -h is added by hand, so that once an example is named (metrics -h), it
+    # is left for the example's own parser
+    parser = argparse.ArgumentParser(
+        description='Create reports with the ADS API examples',
+        add_help=False
+    )
+    parser.add_argument(
+        '-h',
+        '--help',
+        dest='help',
+        help='Show this help message and exit (after an example, its own options)',
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '--startup-budget',
+        dest='startup_budget',
+        help='Warn if start up takes longer than this many milliseconds '
+             '[default: {}]'.format(STARTUP_BUDGET),
+        default=int(os.getenv('ADS_REPORT_STARTUP_BUDGET', STARTUP_BUDGET)),
+        type=int
+    )
+    parser.add_argument(
+        'command',
+        choices=sorted(examples.EXAMPLES) + sorted(TOOLS),
+        help='Example (or tool) to run'
+    )
+    return parser
+
+
+def load_command(name):
+    """
+    Import the module that runs a sub-command
+    """
+    if name in TOOLS:
+        return importlib.import_module(TOOLS[name])
+    return examples.load(name)
+
+
+def main(argv=None):
+
+    argv = sys.argv[1:] if argv is None else argv
+
+    parser = get_parser()
+    for arg in argv:
+        if arg in examples.EXAMPLES or arg in TOOLS:
+            break
+        if arg in ('-h', '--help'):
+            parser.print_help()
+            parser.exit()
+    args, remaining = parser.parse_known_args(argv)
+    if args.help:
+        remaining = remaining + ['--help']
+
+    module = load_command(args.command)
+    sub_parser = argparse.ArgumentParser(
+        prog='{} {}'.format(parser.prog, args.command),
+        description=(module.__doc__ or '').strip().split('\n\n')[0]
+    )
+    module.add_arguments(sub_parser)
+    sub_args = sub_parser.parse_args(remaining)
+
+    startup = 1000 * (time.time() - _start)
+    if startup > args.startup_budget:
+        sys.stderr.write(
+            'Start up took {:.0f} ms, which is over the budget of {} ms\n'
+            .format(startup, args.startup_budget)
+        )
+
+    module.run(sub_args, sub_parser)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Run many reports at the same time against the stand-in API, to see how
+report generation scales with concurrency, e.g., to size the machines that
+make them.
+
+Each report is a new process (`ads_report.py <example> ...`), as it would be
+from a cron job or a queue worker. For each level of concurrency, the
+throughput (reports per minute), the percentiles of the time a report takes,
+and the CPU time and peak memory (RSS) of each report are measured. Unix only,
+as os.wait4 is used to get the resource usage of each process.
+
+    python benchmarks/load_test.py --concurrency 1 2 4 8 --jobs 32 --output load.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.request import urlopen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.append(HERE)  # for run_benchmarks
+
+import numpy
+
+from run_benchmarks import get_revision
+
+ADS_REPORT = os.path.join(ROOT, 'ads_report.py')
+
+EXAMPLES = ['metrics', 'search', 'facet', 'library']
+
+
+class MockNotReady(Exception):
+    pass
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_mock(port, options, timeout=30):
+    """
+    Start the stand-in API in its own process, so it does not compete with the
+    harness for the GIL
+
+    :return: subprocess.Popen
+    """
+    mock = subprocess.Popen(
+        [sys.executable, ADS_REPORT, 'mock-api', '--port', str(port),
+         '--rate-limit', str(10**9)] + options,
+        stdout=subprocess.DEVNULL
+    )
+    url = 'http://127.0.0.1:{}/v1/biblib/libraries'.format(port)
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            urlopen(url).read()
+            return mock
+        except IOError:
+            if mock.poll() is not None:
+                break
+            time.sleep(0.1)
+    mock.kill()
+    raise MockNotReady('The stand-in API did not start on port {}'.format(port))
+
+
+def job_argv(example, folder, query, plot=False):
+    if example == 'library':
+        return ['library', '--save-to-file', os.path.join(folder, 'libraries.csv')]
+
+    argv = [example, '--query', query, '--save-to-file', 'csv', '--output', folder]
+    if plot:
+        argv += ['--plot', '--format', 'png']
+    return argv
+
+
+def run_job(example, query, env, plot=False):
+    """
+    Make one report in a new process
+
+    :return: dict of the time it took, its CPU time and peak memory
+    """
+    folder = tempfile.mkdtemp(prefix='ads-load-test-')
+    try:
+        with open(os.path.join(folder, 'stderr.txt'), 'w+') as stderr:
+            start = time.time()
+            process = subprocess.Popen(
+                [sys.executable, ADS_REPORT] + job_argv(example, folder, query, plot=plot),
+                stdout=subprocess.DEVNULL,
+                stderr=stderr,
+                env=env
+            )
+            _, status, usage = os.wait4(process.pid, 0)
+            wall = time.time() - start
+            # The process has already been reaped by wait4
+            process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+
+            stderr.seek(0)
+            error = stderr.read()[-2000:] if process.returncode else None
+
+        return OrderedDict([
+            ('example', example),
+            ('wall', wall),
+            ('cpu', usage.ru_utime + usage.ru_stime),
+            # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+            ('max_rss_mb', usage.ru_maxrss / (1024. if sys.platform != 'darwin' else 1024.**2)),
+            ('returncode', process.returncode),
+            ('error', error),
+        ])
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def run_level(concurrency, jobs, examples, env, query='star', plot=False):
+    """
+    Run a number of reports, with concurrency of them running at any time
+
+    :return: summary of the level, and every job
+    """
+    lock = threading.Lock()
+    results = []
+
+    def job(i):
+        result = run_job(examples[i % len(examples)], query, env, plot=plot)
+        with lock:
+            results.append(result)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(job, range(jobs)))
+    wall = time.time() - start
+
+    succeeded = [r for r in results if r['returncode'] == 0]
+    summary = OrderedDict([
+        ('concurrency', concurrency),
+        ('jobs', jobs),
+        ('failed', jobs - len(succeeded)),
+        ('wall', wall),
+        ('reports_per_minute', 60. * len(succeeded) / wall),
+    ])
+    if succeeded:
+        latency = numpy.array([r['wall'] for r in succeeded])
+        cpu = numpy.array([r['cpu'] for r in succeeded])
+        rss = numpy.array([r['max_rss_mb'] for r in succeeded])
+        summary['latency'] = OrderedDict(
+            [('mean', float(latency.mean()))] +
+            [('p{}'.format(p), float(numpy.percentile(latency, p))) for p in [50, 95, 99]]
+        )
+        summary['cpu_per_job'] = float(cpu.mean())
+        summary['max_rss_mb'] = OrderedDict([('mean', float(rss.mean())), ('max', float(rss.max()))])
+    summary['results'] = results
+    return summary
+
+
+def main(levels, jobs, examples, query='star', plot=False, mock_options=None, output_file=None):
+
+    port = free_port()
+    mock = start_mock(port, mock_options or [])
+
+    env = dict(os.environ)
+    env.update({
+        'ADS_API_URL': 'http://127.0.0.1:{}/v1'.format(port),
+        'ADS_DEV_KEY': env.get('ADS_DEV_KEY', 'load-test'),
+        'MPLBACKEND': 'Agg',
+    })
+
+    results = OrderedDict([
+        ('revision', get_revision()),
+        ('date', datetime.utcnow().isoformat()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('cpu_count', os.cpu_count()),
+        ('examples', examples),
+        ('mock_options', mock_options),
+        ('levels', []),
+    ])
+
+    print('{:>11} {:>6} {:>12} {:>8} {:>8} {:>8} {:>9} {:>9}'.format(
+        'concurrency', 'failed', 'reports/min', 'p50 [s]', 'p95 [s]', 'p99 [s]', 'cpu [s]', 'rss [MB]'
+    ))
+    try:
+        for concurrency in levels:
+            level = run_level(concurrency, jobs, examples, env, query=query, plot=plot)
+            results['levels'].append(level)
+
+            if 'latency' in level:
+                print('{:>11} {:>6} {:>12.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>9.2f} {:>9.1f}'.format(
+                    concurrency, level['failed'], level['reports_per_minute'],
+                    level['latency']['p50'], level['latency']['p95'], level['latency']['p99'],
+                    level['cpu_per_job'], level['max_rss_mb']['max']
+                ))
+            else:
+                print('{:>11} {:>6} every report failed, e.g.:\n{}'.format(
+                    concurrency, level['failed'], level['results'][0]['error']
+                ))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Output results: {}'.format(output_file))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--concurrency',
+        dest='concurrency',
+        nargs='+',
+        help='Numbers of reports made at the same time [default: 1 2 4 8]',
+        default=[1, 2, 4, 8],
+        type=int
+    )
+    parser.add_argument(
+        '--jobs',
+        dest='jobs',
+        help='Number of reports made at each level of concurrency [default: 16]',
+        default=16,
+        type=int
+    )
+    parser.add_argument(
+        '--examples',
+        dest='examples',
+        nargs='+',
+        choices=EXAMPLES,
+        help='Examples to make reports with, in turn [default: facet library]',
+        default=['facet', 'library'],
+        type=str
+    )
+    parser.add_argument(
+        '--query',
+        dest='query',
+        help='Query given to the examples [default: star]',
+        default='star',
+        type=str
+    )
+    parser.add_argument(
+        '--plot',
+        dest='plot',
+        action='store_true',
+        help='Make the figures too',
+        default=False
+    )
+    parser.add_argument(
+        '--papers',
+        dest='papers',
+        help='Number of papers found by the query [default: 5000]',
+        default=5000,
+        type=int
+    )
+    parser.add_argument(
+        '--latency',
+        dest='latency',
+        help='Milliseconds the stand-in API waits before every response [default: 0]',
+        default=0,
+        type=float
+    )
+    parser.add_argument(
+        '--output',
+        dest='output',
+        help='Save the results to this JSON file [default: None]',
+        default=None,
+        type=str
+    )
+    args = parser.parse_args()
+
+    main(
+        levels=args.concurrency,
+        jobs=args.jobs,
+        examples=args.examples,
+        query=args.query,
+        plot=args.plot,
+        mock_options=['--papers', str(args.papers), '--latency', str(args.latency)],
+        output_file=args.output
+    )
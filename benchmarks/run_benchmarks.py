@@ -0,0 +1,407 @@
+"""
+Time the hot paths of the examples on made up data, from 10^3 up to 10^7
+papers, and save the results as JSON so that revisions can be compared.
+
+The functions that turn API responses into tables (stepify, h_index, the
+get_* parsers, get_rank) are timed on their own. The examples are also run end
+to end against the stand-in API (ads_helpers/mock_api.py), which times the
+CSV writers and the pagination of lib_2_csv as stages of a real run.
+
+    python benchmarks/run_benchmarks.py --sizes 1000 100000 --output new.json
+    python benchmarks/run_benchmarks.py --compare old.json --output new.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import timeit
+import argparse
+import platform
+import importlib.util
+import tempfile
+import subprocess
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from datetime import datetime
+from functools import lru_cache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.append(ROOT)  # for ads_helpers
+
+import numpy
+
+from ads_helpers import decoding, examples, http, mock_api, profiling, synthetic
+
+# Name: (setup, largest size it is run for)
+BENCHMARKS = OrderedDict()
+
+# Fields of the documents used by search_facet
+SEARCH_FIELDS = ['bibcode', 'year', 'pubdate', 'read_count', 'citation_count', 'property']
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def benchmark(name, max_size=None):
+    """
+    Register a benchmark. The decorated function is given the size, and
+    returns the function to time.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, max_size)
+        return setup
+    return register
+
+
+class Article(object):
+    """
+    Stands in for ads.search.Article
+    """
+    def __init__(self, doc):
+        self.__dict__.update(doc)
+
+
+@lru_cache(maxsize=2)
+def get_corpus(n):
+    return synthetic.Corpus(n, seed=n)
+
+
+def get_articles(n):
+    corpus = get_corpus(n)
+    return [
+        Article(doc)
+        for doc in synthetic.search_docs(corpus, numpy.arange(n), SEARCH_FIELDS)
+    ]
+
+
+def get_series(n):
+    """
+    A time series of n points, one a minute
+    """
+    x = numpy.datetime64('1980-01-01T00:00') + numpy.arange(n).astype('timedelta64[m]')
+    y = get_corpus(n).read_count
+    return x.astype('datetime64[us]'), y
+
+
+for example in ['metrics', 'search', 'facet']:
+    def setup(n, example=example):
+        module = examples.load(example)
+        x, y = get_series(n)
+        return lambda: module.stepify(x, y)
+    benchmark('stepify/{}'.format(example))(setup)
+
+for example in ['search', 'facet']:
+    def setup(n, example=example):
+        module = examples.load(example)
+        citations = get_corpus(n).citation_count
+        return lambda: module.h_index(citations)
+    benchmark('h_index/{}'.format(example))(setup)
+
+for example in ['metrics', 'search']:
+    def setup(n, example=example):
+        module = examples.load(example)
+        articles = get_articles(n)
+        return lambda: module.get_numbers_of_papers_raw(articles)
+    benchmark('get_numbers_of_papers_raw/{}'.format(example), max_size=10**6)(setup)
+
+for parser in ['get_numbers_of_papers', 'get_citations_of_papers',
+               'get_indices_of_papers', 'get_reads_of_papers']:
+    def setup(n, parser=parser):
+        function = getattr(examples.load('metrics'), parser)
+        metrics = synthetic.metrics(get_corpus(n))
+        return lambda: function(metrics)
+    benchmark('{}/metrics'.format(parser))(setup)
+
+
+@benchmark('get_numbers_of_papers/facet')
+def setup_facet_numbers(n):
+    plot_search = examples.load('facet')
+    pivot = decoding.compact_pivot(synthetic.facet_pivot(
+        get_corpus(n), ['property', 'year'], options={'year': {'limit': -1}}
+    ))
+    return lambda: plot_search.get_numbers_of_papers(pivot)
+
+
+for field in ['citation_count', 'read_count']:
+    def setup(n, field=field):
+        plot_search = examples.load('facet')
+        pivot = decoding.compact_pivot(synthetic.facet_pivot(
+            get_corpus(n), ['property', field], options={field: {'limit': -1}}
+        ))
+        return lambda: plot_search.get_rank(pivot)
+    benchmark('get_rank/facet/{}'.format(field))(setup)
+
+
+def end_to_end(example, n, argv, needs_ads=False, **mock_options):
+    """
+    Run an example against the stand-in API, in a new folder every time
+
+    :return: function to time
+    """
+    if needs_ads and importlib.util.find_spec('ads') is None:
+        raise SkipBenchmark("Andy Casey's ads client is not installed")
+
+    module = examples.load(example)
+    parser = argparse.ArgumentParser()
+    module.add_arguments(parser)
+
+    server, url = mock_api.start_server(mock_api.MockAPI(rate_limit=10**9, **mock_options))
+    http.API_URL = url
+    os.environ.setdefault('ADS_DEV_KEY', 'benchmark')
+
+    def run():
+        folder = tempfile.mkdtemp(prefix='ads-benchmark-')
+        args = parser.parse_args([a.format(output=folder) for a in argv])
+        try:
+            with redirect_stdout(io.StringIO()):
+                module.run(args, parser)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    run.server = server
+    return run
+
+
+@benchmark('end_to_end/facet', max_size=10**7)
+def setup_facet(n):
+    return end_to_end(
+        'facet', n, ['--query', 'star', '--save-to-file', 'csv', '--output', '{output}'],
+        papers=n
+    )
+
+
+@benchmark('end_to_end/library', max_size=10**5)
+def setup_library(n):
+    return end_to_end(
+        'library', n, ['--save-to-file', '{output}/libraries.csv'],
+        libraries=1, library_size=(n, n)
+    )
+
+
+@benchmark('end_to_end/search', max_size=10**5)
+def setup_search(n):
+    return end_to_end(
+        'search', n, ['--query', 'star', '--save-to-file', 'csv', '--output', '{output}',
+                      '--rows', '2000', '--max-pages', str(max(1, n // 2000))],
+        needs_ads=True, papers=n
+    )
+
+
+@benchmark('end_to_end/metrics', max_size=10**7)
+def setup_metrics(n):
+    return end_to_end(
+        'metrics', n, ['--query', 'star', '--save-to-file', 'csv', '--output', '{output}'],
+        needs_ads=True, papers=n
+    )
+
+
+def time_function(function, repeat, end_to_end=False):
+    """
+    :return: number of calls per repeat, and the seconds per call of each repeat
+    """
+    timer = timeit.Timer(function)
+    if end_to_end:
+        number = 1
+    else:
+        number, _ = timer.autorange()
+    return number, [t / number for t in timer.repeat(repeat=repeat, number=number)]
+
+
+def run_benchmark(name, size, repeat):
+    setup, max_size = BENCHMARKS[name]
+    result = OrderedDict([('benchmark', name), ('size', size)])
+    if max_size is not None and size > max_size:
+        result['skipped'] = 'only run up to {} papers'.format(max_size)
+        return result
+
+    try:
+        function = setup(size)
+    except SkipBenchmark as error:
+        result['skipped'] = str(error)
+        return result
+
+    is_end_to_end = name.startswith('end_to_end/')
+    try:
+        number, times = time_function(function, repeat, end_to_end=is_end_to_end)
+
+        if is_end_to_end:
+            # One more run to see where the time goes
+            profiler = profiling.Profiler(trace_memory=False)
+            previous = profiling.set_profiler(profiler)
+            try:
+                function()
+            finally:
+                profiling.set_profiler(previous)
+            result['stages'] = dict(
+                (stage, total['wall']) for stage, total in profiler.trace()['totals'].items()
+            )
+    finally:
+        server = getattr(function, 'server', None)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    result['number'] = number
+    result['times'] = times
+    result['best'] = min(times)
+    result['median'] = float(numpy.median(times))
+    return result
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold=1.1):
+    """
+    Print how the best times changed between two sets of results
+
+    :return: list of (benchmark, size) that are slower by more than threshold
+    """
+    old_results = dict(
+        ((r['benchmark'], r['size']), r) for r in old['results'] if 'best' in r
+    )
+    print('Compared to revision {} of {}'.format(old.get('revision'), old.get('date')))
+    print('{:<45} {:>9} {:>12} {:>12} {:>7}'.format('benchmark', 'size', 'old [s]', 'new [s]', 'ratio'))
+
+    slower = []
+    for result in new['results']:
+        key = (result['benchmark'], result['size'])
+        if 'best' not in result or key not in old_results:
+            continue
+        ratio = result['best'] / old_results[key]['best']
+        flag = ''
+        if ratio > threshold:
+            flag = ' slower'
+            slower.append(key)
+        elif ratio < 1. / threshold:
+            flag = ' faster'
+        print('{:<45} {:>9} {:>12.3g} {:>12.3g} {:>7.2f}{}'.format(
+            key[0], key[1], old_results[key]['best'], result['best'], ratio, flag
+        ))
+    return slower
+
+
+def main(sizes, names, repeat, output_file=None, compare_file=None, threshold=1.1):
+
+    # Plots are not made, but the examples import matplotlib on demand
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    results = OrderedDict([
+        ('revision', get_revision()),
+        ('date', datetime.utcnow().isoformat()),
+        ('python', platform.python_version()),
+        ('numpy', numpy.__version__),
+        ('platform', platform.platform()),
+        ('results', []),
+    ])
+
+    for name in names:
+        for size in sizes:
+            start = time.time()
+            result = run_benchmark(name, size, repeat)
+            results['results'].append(result)
+            if 'skipped' in result:
+                print('{:<45} {:>9} skipped: {}'.format(name, size, result['skipped']))
+            else:
+                print('{:<45} {:>9} best: {:.3g} s (took {:.1f} s)'.format(
+                    name, size, result['best'], time.time() - start
+                ))
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Output results: {}'.format(output_file))
+
+    if compare_file:
+        with open(compare_file) as f:
+            old = json.load(f)
+        if compare(old, results, threshold=threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--sizes',
+        dest='sizes',
+        nargs='+',
+        help='Numbers of papers to run the benchmarks for [default: 1000 10000 100000]',
+        default=[1000, 10000, 100000],
+        type=int
+    )
+    parser.add_argument(
+        '--benchmarks',
+        dest='benchmarks',
+        nargs='+',
+        help='Only run the benchmarks whose name starts with one of these [default: all]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--repeat',
+        dest='repeat',
+        help='Number of times each benchmark is timed [default: 5]',
+        default=5,
+        type=int
+    )
+    parser.add_argument(
+        '--output',
+        dest='output',
+        help='Save the results to this JSON file [default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--compare',
+        dest='compare',
+        help='Compare with the results in this JSON file, and exit with 1 if any '
+             'benchmark got slower [default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--threshold',
+        dest='threshold',
+        help='Ratio of the times above which a benchmark got slower [default: 1.1]',
+        default=1.1,
+        type=float
+    )
+    parser.add_argument(
+        '--list',
+        dest='list',
+        action='store_true',
+        help='List the benchmarks',
+        default=False
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (setup, max_size) in BENCHMARKS.items():
+            print(name if max_size is None else '{} (up to {} papers)'.format(name, max_size))
+        sys.exit()
+
+    names = [
+        name for name in BENCHMARKS
+        if not args.benchmarks or any(name.startswith(b) for b in args.benchmarks)
+    ]
+
+    main(
+        sizes=args.sizes,
+        names=names,
+        repeat=args.repeat,
+        output_file=args.output,
+        compare_file=args.compare,
+        threshold=args.threshold
+    )
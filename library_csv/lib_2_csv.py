@@ -4,10 +4,14 @@ Convert your ADS Libraries into CSV output
 """
 
 import os
+import sys
 import math
-import requests
 import argparse
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # for ads_helpers
+
+from ads_helpers import archive, decoding, http, http_cache, latency, profiling, warehouse
+
 token = None
 
 def get_config():
@@ -21,11 +25,11 @@ def get_config():
             with open(os.path.expanduser('~/.ads/dev_key')) as f:
                 token = f.read().strip()
         except IOError:
-            print('The script assumes you have your ADS developer token in the'
-                  'folder: {}'.format())
+            print('The script assumes you have your ADS developer token in the '
+                  'folder: {}'.format('~/.ads/dev_key'))
 
     return {
-        'url': 'https://api.adsabs.harvard.edu/v1/biblib',
+        'url': http.api_url('biblib'),
         'headers': {
             'Authorization': 'Bearer:{}'.format(token),
             'Content-Type': 'application/json',
@@ -41,15 +45,17 @@ def get_libraries():
 
     config = get_config()
 
-    r = requests.get(
-        '{}/libraries'.format(config['url']),
-        headers=config['headers']
-    )
+    with profiling.stage('fetch'):
+        r = http.get_session().get(
+            '{}/libraries'.format(config['url']),
+            headers=config['headers']
+        )
 
     # Collect a list of all of our libraries, this will include the number
     # of documents, the name, description, id, and other meta data
     try:
-        data = r.json()['libraries']
+        with profiling.stage('decode'):
+            data = decoding.decode(r)['libraries']
         return data
     except ValueError:
         raise ValueError(r.text)
@@ -79,19 +85,21 @@ def get_library(library_id, num_documents):
     for i in range(num_paginates):
         print('Pagination {} out of {}'.format(i+1, num_paginates))
 
-        r = requests.get(
-            '{}/libraries/{id}?start={start}&rows={rows}'.format(
-                config['url'],
-                id=library_id,
-                start=start,
-                rows=rows
-            ),
-            headers=config['headers']
-        )
+        with profiling.stage('fetch'):
+            r = http.get_session().get(
+                '{}/libraries/{id}?start={start}&rows={rows}'.format(
+                    config['url'],
+                    id=library_id,
+                    start=start,
+                    rows=rows
+                ),
+                headers=config['headers']
+            )
 
         # Get all the documents that are inside the library
         try:
-            data = r.json()['documents']
+            with profiling.stage('decode'):
+                data = decoding.decode(r)['documents']
         except ValueError:
             raise ValueError(r.text)
 
@@ -102,18 +110,15 @@ def get_library(library_id, num_documents):
     return documents
 
 
-if __name__ == '__main__':
+def main(output_file, store=None):
+    """
+    Collect all of my libraries and write them to a CSV file
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        '-s',
-        '--save-to-file',
-        dest='output_file',
-        help='Save my libraries to this file.',
-        default='private_libraries.csv'
-    )
-    args = parser.parse_args()
-    output_file = args.output_file
+    :param output_file: name of the file to write
+    :type output_file: str
+    :param store: warehouse.Warehouse, to only fetch the documents of the
+        libraries that changed since the last run
+    """
 
     # Collect libraries and their meta-data (no documents at this stage)
     libraries = get_libraries()
@@ -133,27 +138,74 @@ if __name__ == '__main__':
             .format(library['name'], library['id'])
         )
 
-        documents = get_library(
-            library_id=library['id'],
-            num_documents=library['num_documents']
-        )
+        documents = None
+        if store is not None:
+            with profiling.stage('warehouse'):
+                documents = store.library_bibcodes(library)
+            if documents is not None:
+                print('Unchanged since the last run, read from the warehouse')
+
+        if documents is None:
+            documents = get_library(
+                library_id=library['id'],
+                num_documents=library['num_documents']
+            )
+            if store is not None:
+                with profiling.stage('warehouse'):
+                    store.add_library(library, documents)
 
         output['names'].append(library['name'])
         output['num_documents'].append(library['num_documents'])
         output['bibcodes'].append(documents)
 
     # Write to file, could be above, but just separate for clarity
-    with open(output_file, 'w') as f:
+    with profiling.stage('csv'):
+        with open(output_file, 'w') as f:
 
-        # Header of file
-        f.write('#name,num_documents,bibcodes\n')
+            # Header of file
+            f.write('#name,num_documents,bibcodes\n')
 
-        for i in range(len(libraries)):
+            for i in range(len(libraries)):
 
-            f.write(
-                '{name},{num_documents},{bibcodes}\n'.format(
-                    name=output['names'][i].replace(',', ';'),
-                    num_documents=output['num_documents'][i],
-                    bibcodes='\t'.join(output['bibcodes'][i])
+                f.write(
+                    '{name},{num_documents},{bibcodes}\n'.format(
+                        name=output['names'][i].replace(',', ';'),
+                        num_documents=output['num_documents'][i],
+                        bibcodes='\t'.join(output['bibcodes'][i])
+                    )
                 )
-            )
+
+
+def add_arguments(parser):
+    """
+    Add the command line options of this script to an argparse parser
+    """
+    parser.add_argument(
+        '-s',
+        '--save-to-file',
+        dest='output_file',
+        help='Save my libraries to this file.',
+        default='private_libraries.csv'
+    )
+    warehouse.add_arguments(parser)
+    profiling.add_arguments(parser)
+    # Nothing in this report can be left out, so it has no --budget
+    latency.add_arguments(parser, budget=False)
+    http_cache.add_arguments(parser)
+    archive.add_arguments(parser)
+
+
+def run(args, parser):
+    """
+    Run the script for the command line options that were parsed
+    """
+    with profiling.profile_to(args.profile, args.profile_dir), latency.from_args(args), \
+            archive.from_args(args), http_cache.from_args(args):
+        main(output_file=args.output_file, store=warehouse.from_args(args))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    run(parser.parse_args(), parser)
@@ -16,56 +16,182 @@ Bear in mind, you will have to manually modify max_pages and rows if you are
 doing very large searches.
 """
 
+import os
 import sys
+import json
+import shutil
+import tempfile
 import numpy
 import argparse
-import matplotlib
-matplotlib.use('TkAgg')
-import seaborn  # simply importing this changes matplotlib styles
-from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import pandas
-import ads
+from collections import OrderedDict
+from datetime import datetime
 import subprocess
-from jinja2 import Template
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# matplotlib, seaborn, pandas, jinja2 and ads are only imported when they are
+# needed, as they take far longer to import than the rest of the script runs
+# for, e.g., a CSV export
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(HERE))  # for ads_helpers
+
+from ads_helpers import archive, bigquery, http, http_cache, latency, profiling, warehouse
+
+# Shared template environment, see get_template
+_environment = None
+
+# Seconds to wait for pdflatex to finish a single report
+LATEX_TIMEOUT = 120
+
+# Seconds pdflatex usually takes for a report, checked against --budget
+LATEX_COST = 2
+
+# Version of the layout of the files written by save_bundle
+BUNDLE_VERSION = 1
+
+# Fields used to fill in the metrics templates:
+# (template variable, metrics section, metrics key, format)
+METRICS_FIELDS = [
+    ('number_of_papers_total', 'basic stats', 'number of papers', None),
+    ('number_of_papers_ref', 'basic stats refereed', 'number of papers', None),
+    ('normalized_paper_total', 'basic stats', 'normalized paper count', '{0:.1f}'),
+    ('normalized_paper_ref', 'basic stats refereed', 'normalized paper count', '{0:.1f}'),
+    ('number_citing_total', 'citation stats', 'number of citing papers', None),
+    ('number_citing_ref', 'citation stats refereed', 'number of citing papers', None),
+    ('total_cites', 'citation stats', 'total number of citations', None),
+    ('total_cites_ref', 'citation stats refereed', 'total number of citations', None),
+    ('self_cite_total', 'citation stats', 'number of self-citations', None),
+    ('self_cite_ref', 'citation stats refereed', 'number of self-citations', None),
+    ('avg_cite_total', 'citation stats', 'average number of citations', '{0:.1f}'),
+    ('avg_cite_ref', 'citation stats refereed', 'average number of citations', '{0:.1f}'),
+    ('med_cite_total', 'citation stats', 'median number of citations', None),
+    ('med_cite_ref', 'citation stats refereed', 'median number of citations', None),
+    ('norm_cite_total', 'citation stats', 'normalized number of citations', '{0:.1f}'),
+    ('norm_cite_ref', 'citation stats refereed', 'normalized number of citations', '{0:.1f}'),
+    ('ref_cite_total', 'citation stats', 'total number of refereed citations', None),
+    ('ref_cite_ref', 'citation stats refereed', 'total number of refereed citations', None),
+    ('avg_ref_cite_total', 'citation stats', 'average number of refereed citations', '{0:.1f}'),
+    ('avg_ref_cite_ref', 'citation stats refereed', 'average number of refereed citations', '{0:.1f}'),
+    ('med_ref_cite_total', 'citation stats', 'median number of refereed citations', None),
+    ('med_ref_cite_ref', 'citation stats refereed', 'median number of refereed citations', None),
+    ('norm_ref_cite_total', 'citation stats', 'normalized number of refereed citations', '{0:.1f}'),
+    ('norm_ref_cite_ref', 'citation stats refereed', 'normalized number of refereed citations', '{0:.1f}'),
+    ('h_total', 'indicators', 'h', None),
+    ('h_ref', 'indicators refereed', 'h', None),
+    ('m_total', 'indicators', 'm', '{0:.1f}'),
+    ('m_ref', 'indicators refereed', 'm', '{0:.1f}'),
+    ('g_total', 'indicators', 'g', None),
+    ('g_ref', 'indicators refereed', 'g', None),
+    ('i10_total', 'indicators', 'i10', None),
+    ('i10_ref', 'indicators refereed', 'i10', None),
+    ('i100_total', 'indicators', 'i100', None),
+    ('i100_ref', 'indicators refereed', 'i100', None),
+    ('tori_total', 'indicators', 'tori', '{0:.1f}'),
+    ('tori_ref', 'indicators refereed', 'tori', '{0:.1f}'),
+    ('riq_total', 'indicators', 'riq', None),
+    ('riq_ref', 'indicators refereed', 'riq', None),
+    ('read10_total', 'indicators', 'read10', '{0:.1f}'),
+    ('read10_ref', 'indicators refereed', 'read10', '{0:.1f}'),
+    ('reads_total', 'basic stats', 'total number of reads', None),
+    ('reads_ref', 'basic stats refereed', 'total number of reads', None),
+    ('avg_reads_total', 'basic stats', 'average number of reads', '{0:.1f}'),
+    ('avg_reads_ref', 'basic stats refereed', 'average number of reads', '{0:.1f}'),
+    ('med_reads_total', 'basic stats', 'median number of reads', None),
+    ('med_reads_ref', 'basic stats refereed', 'median number of reads', None),
+    ('downloads_total', 'basic stats', 'total number of downloads', None),
+    ('downloads_ref', 'basic stats refereed', 'total number of downloads', None),
+    ('downloads_avg', 'basic stats', 'average number of downloads', '{0:.1f}'),
+    ('downloads_avg_ref', 'basic stats refereed', 'average number of downloads', '{0:.1f}'),
+    ('med_downloads', 'basic stats', 'median number of downloads', None),
+    ('med_downloads_ref', 'basic stats refereed', 'median number of downloads', None),
+]
+
+
+class LatexBuildError(Exception):
+    pass
+
+
+def get_pyplot():
+    """
+    Import matplotlib (with the seaborn styles) when a plot is requested
+    """
+    import matplotlib
+    # TkAgg unless told otherwise, e.g., MPLBACKEND=Agg on a machine without a display
+    matplotlib.use(os.getenv('MPLBACKEND', 'TkAgg'))
+    import seaborn  # simply importing this changes matplotlib styles
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Calendar units a step can be, as (number, numpy unit)
+BINSIZES = {
+    'year': (1, 'Y'),
+    'month': (1, 'M'),
+    'week': (7, 'D'),
+    'day': (1, 'D'),
+}
 
 
 def dyear(y):
     """
-    Convert delta year into a timedelta object
+    Convert delta year into a numpy timedelta64 object
     :param y: delta year
     """
-    return timedelta(days=365*y)
+    return numpy.timedelta64(int(round(y*365*86400*1e6)), 'us')
+
+
+def bin_ends(x, binsize=1):
+    """
+    End of the bin that starts at each x
+    :param x: datetime64 array
+    :param binsize: number of years, or one of year, month, week or day
+    """
+    if binsize in BINSIZES:
+        number, unit = BINSIZES[binsize]
+    elif float(binsize).is_integer():
+        number, unit = int(binsize), 'Y'
+    else:
+        return x + dyear(binsize)
+
+    # The same time into the next year (or month), as they vary in length
+    start = x.astype('datetime64[{}]'.format(unit))
+    return (start + number).astype(x.dtype) + (x - start.astype(x.dtype))
 
 
 def stepify(x, y, binsize=1):
     """
     Create a step-like version of the data.
-    :param x: x-array
+    :param x: x-array, datetime or datetime64
     :param y: y-array
-    :param binsize: length of the step size
+    :param binsize: length of the step size, as a number of years or one of
+        year, month, week or day
     """
 
-    binsize = dyear(binsize)
+    x = numpy.asarray(x).astype('datetime64[us]')
+    y = numpy.asarray(y)
+    if x.size == 0:
+        return x, y
+    end = bin_ends(x, binsize)
 
-    new_x, new_y = [x[0]], [0]
-    for i in range(len(x)):
-        new_x.extend([x[i], x[i]+binsize])
-        new_y.extend([y[i], y[i]])
+    # Both edges of every step, with a tail at 0 on either side
+    new_x = numpy.empty(2*x.size + 2, dtype=x.dtype)
+    new_x[1:-1:2] = x
+    new_x[2:-1:2] = end
+    new_x[0], new_x[-1] = new_x[1], new_x[-2]
 
-    # Add tails
-    new_x.append(x[-1]+binsize)
-    new_y.append(0)
+    new_y = numpy.zeros(2*y.size + 2, dtype=y.dtype)
+    new_y[1:-1:2] = y
+    new_y[2:-1:2] = y
 
-    return numpy.array(new_x), numpy.array(new_y)
+    return new_x, new_y
 
 
-def step(ax, x, y, label='', color='blue', lw=1):
+def step(ax, x, y, label='', color='blue', lw=1, binsize=1):
     """
     Create a step plot that is filled underneath. This is not usually possible
     using the normal ax.step() function
     """
-    x_, y_ = stepify(x, y)
+    x_, y_ = stepify(x, y, binsize=binsize)
     ax.errorbar(x_, y_, label=label, color=color, lw=lw)
     ax.fill_between(x_, 0, y_, color=color, alpha=0.5)
 
@@ -171,6 +297,8 @@ def metrics_to_pandas(metrics):
     'citations', etc.). There is a smarter recursive way to do it, so please
     update if you have time.
     """
+    import pandas
+
     years = metrics['histograms']['publications']['all publications'].keys()
     years.sort()
 
@@ -198,11 +326,81 @@ def metrics_to_pandas(metrics):
     return pandas.DataFrame(data, index=pandas.DatetimeIndex(years))
 
 
-def build_latex(metrics, orcid_id=None, plot=None, desc=None):
+def get_template(name):
+    """
+    Load a template that sits next to this script. The environment is created
+    once per process, it keeps every template it has compiled, and stores the
+    compiled byte code on disk, so only the very first report pays for parsing
+    the templates.
+
+    :param name: file name of the template
+    :type name: basestring
+    """
+    global _environment
+    if _environment is None:
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+        _environment = Environment(
+            loader=FileSystemLoader(HERE),
+            bytecode_cache=FileSystemBytecodeCache(),
+            auto_reload=False
+        )
+    return _environment.get_template(name)
+
+
+def metrics_context(metrics):
+    """
+    Pull out and format the values needed by the templates (see
+    METRICS_FIELDS). This works on a single metrics response, or on a list of
+    them, where each field is extracted for all the reports in one go.
+
+    :param metrics: data returned from metrics end point
+    :type metrics: JSON or list of JSON
+
+    :return: dict (or list of dict) that can be passed to a template
+    """
+    single = isinstance(metrics, dict)
+    reports = [metrics] if single else list(metrics)
+
+    columns = {}
+    for name, section, key, fmt in METRICS_FIELDS:
+        values = [m[section][key] for m in reports]
+        columns[name] = [fmt.format(v) for v in values] if fmt else values
+
+    contexts = [
+        dict((name, column[i]) for name, column in columns.items())
+        for i in range(len(reports))
+    ]
+    return contexts[0] if single else contexts
+
+
+def render_reports(metrics, name='mymetrics.txt.template', **kwargs):
+    """
+    Render many reports with the same template, e.g., to create the text
+    summary of thousands of metrics responses.
+
+    :param metrics: data returned from metrics end point, one per report
+    :type metrics: list of JSON
+
+    :param name: file name of the template
+    :type name: basestring
+
+    :return: generator of rendered reports
+    """
+    template = get_template(name)
+    for context in metrics_context(metrics):
+        context.update(kwargs)
+        yield template.render(**context)
+
+
+def build_latex(metrics, orcid_id=None, plot=None, desc=None, output_path='.',
+                output_name='mymetrics', timeout=LATEX_TIMEOUT):
     """
     Fill in the basic latex template and generate a PDF. This requires the
     user to have PDFLaTeX installed, otherwise it will not work.
-    # TODO: add detection of whether PDFLaTeX is installed or not.
+
+    Every build is done in its own scratch directory, so that several reports
+    can be built at the same time without overwriting each others files. The
+    finished PDF is copied to <output_path>/<output_name>.pdf.
 
     :param metrics: data returned from metrics end point
     :type metrics: JSON
@@ -212,155 +410,260 @@ def build_latex(metrics, orcid_id=None, plot=None, desc=None):
 
     :param plot: does the user want a plot created
     :type plot: boolean
-    """
 
-    # Load LaTeX template
-    with open('mymetrics.tex.template', 'r') as f:
-        latex_template = Template(f.read())
+    :param output_path: folder containing metrics.pdf, and where the PDF is saved
+    :type output_path: basestring
+
+    :param output_name: name of the PDF created (without extension)
+    :type output_name: basestring
+
+    :param timeout: seconds to wait for pdflatex before giving up
+    :type timeout: int
+
+    :return: path to the PDF created
+    """
 
     orcid = '{{\\bf ORCiD iD}}: {}'.format(orcid_id) if orcid_id else ''
     plotpdf = '\\includegraphics[height=0.95\\textheight]{metrics.pdf}' if plot else ''
     desc = desc if desc else ''
 
-    rendered_latex = latex_template.render(
-        orcid_id=orcid,
-        number_of_papers_total=metrics['basic stats']['number of papers'],
-        number_of_papers_ref=metrics['basic stats refereed']['number of papers'],
-        normalized_paper_total='{0:.1f}'.format(metrics['basic stats']['normalized paper count']),
-        normalized_paper_ref='{0:.1f}'.format(metrics['basic stats refereed']['normalized paper count']),
-        number_citing_total=metrics['citation stats']['number of citing papers'],
-        number_citing_ref=metrics['citation stats refereed']['number of citing papers'],
-        total_cites=metrics['citation stats']['total number of citations'],
-        total_cites_ref=metrics['citation stats refereed']['total number of citations'],
-        self_cite_total=metrics['citation stats']['number of self-citations'],
-        self_cite_ref=metrics['citation stats refereed']['number of self-citations'],
-        avg_cite_total='{0:.1f}'.format(metrics['citation stats']['average number of citations']),
-        avg_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['average number of citations']),
-        med_cite_total=metrics['citation stats']['median number of citations'],
-        med_cite_ref=metrics['citation stats refereed']['median number of citations'],
-        norm_cite_total='{0:.1f}'.format(metrics['citation stats']['normalized number of citations']),
-        norm_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['normalized number of citations']),
-        ref_cite_total=metrics['citation stats']['total number of refereed citations'],
-        ref_cite_ref=metrics['citation stats refereed']['total number of refereed citations'],
-        avg_ref_cite_total='{0:.1f}'.format(metrics['citation stats']['average number of refereed citations']),
-        avg_ref_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['average number of refereed citations']),
-        med_ref_cite_total=metrics['citation stats']['median number of refereed citations'],
-        med_ref_cite_ref=metrics['citation stats refereed']['median number of refereed citations'],
-        norm_ref_cite_total='{0:.1f}'.format(metrics['citation stats']['normalized number of refereed citations']),
-        norm_ref_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['normalized number of refereed citations']),
-        h_total=metrics['indicators']['h'],
-        h_ref=metrics['indicators refereed']['h'],
-        m_total='{0:.1f}'.format(metrics['indicators']['m']),
-        m_ref='{0:.1f}'.format(metrics['indicators refereed']['m']),
-        g_total=metrics['indicators']['g'],
-        g_ref=metrics['indicators refereed']['g'],
-        i10_total=metrics['indicators']['i10'],
-        i10_ref=metrics['indicators refereed']['i10'],
-        i100_total=metrics['indicators']['i100'],
-        i100_ref=metrics['indicators refereed']['i100'],
-        tori_total='{0:.1f}'.format(metrics['indicators']['tori']),
-        tori_ref='{0:.1f}'.format(metrics['indicators refereed']['tori']),
-        riq_total=metrics['indicators']['riq'],
-        riq_ref=metrics['indicators refereed']['riq'],
-        read10_total='{0:.1f}'.format(metrics['indicators']['read10']),
-        read10_ref='{0:.1f}'.format(metrics['indicators refereed']['read10']),
-        reads_total=metrics['basic stats']['total number of reads'],
-        reads_ref=metrics['basic stats refereed']['total number of reads'],
-        avg_reads_total='{0:.1f}'.format(metrics['basic stats']['average number of reads']),
-        avg_reads_ref='{0:.1f}'.format(metrics['basic stats refereed']['average number of reads']),
-        med_reads_total=metrics['basic stats']['median number of reads'],
-        med_reads_ref=metrics['basic stats refereed']['median number of reads'],
-        downloads_total=metrics['basic stats']['total number of downloads'],
-        downloads_ref=metrics['basic stats refereed']['total number of downloads'],
-        downloads_avg='{0:.1f}'.format(metrics['basic stats']['average number of downloads']),
-        downloads_avg_ref='{0:.1f}'.format(metrics['basic stats refereed']['average number of downloads']),
-        med_downloads=metrics['basic stats']['median number of downloads'],
-        med_downloads_ref=metrics['basic stats refereed']['median number of downloads'],
+    rendered_latex = get_template('mymetrics.tex.template').render(
         plot=plotpdf,
-        desc=desc
+        desc=desc,
+        orcid_id=orcid,
+        **metrics_context(metrics)
     )
 
-    # Save filled LaTeX template
-    with open('mymetrics.tex', 'w') as f:
-        f.write(rendered_latex)
-
-    # Build laTeX
-    cmd = ['pdflatex', 'mymetrics.tex']
-    print('Building LaTeX: {}'.format(' '.join(cmd)))
-    p = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+    scratch = tempfile.mkdtemp(prefix='ads-latex-')
+    try:
+        # Save filled LaTeX template, and everything it includes, in the
+        # scratch directory
+        with open(os.path.join(scratch, 'mymetrics.tex'), 'w') as f:
+            f.write(rendered_latex)
+
+        shutil.copy(os.path.join(HERE, 'ads_logo.jpg'), scratch)
+        if plot:
+            shutil.copy(os.path.join(output_path, 'metrics.pdf'), scratch)
+
+        # Build laTeX
+        cmd = ['pdflatex', '-interaction=nonstopmode', '-halt-on-error', 'mymetrics.tex']
+        print('Building LaTeX: {}'.format(' '.join(cmd)))
+        try:
+            p = subprocess.Popen(
+                cmd,
+                cwd=scratch,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except OSError:
+            raise LatexBuildError('pdflatex could not be run, is it installed?')
+
+        try:
+            out, err = p.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.communicate()
+            raise LatexBuildError('pdflatex took longer than {} s'.format(timeout))
+
+        if p.returncode != 0:
+            raise LatexBuildError(
+                'LaTeX compilation error: {}'.format(
+                    (err or out[-2000:]).decode('utf-8', 'replace')
+                )
+            )
+
+        pdf_path = os.path.join(output_path, '{}.pdf'.format(output_name))
+        shutil.copy(os.path.join(scratch, 'mymetrics.pdf'), pdf_path)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return pdf_path
+
+
+def build_latex_many(jobs, max_workers=4, timeout=LATEX_TIMEOUT):
+    """
+    Build several LaTeX reports at once, with at most max_workers pdflatex
+    processes running at any time. Results are yielded as soon as each PDF
+    is complete, not in the order they were given.
+
+    :param jobs: keyword arguments for build_latex, one dict per report. Give
+        each a different output_name (or output_path) so they do not clash
+    :type jobs: list of dict
+
+    :param max_workers: maximum number of pdflatex processes
+    :type max_workers: int
+
+    :param timeout: seconds to wait for each pdflatex before giving up
+    :type timeout: int
+
+    :return: generator of (job, PDF path, exception or None), the exception
+        being whatever stopped the report from being built
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for job in jobs:
+            kwargs = dict(job)
+            kwargs.setdefault('timeout', timeout)
+            futures[pool.submit(build_latex, **kwargs)] = job
+
+        # Any error (not only LatexBuildError, e.g., a missing figure or a
+        # broken template) is that report's result, and the others go on
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is None:
+                yield futures[future], future.result(), None
+            else:
+                yield futures[future], None, error
+
+
+def save_metrics(metrics, output_path='.'):
+    """
+    Save the simple metric values to <output_path>/metrics.txt
+
+    :param metrics: data returned from metrics end point
+    :type metrics: JSON
+
+    :param output_path: folder to save the file in
+    :type output_path: basestring
+    """
+    txt_rendered = get_template('mymetrics.txt.template').render(
+        **metrics_context(metrics)
     )
-    out, err = p.communicate()
-    if err:
-        print('LaTeX compilation error: {}'.format(err))
-
-
-def save_metrics(metrics):
-
-    with open('mymetrics.txt.template', 'r') as f:
-        txt_template = Template(f.read())
-
-        txt_rendered = txt_template.render(
-            number_of_papers_total=metrics['basic stats']['number of papers'],
-            number_of_papers_ref=metrics['basic stats refereed']['number of papers'],
-            normalized_paper_total='{0:.1f}'.format(metrics['basic stats']['normalized paper count']),
-            normalized_paper_ref='{0:.1f}'.format(metrics['basic stats refereed']['normalized paper count']),
-            number_citing_total=metrics['citation stats']['number of citing papers'],
-            number_citing_ref=metrics['citation stats refereed']['number of citing papers'],
-            total_cites=metrics['citation stats']['total number of citations'],
-            total_cites_ref=metrics['citation stats refereed']['total number of citations'],
-            self_cite_total=metrics['citation stats']['number of self-citations'],
-            self_cite_ref=metrics['citation stats refereed']['number of self-citations'],
-            avg_cite_total='{0:.1f}'.format(metrics['citation stats']['average number of citations']),
-            avg_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['average number of citations']),
-            med_cite_total=metrics['citation stats']['median number of citations'],
-            med_cite_ref=metrics['citation stats refereed']['median number of citations'],
-            norm_cite_total='{0:.1f}'.format(metrics['citation stats']['normalized number of citations']),
-            norm_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['normalized number of citations']),
-            ref_cite_total=metrics['citation stats']['total number of refereed citations'],
-            ref_cite_ref=metrics['citation stats refereed']['total number of refereed citations'],
-            avg_ref_cite_total='{0:.1f}'.format(metrics['citation stats']['average number of refereed citations']),
-            avg_ref_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['average number of refereed citations']),
-            med_ref_cite_total=metrics['citation stats']['median number of refereed citations'],
-            med_ref_cite_ref=metrics['citation stats refereed']['median number of refereed citations'],
-            norm_ref_cite_total='{0:.1f}'.format(metrics['citation stats']['normalized number of refereed citations']),
-            norm_ref_cite_ref='{0:.1f}'.format(metrics['citation stats refereed']['normalized number of refereed citations']),
-            h_total=metrics['indicators']['h'],
-            h_ref=metrics['indicators refereed']['h'],
-            m_total=metrics['indicators']['m'],
-            m_ref=metrics['indicators refereed']['m'],
-            g_total=metrics['indicators']['g'],
-            g_ref=metrics['indicators refereed']['g'],
-            i10_total=metrics['indicators']['i10'],
-            i10_ref=metrics['indicators refereed']['i10'],
-            i100_total=metrics['indicators']['i100'],
-            i100_ref=metrics['indicators refereed']['i100'],
-            tori_total='{0:.1f}'.format(metrics['indicators']['tori']),
-            tori_ref='{0:.1f}'.format(metrics['indicators refereed']['tori']),
-            riq_total=metrics['indicators']['riq'],
-            riq_ref=metrics['indicators refereed']['riq'],
-            read10_total='{0:.1f}'.format(metrics['indicators']['read10']),
-            read10_ref='{0:.1f}'.format(metrics['indicators refereed']['read10']),
-            reads_total=metrics['basic stats']['total number of reads'],
-            reads_ref=metrics['basic stats refereed']['total number of reads'],
-            avg_reads_total='{0:.1f}'.format(metrics['basic stats']['average number of reads']),
-            avg_reads_ref='{0:.1f}'.format(metrics['basic stats refereed']['average number of reads']),
-            med_reads_total=metrics['basic stats']['median number of reads'],
-            med_reads_ref=metrics['basic stats refereed']['median number of reads'],
-            downloads_total=metrics['basic stats']['total number of downloads'],
-            downloads_ref=metrics['basic stats refereed']['total number of downloads'],
-            downloads_avg='{0:.1f}'.format(metrics['basic stats']['average number of downloads']),
-            downloads_avg_ref='{0:.1f}'.format(metrics['basic stats refereed']['average number of downloads']),
-            med_downloads=metrics['basic stats']['median number of downloads'],
-            med_downloads_ref=metrics['basic stats refereed']['median number of downloads'],
-        )
 
-    with open('metrics.txt', 'w') as f:
+    with open(os.path.join(output_path, 'metrics.txt'), 'w') as f:
         f.write(txt_rendered)
 
 
+def _is_series(value):
+    """
+    Whether a section of the metrics is a set of {year: value} series
+    """
+    return (
+        isinstance(value, dict) and len(value) > 0 and
+        all(isinstance(v, dict) and all(k.isdigit() for k in v) for v in value.values())
+    )
+
+
+def _write_bundle_group(group, data, compression, contents):
+    for key, value in data.items():
+        path = '{}/{}'.format(group.name.rstrip('/'), key)
+
+        if _is_series(value):
+            # Every series of a section on the same years, so they are columns
+            subgroup = group.create_group(key)
+            years = sorted(set().union(*value.values()), key=int)
+            subgroup.create_dataset('year', data=numpy.array(years, dtype=numpy.int16))
+            for name, series in value.items():
+                values = numpy.array([series.get(y, 0) for y in years])
+                # Compressing arrays this short makes them larger
+                subgroup.create_dataset(
+                    name,
+                    data=values,
+                    compression=compression if values.size > 64 else None
+                )
+            contents[path] = {'kind': 'series', 'series': list(value), 'years': len(years)}
+
+        elif isinstance(value, dict) and all(isinstance(v, dict) for v in value.values()):
+            _write_bundle_group(group.create_group(key), value, compression, contents)
+
+        elif isinstance(value, dict):
+            # Scalar statistics, None is kept as NaN
+            subgroup = group.create_group(key)
+            for name, scalar in value.items():
+                subgroup.attrs[name] = numpy.nan if scalar is None else scalar
+            contents[path] = {'kind': 'stats', 'names': list(value)}
+
+        else:
+            import h5py
+            group.create_dataset(key, data=[str(i) for i in value], dtype=h5py.string_dtype())
+            contents[path] = {'kind': 'list', 'length': len(value)}
+
+
+def save_bundle(metrics, path, compression='gzip', orcid=None, query=None, bibcodes=None):
+    """
+    Save everything in a metrics report (histograms, time series, statistics
+    and the text report) to a single HDF5 file, with a manifest describing it.
+    Arrays are written in one go, and compressed, so that many reports can be
+    archived cheaply.
+
+    :param metrics: data returned from metrics end point
+    :type metrics: JSON
+    :param path: name of the file to write
+    :param compression: gzip, lzf or None
+    :param orcid: ORCiD iD the report is for
+    :param query: ADS query the report is for
+    :param bibcodes: bibcodes the report is for
+
+    :return: path of the file
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('Saving to hdf5 needs h5py: pip install h5py')
+
+    contents = {}
+    with h5py.File(path, 'w') as f:
+        _write_bundle_group(f.create_group('metrics'), metrics, compression, contents)
+
+        f.create_dataset(
+            'report',
+            data=get_template('mymetrics.txt.template').render(**metrics_context(metrics)),
+            dtype=h5py.string_dtype()
+        )
+        contents['/report'] = {'kind': 'text', 'template': 'mymetrics.txt.template'}
+
+        manifest = {
+            'format': 'ads-metrics-bundle',
+            'version': BUNDLE_VERSION,
+            'created': datetime.utcnow().isoformat(),
+            'orcid': orcid or None,
+            'query': query or None,
+            'bibcodes': len(bibcodes) if bibcodes else None,
+            'compression': compression,
+            'contents': contents,
+        }
+        f.create_dataset('manifest', data=json.dumps(manifest, indent=2), dtype=h5py.string_dtype())
+
+    return path
+
+
+def _read_bundle_group(group):
+    import h5py
+
+    if 'year' in group:
+        years = [str(y) for y in group['year'][()]]
+        return dict(
+            (name, dict(zip(years, dataset[()].tolist())))
+            for name, dataset in group.items() if name != 'year'
+        )
+
+    data = dict(
+        (name, None if isinstance(value, float) and numpy.isnan(value) else
+         value.item() if hasattr(value, 'item') else value)
+        for name, value in group.attrs.items()
+    )
+    for name, item in group.items():
+        if isinstance(item, h5py.Group):
+            data[name] = _read_bundle_group(item)
+        else:
+            data[name] = [i.decode('utf-8') for i in item[()]]
+    return data
+
+
+def read_bundle(path):
+    """
+    Read a bundle written by save_bundle
+
+    :return: metrics (as returned from the metrics end point), manifest
+    """
+    import h5py
+
+    with h5py.File(path, 'r') as f:
+        manifest = json.loads(f['manifest'][()])
+        metrics = _read_bundle_group(f['metrics'])
+    return metrics, manifest
+
+
 def get_numbers_of_papers_raw(sq):
     """
     Returns the number of reads vs year. This is not affected by the limit
@@ -401,7 +704,19 @@ def get_numbers_of_papers_raw(sq):
     return numpy.array(y), numpy.array(number), numpy.array(number_ref)
 
 
-def main(output_path, figure_format, orcid=False, bibcodes=False, query=False, save=False, plot=False, printable=False, test=False, desc=None):
+def get_metrics(orcid=False, bibcodes=False, query=False, test=False, store=None):
+    """
+    Resolve what the user has given into a list of bibcodes, and collect their
+    metrics from the API.
+
+    :param orcid: ORCiD iD
+    :param bibcodes: list of bibcodes
+    :param query: ADS query
+    :param test: use the ADS sandbox environment
+    :param store: warehouse.Warehouse to look the bibcodes of the query up in
+
+    :return: data returned from metrics end point
+    """
 
     # Imports should not be here, but I don't care....
     if test:
@@ -409,6 +724,8 @@ def main(output_path, figure_format, orcid=False, bibcodes=False, query=False, s
     else:
         import ads
 
+    http.share_ads_session()
+
     fl = ['id', 'bibcode']
     rows = 2000
     max_pages = 1
@@ -416,140 +733,202 @@ def main(output_path, figure_format, orcid=False, bibcodes=False, query=False, s
     print('Using rows: {} with max_pages: {}'.format(rows, max_pages))
 
     # See what the user has given to generate the metrics plot
-    if query:
-        sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages)
-        sq.execute()
-        bibcodes = [i.bibcode for i in sq.articles]
+    if (query or orcid) and store is not None:
+        if query:
+            print('You gave a query: {}'.format(query))
+        else:
+            query = 'orcid:{}'.format(orcid)
+            print('You gave an ORCiD iD: {}'.format(orcid))
+        bibcodes, _ = warehouse.search_bibcodes(store, ads, query, rows, max_pages)
+        print('Found {} bibcodes (e.g., {})'.format(len(bibcodes), bibcodes[0:4]))
+    elif query:
+        with profiling.stage('query'):
+            sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages)
+            sq.execute()
+            bibcodes = [i.bibcode for i in sq.articles]
         print('You gave a query: {}'.format(query))
         print('Found {} bibcodes (e.g., {})'.format(len(bibcodes), bibcodes[0:4]))
     elif orcid:
         query = 'orcid:{}'.format(orcid)
-        sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages)
-        sq.execute()
-        bibcodes = [i.bibcode for i in sq.articles]
+        with profiling.stage('query'):
+            sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages)
+            sq.execute()
+            bibcodes = [i.bibcode for i in sq.articles]
         print('You gave an ORCiD iD: {}'.format(orcid))
         print('Found {} bibcodes (e.g., {})'.format(len(bibcodes), bibcodes[0:4]))
     elif bibcodes:
-        sq = False
         print('You gave {} bibcodes: {}'.format(len(bibcodes), bibcodes[0:4]))
     else:
         sys.exit()
 
-    # Collect the metrics from the API
-    mq = ads.MetricsQuery(bibcodes=bibcodes)
-    metrics = mq.execute()
+    # Collect the metrics from the API (the client decodes the JSON too)
+    with profiling.stage('fetch'):
+        mq = ads.MetricsQuery(bibcodes=bibcodes)
+        return mq.execute()
 
-    if plot:
-        # Number of papers
-        y, t, r = get_numbers_of_papers(metrics)
-
-        number = dict(name='numbers', year=y, total=t, refereed=r)
-        # Number of citations
-        y, r2r, r2nr, nr2r, nr2nr = get_citations_of_papers(metrics)
-        citation = dict(name='citations', year=y, ref_to_ref=r2r, non_ref_to_ref=nr2r, ref_to_non_ref=r2nr, non_ref_to_non_ref=nr2nr)
-
-        # Indices
-        y, h, g, tori, i10, read10, i100 = get_indices_of_papers(metrics)
-        index = dict(name='indices', year=y, h=h, g=g, tori=tori, i10=i10, read10=read10, i100=i100)
-
-        # Number of reads
-        y, t, rr = get_reads_of_papers(metrics)
-        reads = dict(name='reads', year=y, total=t, reads_ref=rr)
-
-        # Define the figure and the axes
-        fig = plt.figure(0, figsize=(8.27, 11.69))
-        ax1 = fig.add_subplot(411)
-        ax2 = fig.add_subplot(412)
-        ax3 = fig.add_subplot(413)
-        ax4 = fig.add_subplot(414)
-
-        # Number of papers
-        step(ax1, number['year'], number['total'] - number['refereed'], label='Not refereed', color='green')
-        step(ax1, number['year'], number['refereed'], label='Refereed', color='blue')
-        ax1.set_ylim([0, max(number['total'])+1])
-        ax1.set_ylabel('Numer of papers')
-        leg1 = ax1.legend(loc=0)
-        leg1.draw_frame(False)
-
-        # Number of citations
-        step(ax2, citation['year'], citation['ref_to_ref'], label='Ref. citations to ref. papers', color='blue')
-        step(ax2, citation['year'], citation['ref_to_non_ref'], label='Ref. citations to non ref. papers', color='green')
-        step(ax2, citation['year'], citation['non_ref_to_ref'], label='Non ref. citations to ref. papers', color='gold')
-        step(ax2, citation['year'], citation['non_ref_to_non_ref'], label='Non ref. citations to non ref. papers', color='red')
-
-        ax2.set_ylabel('Numer of citations')
-        max_citation = max(
-            citation['ref_to_ref'].max(),
-            citation['ref_to_non_ref'].max(),
-            citation['non_ref_to_ref'].max(),
-            citation['non_ref_to_non_ref'].max()
-        )
-        ax2.set_ylim([0, max_citation+1])
-        leg2 = ax2.legend(loc=0)
-        leg2.draw_frame(False)
-
-        # Indices
-        ax3.errorbar(index['year'], index['h'], label='h Index', color='blue', lw=2, ls='-')
-        ax3.errorbar(index['year'], index['g'], label='g Index', color='green', lw=2, ls='-')
-        ax3.errorbar(index['year'], index['i10'], label='i10 Index', color='gold', lw=2, ls='-')
-        ax3.errorbar(index['year'], index['tori'], label='tori Index', color='red', lw=2, ls='-')
-        ax3.errorbar(index['year'], index['i100'], label='i100 Index', color='purple', lw=2, ls='-')
-        ax3.errorbar(index['year'], index['read10'], label='read10 Index', color='darkblue', lw=2, ls='-')
-        max_index = max(h.max(), g.max(), i10.max(), tori.max(), i100.max(), read10.max())
-
-        ax3.set_ylim([0, max_index+1])
-        leg3 = ax3.legend(loc=0, ncol=2)
-        leg3.draw_frame(False)
-
-        # Number of reads
-        step(ax4, reads['year'], reads['total'] - reads['reads_ref'], label='Non refereed', color='green')
-        step(ax4, reads['year'], reads['reads_ref'], label='Refereed', color='blue')
-        max_reads = max(
-            reads['total'].max(),
-            reads['reads_ref'].max()
-        )
 
-        min_year = reads['year'][0]
-        for i in range(len(reads['year'])):
-            if reads['total'][i] > 0 or reads['reads_ref'][i] > 0:
-                break
-            min_year = reads['year'][i]
+def get_tables(metrics):
+    """
+    Convert the metrics into the four year-ordered tables that are plotted and
+    saved to disk: numbers, citations, indices, and reads.
 
-        ax4.set_xlim([min_year, reads['year'].max()])
-        ax4.set_ylim([0, max_reads+1])
+    :param metrics: data returned from metrics end point
+    :type metrics: JSON
 
-        ax4.set_xlabel('Year')
-        ax4.set_ylabel('Number of reads')
-        leg4 = ax4.legend(loc=0)
-        leg4.draw_frame(False)
+    :return: list of dict
+    """
+    # Number of papers
+    y, t, r = get_numbers_of_papers(metrics)
+    number = dict(name='numbers', year=y, total=t, refereed=r)
 
-        figure_path = '{}/metrics.{}'.format(output_path, figure_format)
-        plt.savefig(figure_path)
+    # Number of citations
+    y, r2r, r2nr, nr2r, nr2nr = get_citations_of_papers(metrics)
+    citation = dict(name='citations', year=y, ref_to_ref=r2r, non_ref_to_ref=nr2r, ref_to_non_ref=r2nr, non_ref_to_non_ref=nr2nr)
 
-    # Save to disk if requested
-    if save == 'csv':
-        for output in [number, citation, index, reads]:
-            with open('{}/{}.{}'.format(output_path, output['name'], save), 'w') as f:
+    # Indices
+    y, h, g, tori, i10, read10, i100 = get_indices_of_papers(metrics)
+    index = dict(name='indices', year=y, h=h, g=g, tori=tori, i10=i10, read10=read10, i100=i100)
 
-                keys = [i for i in output.keys() if i != 'name' and i != 'year']
-                f.write('#year,{}\n'.format(','.join(keys)))
+    # Number of reads
+    y, t, rr = get_reads_of_papers(metrics)
+    reads = dict(name='reads', year=y, total=t, reads_ref=rr)
 
-                for i in range(len(output['year'])):
-                    f.write('{year},{other}\n'.format(
-                        year=output['year'][i].year,
-                        other=','.join([str(output[k][i]) for k in keys])
-                    ))
+    return [number, citation, index, reads]
 
-        save_metrics(metrics)
 
-    # Does the user want a printable PDF?
-    if printable:
-        build_latex(metrics, orcid_id=orcid, plot=plot, desc=desc)
+def main(output_path, figure_format, orcid=False, bibcodes=False, query=False, save=False, plot=False, printable=False, test=False, desc=None, latex_timeout=LATEX_TIMEOUT, compression='gzip', store=None):
 
+    metrics = get_metrics(orcid=orcid, bibcodes=bibcodes, query=query, test=test, store=store)
+    with profiling.stage('parse'):
+        number, citation, index, reads = get_tables(metrics)
 
-if __name__ == '__main__':
+    if plot:
+        with profiling.stage('plot'):
+            plt = get_pyplot()
+
+            # Define the figure and the axes
+            fig = plt.figure(0, figsize=(8.27, 11.69))
+            ax1 = fig.add_subplot(411)
+            ax2 = fig.add_subplot(412)
+            ax3 = fig.add_subplot(413)
+            ax4 = fig.add_subplot(414)
+
+            # Number of papers
+            step(ax1, number['year'], number['total'] - number['refereed'], label='Not refereed', color='green')
+            step(ax1, number['year'], number['refereed'], label='Refereed', color='blue')
+            ax1.set_ylim([0, max(number['total'])+1])
+            ax1.set_ylabel('Numer of papers')
+            leg1 = ax1.legend(loc=0)
+            leg1.draw_frame(False)
+
+            # Number of citations
+            step(ax2, citation['year'], citation['ref_to_ref'], label='Ref. citations to ref. papers', color='blue')
+            step(ax2, citation['year'], citation['ref_to_non_ref'], label='Ref. citations to non ref. papers', color='green')
+            step(ax2, citation['year'], citation['non_ref_to_ref'], label='Non ref. citations to ref. papers', color='gold')
+            step(ax2, citation['year'], citation['non_ref_to_non_ref'], label='Non ref. citations to non ref. papers', color='red')
+
+            ax2.set_ylabel('Numer of citations')
+            max_citation = max(
+                citation['ref_to_ref'].max(),
+                citation['ref_to_non_ref'].max(),
+                citation['non_ref_to_ref'].max(),
+                citation['non_ref_to_non_ref'].max()
+            )
+            ax2.set_ylim([0, max_citation+1])
+            leg2 = ax2.legend(loc=0)
+            leg2.draw_frame(False)
+
+            # Indices
+            ax3.errorbar(index['year'], index['h'], label='h Index', color='blue', lw=2, ls='-')
+            ax3.errorbar(index['year'], index['g'], label='g Index', color='green', lw=2, ls='-')
+            ax3.errorbar(index['year'], index['i10'], label='i10 Index', color='gold', lw=2, ls='-')
+            ax3.errorbar(index['year'], index['tori'], label='tori Index', color='red', lw=2, ls='-')
+            ax3.errorbar(index['year'], index['i100'], label='i100 Index', color='purple', lw=2, ls='-')
+            ax3.errorbar(index['year'], index['read10'], label='read10 Index', color='darkblue', lw=2, ls='-')
+            max_index = max(index[k].max() for k in ['h', 'g', 'i10', 'tori', 'i100', 'read10'])
+
+            ax3.set_ylim([0, max_index+1])
+            leg3 = ax3.legend(loc=0, ncol=2)
+            leg3.draw_frame(False)
+
+            # Number of reads
+            step(ax4, reads['year'], reads['total'] - reads['reads_ref'], label='Non refereed', color='green')
+            step(ax4, reads['year'], reads['reads_ref'], label='Refereed', color='blue')
+            max_reads = max(
+                reads['total'].max(),
+                reads['reads_ref'].max()
+            )
+
+            min_year = reads['year'][0]
+            for i in range(len(reads['year'])):
+                if reads['total'][i] > 0 or reads['reads_ref'][i] > 0:
+                    break
+                min_year = reads['year'][i]
+
+            ax4.set_xlim([min_year, reads['year'].max()])
+            ax4.set_ylim([0, max_reads+1])
+
+            ax4.set_xlabel('Year')
+            ax4.set_ylabel('Number of reads')
+            leg4 = ax4.legend(loc=0)
+            leg4.draw_frame(False)
+
+        with profiling.stage('savefig'):
+            figure_path = '{}/metrics.{}'.format(output_path, figure_format)
+            plt.savefig(figure_path)
+            plt.close(fig)
 
-    parser = argparse.ArgumentParser()
+    # Save to disk if requested
+    if save == 'csv':
+        with profiling.stage('csv'):
+            for output in [number, citation, index, reads]:
+                with open('{}/{}.{}'.format(output_path, output['name'], save), 'w') as f:
+
+                    keys = [i for i in output.keys() if i != 'name' and i != 'year']
+                    f.write('#year,{}\n'.format(','.join(keys)))
+
+                    for i in range(len(output['year'])):
+                        f.write('{year},{other}\n'.format(
+                            year=output['year'][i].year,
+                            other=','.join([str(output[k][i]) for k in keys])
+                        ))
+
+            save_metrics(metrics, output_path=output_path)
+
+    elif save == 'hdf5':
+        with profiling.stage('hdf5'):
+            bundle_path = save_bundle(
+                metrics,
+                os.path.join(output_path, 'metrics.h5'),
+                compression=None if compression == 'none' else compression,
+                orcid=orcid,
+                query=query,
+                bibcodes=bibcodes
+            )
+        print('Output bundle: {}'.format(bundle_path))
+
+    # Does the user want a printable PDF? It is left out if pdflatex would
+    # take the report over its budget
+    if printable and latency.allows('printable PDF', cost=LATEX_COST):
+        try:
+            with profiling.stage('latex'):
+                pdf_path = build_latex(
+                    metrics,
+                    orcid_id=orcid,
+                    plot=plot and figure_format == 'pdf',
+                    desc=desc,
+                    output_path=output_path,
+                    timeout=latex_timeout
+                )
+            print('Output printable PDF: {}'.format(pdf_path))
+        except LatexBuildError as error:
+            print(error)
+
+
+def add_arguments(parser):
+    """
+    Add the command line options of this script to an argparse parser
+    """
     parser.add_argument(
         '-o',
         '--output',
@@ -589,14 +968,23 @@ if __name__ == '__main__':
         nargs='+',
         type=str
     )
+    bigquery.add_arguments(parser)
     parser.add_argument(
         '--save-to-file',
         dest='save',
         help='Save plots to a given format [default: False]',
-        choices=['csv'],
+        choices=['csv', 'hdf5'],
         default=False,
         type=str
     )
+    parser.add_argument(
+        '--compression',
+        dest='compression',
+        help='Compression of the hdf5 bundle [default: gzip]',
+        choices=['gzip', 'lzf', 'none'],
+        default='gzip',
+        type=str
+    )
     parser.add_argument(
         '--printable',
         dest='printable',
@@ -624,22 +1012,54 @@ if __name__ == '__main__':
         help='Add a description at the top of the PDF',
         default=None
     )
+    parser.add_argument(
+        '--latex-timeout',
+        dest='latex_timeout',
+        help='Seconds to wait for pdflatex [default: {}]'.format(LATEX_TIMEOUT),
+        default=LATEX_TIMEOUT,
+        type=int
+    )
+    warehouse.add_arguments(parser)
+    profiling.add_arguments(parser)
+    latency.add_arguments(parser)
+    http_cache.add_arguments(parser)
+    archive.add_arguments(parser)
 
-    args = parser.parse_args()
 
-    if args.orcid is None and args.query is None and args.bibcodes is None:
+def run(args, parser):
+    """
+    Run the script for the command line options that were parsed
+    """
+    if args.orcid is None and args.query is None and args.bibcodes is None and args.bibcodes_file is None:
         parser.print_help()
         sys.exit()
 
-    main(
-        output_path=args.output,
-        figure_format=args.format,
-        orcid=args.orcid,
-        query=args.query,
-        bibcodes=args.bibcodes,
-        save=args.save,
-        printable=args.printable,
-        plot=args.plot,
-        test=args.test,
-        desc=args.description
-    )
+    # Bibcodes given on the command line and in files, without repeats
+    bibcodes = None
+    if args.bibcodes or args.bibcodes_file:
+        bibcodes = list(OrderedDict.fromkeys((args.bibcodes or []) + (bigquery.from_args(args) or [])))
+
+    with profiling.profile_to(args.profile, args.profile_dir), latency.from_args(args), \
+            archive.from_args(args), http_cache.from_args(args):
+        main(
+            output_path=args.output,
+            figure_format=args.format,
+            orcid=args.orcid,
+            query=args.query,
+            bibcodes=bibcodes,
+            save=args.save,
+            printable=args.printable,
+            plot=args.plot,
+            test=args.test,
+            desc=args.description,
+            latex_timeout=args.latex_timeout,
+            compression=args.compression,
+            store=warehouse.from_args(args)
+        )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    run(parser.parse_args(), parser)
@@ -10,55 +10,125 @@ modify the rows and max_pages.
 
 rows: number of items returned in a single request (max: 2000)
 max_pages: number of times to iterate over the rows returned (starts: 0)
+
+For queries that find millions of papers, --sample estimates the plots from a
+random sample of them instead, with confidence intervals.
 """
 
+import os
 import sys
 import numpy
 import argparse
-import matplotlib
-matplotlib.use('TkAgg')
-import seaborn  # simply importing this changes matplotlib styles
+from collections import OrderedDict
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import ads
+
+# matplotlib, seaborn and ads are only imported when they are needed, as they
+# take far longer to import than the rest of the script runs for
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(HERE))  # for ads_helpers
+
+from ads_helpers import archive, bigquery, http, http_cache, latency, paper_store, profiling, warehouse
+
+# Fields of the papers that are requested
+FIELDS = ['bibcode', 'year', 'pubdate', 'read_count', 'citation_count', 'property']
+
+# A refresh asks for the papers indexed a little before the last one started,
+# to catch those that were being indexed while it ran
+REFRESH_OVERLAP = timedelta(minutes=10)
+
+# Format of the dates the search engine takes
+SOLR_DATE = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def get_pyplot():
+    """
+    Import matplotlib (with the seaborn styles) when a plot is requested
+    """
+    import matplotlib
+    # TkAgg unless told otherwise, e.g., MPLBACKEND=Agg on a machine without a display
+    matplotlib.use(os.getenv('MPLBACKEND', 'TkAgg'))
+    import seaborn  # simply importing this changes matplotlib styles
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Calendar units a step can be, as (number, numpy unit)
+BINSIZES = {
+    'year': (1, 'Y'),
+    'month': (1, 'M'),
+    'week': (7, 'D'),
+    'day': (1, 'D'),
+}
 
 
 def dyear(y):
     """
-    Convert delta year into a timedelta object
+    Convert delta year into a numpy timedelta64 object
     :param y: delta year
     """
-    return timedelta(days=365*y)
+    return numpy.timedelta64(int(round(y*365*86400*1e6)), 'us')
+
+
+def bin_ends(x, binsize=1, bins=1):
+    """
+    End of the bin that starts at each x (or, with bins=-1, start of the bin
+    that ends at each x)
+    :param x: datetime64 array
+    :param binsize: number of years, or one of year, month, week or day
+    :param bins: number of bins to move by
+    """
+    if binsize in BINSIZES:
+        number, unit = BINSIZES[binsize]
+    elif float(binsize).is_integer():
+        number, unit = int(binsize), 'Y'
+    else:
+        return x + bins*dyear(binsize)
+
+    # The same time into the next year (or month), as they vary in length
+    start = x.astype('datetime64[{}]'.format(unit))
+    return (start + bins*number).astype(x.dtype) + (x - start.astype(x.dtype))
 
 
 def stepify(x, y, binsize=1):
     """
     Create a step-like version of the data.
-    :param x: x-array
+    :param x: x-array, datetime or datetime64
     :param y: y-array
-    :param binsize: length of the step size
+    :param binsize: length of the step size, as a number of years or one of
+        year, month, week or day
     """
 
-    binsize = dyear(binsize)
+    x = numpy.asarray(x).astype('datetime64[us]')
+    y = numpy.asarray(y)
+    if x.size == 0:
+        return x, y
 
-    new_x, new_y = [x[0]], [0]
-    for i in range(len(x)):
-        new_x.extend([x[i], x[i]+binsize])
-        new_y.extend([y[i], y[i]])
+    # Centre each step on its x, reaching halfway to the bins either side of
+    # it, so neighbouring steps meet even when their bins differ in length
+    # (e.g., months)
+    left = x - (x - bin_ends(x, binsize, bins=-1)) / 2
+    right = x + (bin_ends(x, binsize) - x) / 2
 
-    # Add tails
-    new_x.append(x[-1]+binsize)
-    new_y.append(0)
+    # Both edges of every step, with a tail at 0 on either side
+    new_x = numpy.empty(2*x.size + 2, dtype=x.dtype)
+    new_x[1:-1:2] = left
+    new_x[2:-1:2] = right
+    new_x[0], new_x[-1] = new_x[1], new_x[-2]
 
-    return numpy.array(new_x) - binsize/2.0, numpy.array(new_y)
+    new_y = numpy.zeros(2*y.size + 2, dtype=y.dtype)
+    new_y[1:-1:2] = y
+    new_y[2:-1:2] = y
 
+    return new_x, new_y
 
-def step(ax, x, y, label='', color='blue', lw=1):
+
+def step(ax, x, y, label='', color='blue', lw=1, binsize=1):
     """
     Create a step plot that is filled underneath. This is not usually possible
     using the normal ax.step() function
     """
-    x_, y_ = stepify(x, y)
+    x_, y_ = stepify(x, y, binsize=binsize)
     ax.errorbar(x_, y_, label=label, color=color, lw=lw)
     ax.fill_between(x_, 0, y_, color=color, alpha=0.5)
 
@@ -123,17 +193,163 @@ def h_index(citations):
     :param citations: list of citations (sorted or unsorted)
     """
 
-    c = list(citations)
-    c.sort(reverse=True)
+    c = numpy.sort(numpy.asarray(citations))[::-1]
+
+    # The first rank that has fewer citations than papers before it
+    below = numpy.flatnonzero(numpy.arange(c.size) > c)
+    if below.size:
+        return int(below[0])
+
+    return int(c.size)
+
+
+def z_score(confidence):
+    """
+    Number of standard deviations either side of the mean that contain a
+    fraction confidence of a normal distribution, e.g., 1.96 for 0.95
+    :param confidence: confidence level, between 0 and 1
+    """
+    from statistics import NormalDist
+    return NormalDist().inv_cdf(0.5 + confidence / 2.)
+
 
-    for i in range(len(c)):
-        if i > c[i]:
-            return i
+def finite_population(n, population):
+    """
+    Correction to the standard error when the sample is a large part of the
+    papers that were found, i.e., sampled without replacement
+    :param n: size of the sample
+    :param population: number of papers found
+    """
+    if population <= 1:
+        return 0.
+    return numpy.sqrt(max(population - n, 0) / (population - 1.))
 
-    return len(c)
 
+def proportion_interval(k, n, z, population=None):
+    """
+    Wilson score interval of a proportion, which stays within [0, 1] for the
+    small counts of the first and last years
+    :param k: number of the sample with the property (array)
+    :param n: size of the sample
+    :param z: z-score of the confidence level
+    :param population: number of papers found, to narrow the interval when the
+        sample is a large part of them
+    :return: proportion, lower and upper bounds
+    """
+    k = numpy.asarray(k, dtype=float)
+    p = k / n
+    fpc = 1. if population is None else finite_population(n, population)
+    if fpc == 0:
+        # Every paper found is in the sample, so the proportion is known
+        return p, p, p
+
+    denominator = 1 + z**2 / n
+    centre = (p + z**2 / (2*n)) / denominator
+    half_width = z * numpy.sqrt(p*(1 - p)/n + z**2/(4*n**2)) / denominator * fpc
+
+    # The centre is pulled towards 1/2, so keep p within the bounds when the
+    # correction makes them narrow
+    lower = numpy.clip(numpy.minimum(centre - half_width, p), 0, 1)
+    upper = numpy.clip(numpy.maximum(centre + half_width, p), 0, 1)
+    return p, lower, upper
+
+
+def total_interval(values, population, z):
+    """
+    Estimate of the sum of values over every paper found, from a sample
+    :param values: values of the papers in the sample
+    :param population: number of papers found
+    :param z: z-score of the confidence level
+    :return: estimate, lower and upper bounds
+    """
+    values = numpy.asarray(values, dtype=float)
+    n = values.size
+    estimate = population * values.mean()
+    if n < 2:
+        return estimate, estimate, estimate
+
+    error = z * population * values.std(ddof=1) / numpy.sqrt(n) * finite_population(n, population)
+    return estimate, max(estimate - error, 0), estimate + error
 
-def main(output_path, figure_format, orcid=False, query=False, save=False, plot=False, test=False, log=False, rows=200, max_pages=1):
+
+def rank_interval(values, population, z):
+    """
+    Estimate the values of every paper found, ordered from the largest, from
+    a sample. Each paper of the sample stands in for population/n papers, and
+    the bounds are the sample order statistics that contain the
+    same quantile with the given confidence.
+    :param values: values of the papers in the sample
+    :param population: number of papers found
+    :param z: z-score of the confidence level
+    :return: last rank (out of population) each paper of the sample stands
+        in for, estimate, lower and upper bounds
+    """
+    values = numpy.sort(numpy.asarray(values))[::-1]
+    n = values.size
+    i = numpy.arange(n)
+
+    q = (i + 0.5) / n
+    spread = z * numpy.sqrt(n * q * (1 - q)) * finite_population(n, population)
+    lower = values[numpy.minimum(numpy.ceil(i + spread).astype(int), n - 1)]
+    upper = values[numpy.maximum(numpy.floor(i - spread).astype(int), 0)]
+
+    rank = (i + 1.) * population / n
+    return rank, values, lower, upper
+
+
+def h_index_of_curve(rank, values):
+    """
+    H-index of a rank curve that is only known at some ranks, the largest h
+    with h papers of at least h
+    :param rank: rank of each value, from 1
+    :param values: values, from the largest
+    """
+    if len(values) == 0:
+        return 0
+    return int(numpy.floor(numpy.max(numpy.minimum(rank, values))))
+
+
+def get_papers_of_bibcodes(session, bibcodes, store=None):
+    """
+    Get the papers of a list of bibcodes through the bigquery end point, a
+    chunk of bibcodes at a time
+
+    :param session: session of Andy Casey's client, which carries the token
+    :param store: warehouse.Warehouse to look papers up in before the API
+
+    :return: list of papers, most cited first
+    """
+    papers = {}
+    if store is not None:
+        with profiling.stage('warehouse'):
+            papers = store.papers(bibcodes)
+    missing = [b for b in bibcodes if b not in papers]
+    print('Papers from the warehouse: {}, from the API: {}'.format(
+        len(bibcodes) - len(missing), len(missing)
+    ))
+
+    fetched = bigquery.search_documents(session, {}, missing, FIELDS) if missing else []
+    if store is not None and fetched:
+        with profiling.stage('warehouse'):
+            store.add_papers(fetched)
+    papers.update((i.bibcode, i) for i in fetched)
+
+    # In the same order as a search sorted by citations
+    p = [papers[b] for b in bibcodes if b in papers]
+    p.sort(key=lambda i: -(i.citation_count or 0))
+    return p
+
+
+def get_papers(orcid=False, query=False, test=False, rows=200, max_pages=1, store=None, bibcodes=None):
+    """
+    Search for the papers of an ORCiD iD or a query, or get those of a list
+    of bibcodes
+
+    :param store: warehouse.Warehouse to look papers up in before the API
+    :param bibcodes: list of bibcodes, used instead of the ORCiD iD or query
+
+    :return: list of ads.Article, number of papers found, query
+    """
 
     # Imports should not be here, but I don't care....
     if test:
@@ -141,130 +357,458 @@ def main(output_path, figure_format, orcid=False, query=False, save=False, plot=
     else:
         import ads
 
-    fl = ['bibcode', 'year', 'pubdate', 'read_count', 'citation_count', 'property']
+    session = http.share_ads_session()
+
+    fl = FIELDS
+
+    if bibcodes is not None:
+        print('You gave {} bibcodes: {}'.format(len(bibcodes), bibcodes[0:4]))
+        p = get_papers_of_bibcodes(session, bibcodes, store=store)
+        if len(p) < len(bibcodes):
+            print('Warning: {} of the bibcodes were not found'.format(len(bibcodes) - len(p)))
+        return p, len(p), 'bibcodes'
 
     print('Using rows: {} with max_pages: {}'.format(rows, max_pages))
     print('Field parameters requested: {}'.format(fl))
 
     # See what the user has given to generate the metrics plot
     if query:
-        sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages, sort='citation_count desc')
-        p = list(sq)
-        bibcodes = [i.bibcode for i in sq.articles]
         print('You gave a query: {}'.format(query))
-        print('Found {} bibcodes (e.g., {})'.format(len(bibcodes), bibcodes[0:4]))
     elif orcid:
         query = 'orcid:{}'.format(orcid)
-        sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages, sort='citation_count desc')
-        p = list(sq)
-        bibcodes = [i.bibcode for i in sq.articles]
         print('You gave an ORCiD iD: {}'.format(orcid))
-        print('Found {} bibcodes (e.g., {})'.format(len(bibcodes), bibcodes[0:4]))
     else:
         sys.exit()
 
+    if store is None:
+        with profiling.stage('fetch'):
+            sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages, sort='citation_count desc')
+            p = list(sq)
+            num_found = sq.response.numFound
+    else:
+        # Only the papers that are not in the warehouse (or are stale) are fetched
+        p, num_found = warehouse.search_papers(
+            store, ads, query, fl, rows, max_pages, sort='citation_count desc'
+        )
+    bibcodes = [i.bibcode for i in p]
+    print('Found {} bibcodes (e.g., {})'.format(len(bibcodes), bibcodes[0:4]))
+
+    return p, num_found, query
+
+
+def refresh_papers(store_path, query, test=False, rows=2000, max_pages=100):
+    """
+    Update the papers kept by --store with only those that were indexed (new,
+    or with new citations or reads) since they were last fetched, and drop
+    those the query no longer finds (from the list of bibcodes it finds,
+    which is far smaller than the papers themselves)
+
+    :param store_path: folder the papers are kept in
+    :param query: query the papers were found by
+    :param max_pages: largest number of pages of changes (or of bibcodes) to
+        ask for, more than this and every paper is downloaded again
+
+    :return: columns and number of papers found, or None if every paper has
+        to be downloaded again
+    """
+    try:
+        columns, manifest = paper_store.load_columns(store_path, mmap_mode=None)
+    except paper_store.StoreException as error:
+        print('{}, downloading every paper'.format(error))
+        return None
+
+    if manifest.get('query') != query or not manifest.get('synced'):
+        print('The papers kept in {} are not for this query, downloading every paper'.format(store_path))
+        return None
+    if manifest.get('num_found') is not None and manifest['papers'] < manifest['num_found']:
+        print('Only some of the papers found are kept, downloading every paper')
+        return None
+
+    if test:
+        import ads.sandbox as ads
+    else:
+        import ads
+
+    http.share_ads_session()
+
+    since = datetime.strptime(manifest['synced'], SOLR_DATE) - REFRESH_OVERLAP
+    with profiling.stage('fetch'):
+        sq = ads.SearchQuery(
+            q='({}) AND indexstamp:["{}" TO *]'.format(query, since.strftime(SOLR_DATE)),
+            fl=FIELDS,
+            rows=rows,
+            max_pages=max_pages
+        )
+        changed = list(sq)
+        if changed and len(changed) < sq.response.numFound:
+            print('More than {} papers changed, downloading every paper'.format(len(changed)))
+            return None
+
+        # Papers can stop matching the query (e.g., be taken off an ORCiD
+        # record) without being indexed again, so the bibcodes it finds now
+        # tell which of those kept to drop
+        found = ads.SearchQuery(q=query, fl=['bibcode'], rows=rows, max_pages=max_pages)
+        found_bibcodes = numpy.array([i.bibcode for i in found])
+        num_found = found.response.numFound
+        if found_bibcodes.size < num_found:
+            print('More than {} papers are found, downloading every paper'.format(found_bibcodes.size))
+            return None
+
+    with profiling.stage('parse'):
+        columns, updated, added = paper_store.merge_columns(
+            columns, paper_store.papers_to_columns(changed)
+        )
+        kept = numpy.isin(columns['bibcode'], found_bibcodes)
+        if not kept.all():
+            columns = OrderedDict((k, v[kept]) for k, v in columns.items())
+    print('Papers indexed since {}: {} ({} updated, {} new, {} no longer found)'.format(
+        since.strftime(SOLR_DATE), len(changed), updated, added, int((~kept).sum())
+    ))
+
+    if columns['bibcode'].size != num_found:
+        print('{} papers are kept, but {} are found (e.g., some were not indexed again), '
+              'downloading every paper'.format(columns['bibcode'].size, num_found))
+        return None
+
+    return columns, num_found
+
+
+def get_numbers_of_papers(year, refereed):
+    """
+    Number of papers, and of refereed papers, in every year from the first
+    to the last, from the columns of the papers
+    :param year: year of each paper (array)
+    :param refereed: whether each paper is refereed (array)
+    """
+    year = numpy.asarray(year, dtype=numpy.int64)
+    refereed = numpy.asarray(refereed, dtype=bool)
+
+    first = year.min()
+    total_paper = numpy.bincount(year - first)
+    ref_paper = numpy.bincount(year[refereed] - first, minlength=total_paper.size)
+    y = numpy.array([datetime(int(first) + i, 1, 1) for i in range(total_paper.size)])
+
+    return y, total_paper, ref_paper
+
+
+def main(output_path, figure_format, orcid=False, query=False, save=False, plot=False, test=False, log=False, rows=200, max_pages=1, store=None, store_path=None, from_store=None, refresh=False, bibcodes=None):
+    """
+    :param store: warehouse.Warehouse to look papers up in before the API
+    :param bibcodes: list of bibcodes to use instead of the ORCiD iD or query
+    :param store_path: folder to keep the columns of the papers in, to plot
+        them again later
+    :param from_store: folder the columns of the papers were kept in, which
+        are used instead of searching
+    :param refresh: only fetch the papers that changed since they were kept
+        in store_path
+    """
+
+    if from_store:
+        with profiling.stage('store'):
+            columns, manifest = paper_store.load_columns(from_store)
+        num_found = manifest.get('num_found')
+        print('Read the papers of: {} (saved {}) from: {}'.format(
+            manifest.get('query'), manifest.get('saved'), from_store
+        ))
+    else:
+        synced = datetime.utcnow()
+
+        refreshed = None
+        if refresh:
+            query = query or 'orcid:{}'.format(orcid)
+            refreshed = refresh_papers(store_path, query, test=test)
+
+        if refreshed is None:
+            p, num_found, query = get_papers(
+                orcid=orcid, query=query, test=test, rows=rows, max_pages=max_pages, store=store,
+                bibcodes=bibcodes
+            )
+            with profiling.stage('parse'):
+                columns = paper_store.papers_to_columns(p)
+        else:
+            columns, num_found = refreshed
+
+        if store_path:
+            with profiling.stage('store'):
+                paper_store.save_columns(
+                    store_path, columns, query=query, num_found=num_found,
+                    synced=synced.strftime(SOLR_DATE)
+                )
+            print('Output papers: {}'.format(store_path))
+
     # Number found
-    print('Number of results found: {}'.format(sq.response.numFound))
-    print('Number of results downloaded: {}'.format(len(sq.articles)))
+    print('Number of results found: {}'.format(num_found))
+    print('Number of results downloaded: {}'.format(columns['bibcode'].size))
 
     # Number of papers
-    y, tot_pap, ref_pap = get_numbers_of_papers_raw(p)
+    with profiling.stage('parse'):
+        y, tot_pap, ref_pap = get_numbers_of_papers(columns['year'], columns['refereed'])
 
     # Collect the metrics from the API
     if plot:
-        # Define the figure and the axes
-        fig = plt.figure(0, figsize=(8.27, 11.69))
-        ax1 = fig.add_subplot(311)
-        ax2 = fig.add_subplot(312)
-        ax3 = fig.add_subplot(313)
-
-        # Number of papers
-        step(ax1, y, tot_pap - ref_pap, label='Not refereed: {}'.format(tot_pap.sum() - ref_pap.sum()), color='green')
-        step(ax1, y, ref_pap, label='Refereed: {}'.format(ref_pap.sum()), color='blue')
-
-        y_max = max((tot_pap-ref_pap).max(), ref_pap.max()) + 1
-        ax1.set_ylim([0, y_max])
-        ax1.set_ylabel('Numer of papers')
-        ax1.set_xlabel('Year')
-        leg1 = ax1.legend(loc=0)
-        leg1.draw_frame(False)
-
-        # Number of citations
-        tot_cite = numpy.array([i.citation_count for i in sq.articles])
-        h = h_index(tot_cite)
-        ax2.errorbar(numpy.arange(1, tot_cite.size+1, 1), tot_cite, label='Total citations: {}'.format(int(tot_cite.sum())), ls='-', color='blue', lw=3, alpha=0.5)
-        h_x = numpy.arange(0, h+1, 1)
-        h_y = numpy.array([h for i in h_x])
-        ax2.errorbar(h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h))
-        ax2.errorbar(h_y, h_x, lw=3, color='black', alpha=0.5)
-
-        ax2.set_ylabel('Total numer of citations per paper')
-        leg2 = ax2.legend(loc=0)
-        leg2.draw_frame(False)
-
-        y_max = tot_cite.max() + 1
-        y_min = 0
-        if log:
-            ax2.set_yscale('log')
-
-        ax2.set_ylim([y_min, y_max])
-
-        x_max = tot_cite.size + 1
-        ax2.set_xlim([0, x_max])
-
-        # Number of reads
-        tot_read = [i.read_count for i in sq.articles]
-        tot_read.sort(reverse=True)
-        tot_read = numpy.array(tot_read)
-
-        h = h_index(tot_read)
-        ax3.errorbar(numpy.arange(1, tot_read.size+1, 1), tot_read, label='Total reads: {}'.format(int(tot_read.sum())), ls='-', color='blue', lw=3, alpha=0.5)
-
-        h_x = numpy.arange(0, h+1, 1)
-        h_y = numpy.array([h for i in h_x])
-        ax3.errorbar(h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h))
-        ax3.errorbar(h_y, h_x, lw=3, color='black', alpha=0.5)
-
-        ax3.set_ylabel('Total numer of reads per paper')
-        leg3 = ax3.legend(loc=0)
-        leg3.draw_frame(False)
-        if log:
-            ax3.set_yscale('log')
-
-        ax3.set_ylim([0, tot_read.max()+1])
-
-        im = plt.imread('ads_logo.jpg')
-        newax = fig.add_axes([0.1, 0.9, 0.8, 0.1], anchor='NW', aspect='equal')
-        newax.imshow(im)
-        newax.axis('off')
-
-        figure_path = '{}/search_metrics.{}'.format(output_path, figure_format)
-        plt.savefig(figure_path)
+        with profiling.stage('plot'):
+            plt = get_pyplot()
+
+            # Define the figure and the axes
+            fig = plt.figure(0, figsize=(8.27, 11.69))
+            ax1 = fig.add_subplot(311)
+            ax2 = fig.add_subplot(312)
+            ax3 = fig.add_subplot(313)
+
+            # Number of papers
+            step(ax1, y, tot_pap - ref_pap, label='Not refereed: {}'.format(tot_pap.sum() - ref_pap.sum()), color='green')
+            step(ax1, y, ref_pap, label='Refereed: {}'.format(ref_pap.sum()), color='blue')
+
+            y_max = max((tot_pap-ref_pap).max(), ref_pap.max()) + 1
+            ax1.set_ylim([0, y_max])
+            ax1.set_ylabel('Numer of papers')
+            ax1.set_xlabel('Year')
+            leg1 = ax1.legend(loc=0)
+            leg1.draw_frame(False)
+
+            # Number of citations, sorted as the papers are not always in
+            # citation order (e.g., papers refetched from the warehouse carry
+            # newer counts than the order of the search they were found by)
+            tot_cite = numpy.sort(columns['citation_count'])[::-1]
+            h = h_index(tot_cite)
+            ax2.errorbar(numpy.arange(1, tot_cite.size+1, 1), tot_cite, label='Total citations: {}'.format(int(tot_cite.sum())), ls='-', color='blue', lw=3, alpha=0.5)
+            h_x = numpy.arange(0, h+1, 1)
+            h_y = numpy.array([h for i in h_x])
+            ax2.errorbar(h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h))
+            ax2.errorbar(h_y, h_x, lw=3, color='black', alpha=0.5)
+
+            ax2.set_ylabel('Total numer of citations per paper')
+            leg2 = ax2.legend(loc=0)
+            leg2.draw_frame(False)
+
+            y_max = tot_cite.max() + 1
+            y_min = 0
+            if log:
+                ax2.set_yscale('log')
+
+            ax2.set_ylim([y_min, y_max])
+
+            x_max = tot_cite.size + 1
+            ax2.set_xlim([0, x_max])
+
+            # Number of reads
+            tot_read = numpy.sort(columns['read_count'])[::-1]
+
+            h = h_index(tot_read)
+            ax3.errorbar(numpy.arange(1, tot_read.size+1, 1), tot_read, label='Total reads: {}'.format(int(tot_read.sum())), ls='-', color='blue', lw=3, alpha=0.5)
+
+            h_x = numpy.arange(0, h+1, 1)
+            h_y = numpy.array([h for i in h_x])
+            ax3.errorbar(h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h))
+            ax3.errorbar(h_y, h_x, lw=3, color='black', alpha=0.5)
+
+            ax3.set_ylabel('Total numer of reads per paper')
+            leg3 = ax3.legend(loc=0)
+            leg3.draw_frame(False)
+            if log:
+                ax3.set_yscale('log')
+
+            ax3.set_ylim([0, tot_read.max()+1])
+
+            im = plt.imread(os.path.join(HERE, 'ads_logo.jpg'))
+            newax = fig.add_axes([0.1, 0.9, 0.8, 0.1], anchor='NW', aspect='equal')
+            newax.imshow(im)
+            newax.axis('off')
+
+        with profiling.stage('savefig'):
+            figure_path = '{}/search_metrics.{}'.format(output_path, figure_format)
+            plt.savefig(figure_path)
+            plt.close(fig)
 
     # Save to disk if requested
     if save == 'csv':
-        with open('{}/number.csv'.format(output_path), 'w') as f:
+        with profiling.stage('csv'):
+            with open('{}/number.csv'.format(output_path), 'w') as f:
+
+                    f.write('#year,total_number,refereed_number\n')
+                    for i in range(len(y)):
+                        f.write('{year},{tot},{ref}\n'.format(
+                            year=y[i].year,
+                            tot=tot_pap[i],
+                            ref=ref_pap[i]
+                        ))
+            with open('{}/citation_read.csv'.format(output_path), 'w') as f:
+                f.write('#bibcode,citation_count,read_count\n')
+                for bib, cit, read in zip(columns['bibcode'], columns['citation_count'], columns['read_count']):
+                    f.write('{bib},{cit},{read}\n'.format(
+                        bib=bib.decode('utf-8'),
+                        cit=cit,
+                        read=read
+                    ))
+
+
+def main_sample(output_path, figure_format, orcid=False, query=False, save=False, plot=False, test=False, log=False, sample=2000, seed=0, confidence=0.95):
+    """
+    Estimate the plots from a random sample of the papers found, for queries
+    that find far too many papers to download them all
+
+    :param sample: number of papers in the sample
+    :param seed: seed of the random order, the same seed gives the same sample
+    :param confidence: confidence level of the intervals
+    """
+
+    if test:
+        import ads.sandbox as ads
+    else:
+        import ads
+
+    http.share_ads_session()
+
+    fl = FIELDS
+
+    if orcid:
+        query = 'orcid:{}'.format(orcid)
+        print('You gave an ORCiD iD: {}'.format(orcid))
+    elif query:
+        print('You gave a query: {}'.format(query))
+    else:
+        sys.exit()
+
+    # The search engine orders the papers randomly (but repeatably for a seed),
+    # so the first papers are a simple random sample of them
+    rows = min(sample, 2000)
+    max_pages = int(numpy.ceil(sample / float(rows)))
+    with profiling.stage('fetch'):
+        sq = ads.SearchQuery(q=query, fl=fl, rows=rows, max_pages=max_pages, sort='random_{} asc'.format(seed))
+        p = list(sq)[:sample]
+
+    population = sq.response.numFound
+    n = len(p)
+    print('Number of results found: {}'.format(population))
+    print('Number of results in the sample: {} (seed: {})'.format(n, seed))
+    if n == 0:
+        sys.exit()
+
+    z = z_score(confidence)
+
+    with profiling.stage('parse'):
+        y, tot_sample, ref_sample = get_numbers_of_papers_raw(p)
+        unref_sample = tot_sample - ref_sample
+
+        # Papers per year, as a proportion of the sample scaled up to the
+        # number found
+        _, ref_lower, ref_upper = proportion_interval(ref_sample, n, z, population=population)
+        _, unref_lower, unref_upper = proportion_interval(unref_sample, n, z, population=population)
+        ref_pap = population * ref_sample / float(n)
+        unref_pap = population * unref_sample / float(n)
+        ref_lower, ref_upper = population * ref_lower, population * ref_upper
+        unref_lower, unref_upper = population * unref_lower, population * unref_upper
+
+        _, tot_lower, tot_upper = proportion_interval(tot_sample, n, z, population=population)
+        tot_pap = population * tot_sample / float(n)
+        tot_lower, tot_upper = population * tot_lower, population * tot_upper
+
+        refereed = proportion_interval(ref_sample.sum(), n, z, population=population)
+
+        citations = numpy.array([i.citation_count for i in p])
+        reads = numpy.array([i.read_count for i in p])
+        cite_total = total_interval(citations, population, z)
+        read_total = total_interval(reads, population, z)
+        cite_rank = rank_interval(citations, population, z)
+        read_rank = rank_interval(reads, population, z)
+
+        cite_h = [h_index_of_curve(cite_rank[0], values) for values in cite_rank[1:]]
+        read_h = [h_index_of_curve(read_rank[0], values) for values in read_rank[1:]]
+
+    print('Estimates with {:.0%} confidence intervals:'.format(confidence))
+    print('  Refereed fraction: {:.3f} ({:.3f} to {:.3f})'.format(*[float(i) for i in refereed]))
+    print('  Total citations: {:.0f} ({:.0f} to {:.0f})'.format(*cite_total))
+    print('  Total reads: {:.0f} ({:.0f} to {:.0f})'.format(*read_total))
+    print('  Citation H-index: {} ({} to {})'.format(*cite_h))
+    print('  Read H-index: {} ({} to {})'.format(*read_h))
 
-                f.write('#year,total_number,refereed_number\n')
+    if plot:
+        with profiling.stage('plot'):
+            plt = get_pyplot()
+
+            fig = plt.figure(0, figsize=(8.27, 11.69))
+            ax1 = fig.add_subplot(311)
+            ax2 = fig.add_subplot(312)
+            ax3 = fig.add_subplot(313)
+
+            # Number of papers, with the interval of each year as an error bar
+            x = numpy.asarray(y).astype('datetime64[us]')
+            step(ax1, x, unref_pap, label='Not refereed: ~{:.0f}'.format(unref_pap.sum()), color='green')
+            step(ax1, x, ref_pap, label='Refereed: ~{:.0f}'.format(ref_pap.sum()), color='blue')
+            for estimate, lower, upper, color in [(unref_pap, unref_lower, unref_upper, 'green'),
+                                                  (ref_pap, ref_lower, ref_upper, 'blue')]:
+                ax1.errorbar(x, estimate, yerr=[estimate - lower, upper - estimate],
+                             fmt='none', ecolor=color, capsize=2, alpha=0.8)
+
+            ax1.set_ylim([0, max(unref_upper.max(), ref_upper.max()) * 1.05 + 1])
+            ax1.set_ylabel('Numer of papers (estimated)')
+            ax1.set_xlabel('Year')
+            ax1.set_title('Estimated from {} of {} papers, {:.0%} confidence'.format(n, population, confidence))
+            leg1 = ax1.legend(loc=0)
+            leg1.draw_frame(False)
+
+            # Rank curves, with the interval they lie in
+            for ax, rank, total, h, name in [(ax2, cite_rank, cite_total, cite_h, 'citations'),
+                                             (ax3, read_rank, read_total, read_h, 'reads')]:
+                x_rank, estimate, lower, upper = rank
+                ax.fill_between(x_rank, lower, upper, step='pre', color='blue', alpha=0.2)
+                ax.step(x_rank, estimate, where='pre', color='blue', lw=3, alpha=0.5,
+                        label='Total {}: ~{:.0f} ({:.0f} to {:.0f})'.format(name, *total))
+
+                h_x = numpy.arange(0, h[0]+1, 1)
+                h_y = numpy.array([h[0] for i in h_x])
+                ax.errorbar(h_x, h_y, lw=3, color='black', alpha=0.5,
+                            label='H-index: ~{} ({} to {})'.format(*h))
+                ax.errorbar(h_y, h_x, lw=3, color='black', alpha=0.5)
+
+                ax.set_ylabel('Total numer of {} per paper'.format(name))
+                leg = ax.legend(loc=0)
+                leg.draw_frame(False)
+                if log:
+                    ax.set_yscale('log')
+                ax.set_ylim([0, upper.max() + 1])
+                ax.set_xlim([0, population + 1])
+
+            im = plt.imread(os.path.join(HERE, 'ads_logo.jpg'))
+            newax = fig.add_axes([0.1, 0.9, 0.8, 0.1], anchor='NW', aspect='equal')
+            newax.imshow(im)
+            newax.axis('off')
+
+        with profiling.stage('savefig'):
+            figure_path = '{}/search_metrics.{}'.format(output_path, figure_format)
+            plt.savefig(figure_path)
+            plt.close(fig)
+
+    if save == 'csv':
+        with profiling.stage('csv'):
+            with open('{}/number.csv'.format(output_path), 'w') as f:
+                f.write('#year,total_number,total_lower,total_upper,'
+                        'refereed_number,refereed_lower,refereed_upper\n')
                 for i in range(len(y)):
-                    f.write('{year},{tot},{ref}\n'.format(
+                    f.write('{year},{tot:.1f},{tot_lo:.1f},{tot_up:.1f},{ref:.1f},{ref_lo:.1f},{ref_up:.1f}\n'.format(
                         year=y[i].year,
-                        tot=tot_pap[i],
-                        ref=ref_pap[i]
+                        tot=tot_pap[i], tot_lo=tot_lower[i], tot_up=tot_upper[i],
+                        ref=ref_pap[i], ref_lo=ref_lower[i], ref_up=ref_upper[i]
+                    ))
+            for name, rank in [('citation', cite_rank), ('read', read_rank)]:
+                with open('{}/{}_rank.csv'.format(output_path, name), 'w') as f:
+                    f.write('#rank,estimate,lower,upper\n')
+                    for r, estimate, lower, upper in zip(*rank):
+                        f.write('{:.0f},{},{},{}\n'.format(r, estimate, lower, upper))
+            with open('{}/citation_read.csv'.format(output_path), 'w') as f:
+                f.write('#bibcode,citation_count,read_count\n')
+                for i in p:
+                    f.write('{bib},{cit},{read}\n'.format(
+                        bib=i.bibcode,
+                        cit=i.citation_count,
+                        read=i.read_count
                     ))
-        with open('{}/citation_read.csv'.format(output_path), 'w') as f:
-            f.write('#bibcode,citation_count,read_count\n')
-            for i in sq.articles:
-                f.write('{bib},{cit},{read}\n'.format(
-                    bib=i.bibcode,
-                    cit=i.citation_count,
-                    read=i.read_count
-                ))
-
 
-if __name__ == '__main__':
 
-    parser = argparse.ArgumentParser()
+def add_arguments(parser):
+    """
+    Add the command line options of this script to an argparse parser
+    """
     parser.add_argument(
         '-o',
         '--output',
@@ -296,6 +840,7 @@ if __name__ == '__main__':
         default=None,
         type=str
     )
+    bigquery.add_arguments(parser)
     parser.add_argument(
         '--save-to-file',
         dest='save',
@@ -339,22 +884,118 @@ if __name__ == '__main__':
         default=1,
         type=int
     )
+    parser.add_argument(
+        '--sample',
+        dest='sample',
+        help='Estimate the plots from a random sample of this many papers, '
+             'rather than downloading every paper [default: None]',
+        default=None,
+        type=int
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        help='Seed of the random sample, the same seed gives the same sample [default: 0]',
+        default=0,
+        type=int
+    )
+    parser.add_argument(
+        '--confidence',
+        dest='confidence',
+        help='Confidence level of the intervals of a sample [default: 0.95]',
+        default=0.95,
+        type=float
+    )
+    parser.add_argument(
+        '--store',
+        dest='store_path',
+        help='Keep the papers in this folder as memory-mapped NumPy files, to '
+             'plot or save them again with --from-store [default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--from-store',
+        dest='from_store',
+        help='Use the papers kept in this folder by --store, without searching '
+             '[default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--refresh',
+        dest='refresh',
+        help='Only fetch the papers indexed since the papers kept by --store '
+             'were fetched, and merge them in',
+        action='store_true',
+        default=False
+    )
+    warehouse.add_arguments(parser)
+    profiling.add_arguments(parser)
+    # Nothing in this report can be left out, so it has no --budget
+    latency.add_arguments(parser, budget=False)
+    http_cache.add_arguments(parser)
+    archive.add_arguments(parser)
 
-    args = parser.parse_args()
 
-    if args.orcid is None and args.query is None and args.bibcodes is None:
+def run(args, parser):
+    """
+    Run the script for the command line options that were parsed
+    """
+    if args.orcid is None and args.query is None and args.from_store is None and args.bibcodes_file is None:
         parser.print_help()
         sys.exit()
+    if (args.from_store or args.store_path) and args.sample:
+        parser.error('--sample cannot be used with --store or --from-store')
+    if args.refresh and not args.store_path:
+        parser.error('--refresh needs the folder the papers are kept in, given with --store')
+    if args.bibcodes_file and (args.sample or args.refresh):
+        parser.error('--sample and --refresh need a query, not --bibcodes-file')
+
+    if args.sample is not None and args.sample < 1:
+        parser.error('--sample must be at least 1')
+    if not 0 < args.confidence < 1:
+        parser.error('--confidence must be between 0 and 1')
+
+    with profiling.profile_to(args.profile, args.profile_dir), latency.from_args(args), \
+            archive.from_args(args), http_cache.from_args(args):
+        if args.sample:
+            main_sample(
+                output_path=args.output,
+                figure_format=args.format,
+                orcid=args.orcid,
+                query=args.query,
+                save=args.save,
+                plot=args.plot,
+                test=args.test,
+                log=args.log,
+                sample=args.sample,
+                seed=args.seed,
+                confidence=args.confidence
+            )
+            return
+
+        main(
+            output_path=args.output,
+            figure_format=args.format,
+            orcid=args.orcid,
+            query=args.query,
+            save=args.save,
+            plot=args.plot,
+            test=args.test,
+            log=args.log,
+            rows=args.rows,
+            max_pages=args.max_pages,
+            store=warehouse.from_args(args),
+            store_path=args.store_path,
+            from_store=args.from_store,
+            refresh=args.refresh,
+            bibcodes=bigquery.from_args(args)
+        )
 
-    main(
-        output_path=args.output,
-        figure_format=args.format,
-        orcid=args.orcid,
-        query=args.query,
-        save=args.save,
-        plot=args.plot,
-        test=args.test,
-        log=args.log,
-        rows=args.rows,
-        max_pages=args.max_pages
-    )
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    run(parser.parse_args(), parser)
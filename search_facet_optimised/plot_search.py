@@ -15,56 +15,167 @@ contact the ADS team at adshelp [at] cfa.harvard.edu.
 import os
 import sys
 import re
+import time
+import json
 import numpy
 import argparse
-import matplotlib
-matplotlib.use('TkAgg')
-import seaborn  # simply importing this changes matplotlib styles
-from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# matplotlib and seaborn are only imported when a plot is requested, as they
+# take far longer to import than the rest of the script runs for
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(HERE))  # for ads_helpers
+
+from ads_helpers import archive, bigquery, decoding, http, http_cache, latency, profiling
+
+
+# Citations and reads summed over the papers of each year, refereed or not, by
+# the search engine (a JSON facet), so no documents have to be downloaded
+YEAR_TOTALS_FACET = {
+    'year': {
+        'type': 'terms',
+        'field': 'year',
+        'limit': -1,
+        'sort': 'index asc',
+        'facet': {
+            'citations': 'sum(citation_count)',
+            'reads': 'sum(read_count)',
+            'refereed': {
+                'type': 'query',
+                'q': 'property:refereed',
+                'facet': {
+                    'citations': 'sum(citation_count)',
+                    'reads': 'sum(read_count)',
+                },
+            },
+        },
+    },
+}
+
+
+# Number of values of a facet requested at a time, and how many of these pages
+# are requested at once
+FACET_PAGE_SIZE = 2000
+FACET_WORKERS = 4
+
+
+# In the approximate mode, papers are counted in bins of their citations (or
+# reads): [0, 1), [1, 2), [2, 4), [4, 8), ... so each paper's count is known to
+# within a factor of 2
+APPROXIMATE_BINS = 26
+
+
+# In the batched mode, the facets of each entity (e.g., an ORCiD iD) are asked
+# for in one query facet: the papers, citations and reads of each year, as in
+# YEAR_TOTALS_FACET, and the papers with each number of citations and reads
+ENTITY_FACET = {
+    'year': YEAR_TOTALS_FACET['year'],
+    'citation_count': {'type': 'terms', 'field': 'citation_count', 'limit': -1},
+    'read_count': {'type': 'terms', 'field': 'read_count', 'limit': -1},
+}
+
+# Number of entities in each request of the batched mode, which keeps the
+# URL of each request (mostly its json.facet) under 8 kB
+BATCH_SIZE = 8
+
+ORCID = re.compile(r'^\d{4}-\d{4}-\d{4}-\d{3}[\dX]$')
+
 
 class BadApiResponseException(Exception):
     pass
 
 
+def get_pyplot():
+    """
+    Import matplotlib (with the seaborn styles) when a plot is requested
+    """
+    import matplotlib
+    # TkAgg unless told otherwise, e.g., MPLBACKEND=Agg on a machine without a display
+    matplotlib.use(os.getenv('MPLBACKEND', 'TkAgg'))
+    import seaborn  # simply importing this changes matplotlib styles
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Calendar units a step can be, as (number, numpy unit)
+BINSIZES = {
+    'year': (1, 'Y'),
+    'month': (1, 'M'),
+    'week': (7, 'D'),
+    'day': (1, 'D'),
+}
+
+
 def dyear(y):
     """
-    Convert delta year into a timedelta object
+    Convert delta year into a numpy timedelta64 object
     :param y: delta year
     """
-    return timedelta(days=365*y)
+    return numpy.timedelta64(int(round(y*365*86400*1e6)), 'us')
+
+
+def bin_ends(x, binsize=1, bins=1):
+    """
+    End of the bin that starts at each x (or, with bins=-1, start of the bin
+    that ends at each x)
+    :param x: datetime64 array
+    :param binsize: number of years, or one of year, month, week or day
+    :param bins: number of bins to move by
+    """
+    if binsize in BINSIZES:
+        number, unit = BINSIZES[binsize]
+    elif float(binsize).is_integer():
+        number, unit = int(binsize), 'Y'
+    else:
+        return x + bins*dyear(binsize)
+
+    # The same time into the next year (or month), as they vary in length
+    start = x.astype('datetime64[{}]'.format(unit))
+    return (start + bins*number).astype(x.dtype) + (x - start.astype(x.dtype))
 
 
 def stepify(x, y, binsize=1):
     """
     Create a step-like version of the data.
-    :param x: x-array
+    :param x: x-array, datetime or datetime64
     :param y: y-array
-    :param binsize: length of the step size
+    :param binsize: length of the step size, as a number of years or one of
+        year, month, week or day
     """
 
-    offset = dyear(binsize/2.0)
-    binsize = dyear(binsize)
+    x = numpy.asarray(x).astype('datetime64[us]')
+    y = numpy.asarray(y)
+    if x.size == 0:
+        return x, y
+
+    # Centre each step on its x, reaching halfway to the bins either side of
+    # it, so neighbouring steps meet even when their bins differ in length
+    # (e.g., months)
+    left = x - (x - bin_ends(x, binsize, bins=-1)) / 2
+    right = x + (bin_ends(x, binsize) - x) / 2
 
-    new_x, new_y = [x[0]], [0]
-    for i in range(len(x)):
-        new_x.extend([x[i], x[i]+binsize])
-        new_y.extend([y[i], y[i]])
+    # Both edges of every step, with a tail at 0 on either side
+    new_x = numpy.empty(2*x.size + 2, dtype=x.dtype)
+    new_x[1:-1:2] = left
+    new_x[2:-1:2] = right
+    new_x[0], new_x[-1] = new_x[1], new_x[-2]
 
-    # Add tails
-    new_x.append(x[-1]+binsize)
-    new_y.append(0)
+    new_y = numpy.zeros(2*y.size + 2, dtype=y.dtype)
+    new_y[1:-1:2] = y
+    new_y[2:-1:2] = y
 
-    return numpy.array(new_x) - offset, numpy.array(new_y)
+    return new_x, new_y
 
 
-def step(ax, x, y, label='', color='blue', lw=1):
+def step(ax, x, y, label='', color='blue', lw=1, binsize=1):
     """
     Create a step plot that is filled underneath. This is not usually possible
     using the normal ax.step() function
     """
-    x_, y_ = stepify(x, y)
+    x_, y_ = stepify(x, y, binsize=binsize)
     ax.errorbar(x_, y_, label=label, color=color, lw=lw)
     ax.fill_between(x_, 0, y_, color=color, alpha=0.5)
 
@@ -86,6 +197,656 @@ def h_index(citations):
     return len(c)
 
 
+def search(session, url, headers, params, bibcodes=None):
+    """
+    Make a request to the search end point
+
+    :param session: HTTP session to use
+    :param url: search end point
+    :param headers: headers of the request (token)
+    :param params: parameters of the request
+    :param bibcodes: search within these bibcodes, sent through the bigquery
+        end point a chunk at a time, rather than with the query
+
+    :return: decoded response
+    """
+    if bibcodes is not None:
+        try:
+            return bigquery.search(session, headers, params, bibcodes)
+        except bigquery.BigQueryException as error:
+            raise BadApiResponseException(str(error))
+
+    with profiling.stage('fetch'):
+        r_facet = session.get(
+            url,
+            params=params,
+            headers=headers
+        )
+    if not r_facet:
+        raise BadApiResponseException("An API error occurred, status: {}".format(r_facet.status_code))
+
+    with profiling.stage('decode'):
+        return decoding.decode(r_facet)
+
+
+def search_pivot(session, url, headers, params, bibcodes=None):
+    """
+    Make a request to the search end point for a facet pivot of two fields,
+    which is read straight into numpy arrays (see decoding.read_pivot) as it
+    is downloaded
+
+    :return: number of papers found, compact pivot entries
+    """
+    pivot = params['facet.pivot']
+    if bibcodes is not None:
+        data = search(session, url, headers, params, bibcodes=bibcodes)
+        return data['response']['numFound'], decoding.compact_pivot(data['facet_counts']['facet_pivot'][pivot])
+
+    # Only the headers are received in the fetch stage, the body is received
+    # as it is decoded
+    with profiling.stage('fetch'):
+        r_facet = session.get(
+            url,
+            params=params,
+            headers=headers,
+            stream=True
+        )
+    try:
+        if not r_facet:
+            raise BadApiResponseException("An API error occurred, status: {}".format(r_facet.status_code))
+
+        with profiling.stage('decode'):
+            return decoding.read_pivot(r_facet, pivot)
+    finally:
+        r_facet.close()
+
+
+def get_facet(session, url, headers, params, page_size=FACET_PAGE_SIZE, workers=FACET_WORKERS, bibcodes=None):
+    """
+    Request a facet pivot from the search end point. The values of the last
+    field of the pivot are requested a page at a time (sorted by value, with
+    f.<field>.facet.limit and f.<field>.facet.offset), with several pages
+    requested at once, until every value has been received. The search
+    engine otherwise only returns the 100 most common values, and the rest
+    are left out without warning. No property has more values than papers
+    found, so at most ceil(num_found / page_size) pages are requested, and
+    it stops early if a page is the same as the one before (the search
+    engine did not take the offset).
+
+    :param session: HTTP session to use
+    :param url: search end point
+    :param headers: headers of the request (token)
+    :param params: parameters of the request, including 'facet.pivot'
+    :param page_size: number of values of the last field in each page
+    :param workers: number of pages requested at once
+    :param bibcodes: search within these bibcodes rather than with the query
+
+    :return: list of the pivot entries, compact (see decoding.py)
+    """
+    pivot = params['facet.pivot']
+    field = pivot.split(',')[-1]
+
+    def get_page(page):
+        page_params = dict(params)
+        page_params.update({
+            'rows': 0,
+            'f.{}.facet.sort'.format(field): 'index',
+            'f.{}.facet.limit'.format(field): page_size,
+            'f.{}.facet.offset'.format(field): page * page_size,
+        })
+        return search_pivot(session, url, headers, page_params, bibcodes=bibcodes)
+
+    merged = OrderedDict()
+
+    def add_page(entries):
+        """
+        :return: whether this was the last page
+        """
+        for entry in entries:
+            merged.setdefault(entry['value'], dict(entry, values=[], counts=[]))
+            if len(entry['values']):
+                merged[entry['value']]['values'].append(entry['values'])
+                merged[entry['value']]['counts'].append(entry['counts'])
+        return all(len(entry['values']) < page_size for entry in entries)
+
+    def same_page(entries, previous):
+        return len(entries) == len(previous) and all(
+            entry['value'] == before['value']
+            and numpy.array_equal(entry['values'], before['values'])
+            and numpy.array_equal(entry['counts'], before['counts'])
+            for entry, before in zip(entries, previous)
+        )
+
+    # The first page on its own, as most queries need no more than that
+    num_found, entries = get_page(0)
+    done = add_page(entries)
+    previous = entries
+    max_pages = -(-num_found // page_size)
+    page = 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while not done and page < max_pages:
+            pages = range(page, min(page + workers, max_pages))
+            for number, (_, entries) in zip(pages, pool.map(get_page, pages)):
+                if done:
+                    continue
+                if same_page(entries, previous):
+                    print('Warning: page {} of the {} facet is the same as the one before, '
+                          'the search engine did not take f.{}.facet.offset'.format(number, pivot, field))
+                    done = True
+                    continue
+                done = add_page(entries)
+                previous = entries
+            page += workers
+
+    for entry in merged.values():
+        if entry['values']:
+            entry['values'] = numpy.concatenate(entry['values'])
+            entry['counts'] = numpy.concatenate(entry['counts'])
+        else:
+            entry['values'] = numpy.array([])
+            entry['counts'] = numpy.array([], dtype=numpy.int64)
+        if bibcodes is not None:
+            # The same value can be on different pages of different chunks
+            entry['values'], entry['counts'] = decoding.sum_counts(entry['values'], entry['counts'])
+
+    check_facet(pivot, list(merged.values()), num_found)
+    return list(merged.values())
+
+
+def check_facet(pivot, entries, num_found):
+    """
+    Warn if the counts of a property,<field> pivot do not add up: every
+    paper is either refereed or not, so between them they should count
+    every paper found
+    """
+    for entry in entries:
+        total = entry['counts'].sum()
+        if total != entry['count']:
+            print('Warning: {} facet of {} counts {} out of {} papers'.format(
+                pivot, entry['value'], total, entry['count']
+            ))
+
+    total = sum(
+        entry['counts'].sum() for entry in entries if entry['value'] in ['refereed', 'notrefereed']
+    )
+    if total != num_found:
+        print('Warning: {} facet counts {} out of {} papers found'.format(pivot, total, num_found))
+
+
+def get_json_facet(session, url, headers, params, bibcodes=None):
+    """
+    Request JSON facets (json.facet) from the search end point
+
+    :param session: HTTP session to use
+    :param url: search end point
+    :param headers: headers of the request (token)
+    :param params: parameters of the request, including 'json.facet'
+    :param bibcodes: search within these bibcodes rather than with the query
+
+    :return: the facets
+    """
+    return search(session, url, headers, params, bibcodes=bibcodes)['facets']
+
+
+def get_totals_per_year(data_year_totals):
+    """
+    Convert the citations and reads summed per year (see YEAR_TOTALS_FACET)
+    into year-ordered numpy arrays
+
+    :param data_year_totals: facets returned for YEAR_TOTALS_FACET
+    :type data_year_totals: dict
+
+    :return: year, citations of refereed papers, citations of unrefereed
+        papers, reads of refereed papers, reads of unrefereed papers
+    """
+    buckets = sorted(data_year_totals.get('year', {}).get('buckets', []), key=lambda b: int(b['val']))
+
+    x_year = numpy.array([datetime.strptime(str(b['val']), '%Y') for b in buckets])
+
+    # Sums are floats, and are left out of buckets without any papers
+    total_cit = numpy.array([b.get('citations', 0) for b in buckets], dtype=numpy.int64)
+    total_read = numpy.array([b.get('reads', 0) for b in buckets], dtype=numpy.int64)
+    ref_cit = numpy.array([b['refereed'].get('citations', 0) for b in buckets], dtype=numpy.int64)
+    ref_read = numpy.array([b['refereed'].get('reads', 0) for b in buckets], dtype=numpy.int64)
+
+    return x_year, ref_cit, total_cit - ref_cit, ref_read, total_read - ref_read
+
+
+def get_bin_edges(bins=APPROXIMATE_BINS):
+    """
+    Smallest value of each of the log-spaced bins: 0, 1, 2, 4, 8, ...
+    """
+    return [0] + [2**i for i in range(bins - 1)]
+
+
+def get_bounds_facet(fields, edges):
+    """
+    JSON facet that counts the papers in each bin of each field, with the
+    largest value and the total of each field
+
+    :param fields: e.g., ['citation_count', 'read_count']
+    :param edges: smallest value of each bin, see get_bin_edges
+
+    :return: dict
+    """
+    facet = {}
+    for field in fields:
+        facet['{}_max'.format(field)] = 'max({})'.format(field)
+        facet['{}_sum'.format(field)] = 'sum({})'.format(field)
+        for i in range(len(edges)):
+            if i + 1 < len(edges):
+                q = '{}:[{} TO {}}}'.format(field, edges[i], edges[i + 1])
+            else:
+                q = '{}:[{} TO *]'.format(field, edges[i])
+            facet['{}_{}'.format(field, i)] = {'type': 'query', 'q': q}
+    return facet
+
+
+def h_index_of_bins(values, last):
+    """
+    H-index of papers given in groups that have the same value, highest first
+
+    :param values: value of the papers in each group
+    :param last: rank (from 1) of the last paper in each group
+    """
+    if not len(values):
+        return 0
+    return int(max(0, numpy.minimum(values, last).max()))
+
+
+def get_rank_bounds(data_bounds, field, edges):
+    """
+    Bounds on the citations (or reads) of every paper, highest first, from the
+    number of papers in each bin (see get_bounds_facet). The h-index is known
+    to be between h_lower and h_upper.
+
+    :param data_bounds: facets returned for get_bounds_facet
+    :param field: citation_count or read_count
+    :param edges: smallest value of each bin
+
+    :return: dict of the rank of the first and last paper of each bin (x), the
+        smallest (lower) and largest (upper) value they can have, an estimate
+        going from one to the other, the bounds on the h-index, and the total
+    """
+    counts = numpy.array([
+        data_bounds.get('{}_{}'.format(field, i), {}).get('count', 0) for i in range(len(edges))
+    ])
+    maximum = int(data_bounds.get('{}_max'.format(field)) or 0)
+    lower = numpy.array(edges)
+    upper = numpy.minimum(numpy.append(lower[1:] - 1, maximum), maximum)
+
+    # Highest values first, without the empty bins
+    keep = counts[::-1] > 0
+    counts, lower, upper = counts[::-1][keep], lower[::-1][keep], upper[::-1][keep]
+    last = numpy.cumsum(counts)
+    first = last - counts
+
+    return {
+        'x': numpy.column_stack([first, last - 1]).ravel(),
+        'lower': numpy.repeat(lower, 2),
+        'upper': numpy.repeat(upper, 2),
+        'estimate': numpy.column_stack([upper, lower]).ravel(),
+        'h_lower': h_index_of_bins(lower, last),
+        'h_upper': h_index_of_bins(upper, last),
+        'total': int(data_bounds.get('{}_sum'.format(field)) or 0),
+    }
+
+
+def plot_rank_bounds(ax, bounds, name, log=False):
+    """
+    Plot the bounds on the citations (or reads) of every paper, and on the
+    h-index
+    """
+    ax.errorbar(
+        bounds['x'],
+        bounds['estimate'],
+        label='Total {}: {}'.format(name, bounds['total']),
+        ls='-',
+        color='blue',
+        lw=3,
+        alpha=0.5
+    )
+    ax.fill_between(
+        bounds['x'], bounds['lower'], bounds['upper'], color='blue', alpha=0.2,
+        label='Within a factor of 2'
+    )
+    for h, ls in [(bounds['h_lower'], '-'), (bounds['h_upper'], '--')]:
+        h_x = numpy.arange(0, h+1, 1)
+        h_y = numpy.array([h for i in h_x])
+        ax.errorbar(
+            h_x, h_y, lw=3, color='black', alpha=0.5, ls=ls,
+            label='H-index: {} to {}'.format(bounds['h_lower'], bounds['h_upper']) if ls == '-' else None
+        )
+        ax.errorbar(h_y, h_x, lw=3, color='black', alpha=0.5, ls=ls)
+
+    ax.set_ylabel('Total numer of {} per paper'.format(name))
+    leg = ax.legend(loc=0)
+    leg.draw_frame(False)
+    if log:
+        ax.set_yscale('log')
+    ax.set_ylim([0, bounds['upper'].max() + 1 if len(bounds['upper']) else 1])
+    ax.set_xlim([0, bounds['x'].max() + 2 if len(bounds['x']) else 1])
+
+
+def get_numbers_of_papers(data_year_facet):
+    """
+    Convert the property,year pivot into year-ordered numpy arrays
+
+    :param data_year_facet: compact pivot entries of the property,year facet
+    :type data_year_facet: list
+
+    :return: year, number of refereed papers, number of unrefereed papers
+    """
+    # Every year of any property, in order
+    years = [p['values'].astype(numpy.int64) for p in data_year_facet if len(p['values'])]
+    years = numpy.unique(numpy.concatenate(years)) if years else numpy.array([], dtype=numpy.int64)
+
+    ref_pap = numpy.zeros(len(years), dtype=numpy.int64)
+    unref_pap = numpy.zeros(len(years), dtype=numpy.int64)
+    for p in data_year_facet:
+        if not len(p['values']):
+            continue
+        if p['value'] == 'refereed':
+            target = ref_pap
+        elif p['value'] == 'notrefereed':
+            target = unref_pap
+        else:
+            continue
+        numpy.add.at(target, numpy.searchsorted(years, p['values'].astype(numpy.int64)), p['counts'])
+
+    x_year = numpy.array([datetime(int(y), 1, 1) for y in years])
+
+    return x_year, ref_pap, unref_pap
+
+
+def get_rank(data_facet):
+    """
+    Convert the property,citation_count (or property,read_count) pivot into
+    the citations (or reads) of every paper, highest first
+
+    :param data_facet: compact pivot entries of the facet
+    :type data_facet: list
+
+    :return: rank, number of citations (or reads)
+    """
+    y = [
+        numpy.repeat(p['values'], p['counts']) for p in data_facet
+        if p['value'] in ['refereed', 'notrefereed'] and len(p['values'])
+    ]
+    y = numpy.sort(numpy.concatenate(y))[::-1] if y else numpy.array([])
+    x = numpy.arange(len(y))
+
+    return x, y
+
+
+def get_batch_facet(queries):
+    """
+    JSON facets of a batch of entities, a query facet each, named by their
+    position in the batch
+
+    :param queries: query of each entity, e.g., orcid:0000-0001-8043-4965
+    """
+    return OrderedDict(
+        ('e{}'.format(i), {'type': 'query', 'q': q, 'facet': ENTITY_FACET})
+        for i, q in enumerate(queries)
+    )
+
+
+def get_entity_facets(session, url, headers, field, values, batch_size=BATCH_SIZE, workers=FACET_WORKERS):
+    """
+    Request the facets of many entities in a few requests: each request
+    searches a batch of them at once, field:(A OR B OR ...), and asks for
+    the facets of each of them (ENTITY_FACET), which are split out locally.
+    The batches are requested several at a time.
+
+    :param session: HTTP session to use
+    :param url: search end point
+    :param headers: headers of the request (token)
+    :param field: field the entities are searched by, e.g., orcid
+    :param values: value of each entity, e.g., ORCiD iDs
+    :param batch_size: number of entities in each request
+    :param workers: number of requests made at once
+
+    :return: OrderedDict of value: its facets
+    """
+    batches = [values[i:i+batch_size] for i in range(0, len(values), batch_size)]
+
+    def get_batch(batch):
+        queries = ['{}:{}'.format(field, value) for value in batch]
+        params = {
+            'q': '{}:({})'.format(field, ' OR '.join(batch)),
+            'rows': 0,
+            'json.facet': json.dumps(get_batch_facet(queries), separators=(',', ':')),
+        }
+        facets = get_json_facet(session, url, headers, params)
+        # Entities without papers can be left out
+        return [(value, facets.get('e{}'.format(i)) or {'count': 0}) for i, value in enumerate(batch)]
+
+    entities = OrderedDict()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(get_batch, batches):
+            entities.update(results)
+    return entities
+
+
+def get_papers_per_year(data_year_totals):
+    """
+    Convert the year facet of an entity (see YEAR_TOTALS_FACET) into the
+    number of papers of each year
+
+    :return: year, number of refereed papers, number of unrefereed papers
+    """
+    buckets = sorted(data_year_totals.get('year', {}).get('buckets', []), key=lambda b: int(b['val']))
+
+    x_year = numpy.array([datetime.strptime(str(b['val']), '%Y') for b in buckets])
+    total = numpy.array([b['count'] for b in buckets], dtype=numpy.int64)
+    ref_pap = numpy.array([b['refereed']['count'] for b in buckets], dtype=numpy.int64)
+
+    return x_year, ref_pap, total - ref_pap
+
+
+def get_rank_of_buckets(data_facet, name, field):
+    """
+    Convert the citation_count (or read_count) terms facet of an entity into
+    the citations (or reads) of every paper, highest first
+
+    :param data_facet: facets of the entity
+    :param name: name of the entity, for the warning
+    :param field: citation_count or read_count
+
+    :return: rank, number of citations (or reads)
+    """
+    buckets = data_facet.get(field, {}).get('buckets', [])
+    values = numpy.array([b['val'] for b in buckets], dtype=numpy.int64)
+    counts = numpy.array([b['count'] for b in buckets], dtype=numpy.int64)
+
+    if counts.sum() != data_facet['count']:
+        print('Warning: {} facet of {} counts {} out of {} papers'.format(
+            field, name, counts.sum(), data_facet['count']
+        ))
+
+    y = numpy.sort(numpy.repeat(values, counts))[::-1]
+    return numpy.arange(len(y)), y
+
+
+def save_columnar(tables, output_path, output_name, file_format='parquet', compression=None):
+    """
+    Save tables to Parquet or Feather (Arrow IPC) files, one per table. Each
+    column is written in one go from its numpy array, with a fixed type, so
+    they load far quicker than a CSV file, e.g., with pandas.read_parquet.
+
+    :param tables: {name: [(column, numpy array, pyarrow type)]}
+    :type tables: OrderedDict
+    :param output_path: folder to save the files in
+    :param output_name: prefix of the file names
+    :param file_format: parquet or feather
+    :param compression: compression codec (default: snappy for parquet, lz4
+        for feather), or none
+
+    :return: list of the files written
+    """
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Saving to {} needs pyarrow: pip install pyarrow'.format(file_format))
+
+    if compression == 'none':
+        compression = 'uncompressed' if file_format == 'feather' else 'none'
+
+    paths = []
+    for name, columns in tables.items():
+        table = pyarrow.table(OrderedDict(
+            (column, pyarrow.array(values, type=column_type))
+            for column, values, column_type in columns
+        ))
+        path = '{}/{}_{}.{}'.format(output_path, output_name, name, file_format)
+        if file_format == 'parquet':
+            pyarrow.parquet.write_table(table, path, compression=compression or 'snappy')
+        else:
+            pyarrow.feather.write_feather(table, path, compression=compression or 'lz4')
+        paths.append(path)
+    return paths
+
+
+def save_tables(save, output_path, output_name, papers, totals, ranks=None, bounds=None, compression=None):
+    """
+    Save the numbers of papers, citations and reads per year, and either the
+    citation and read ranks or their bounds, to CSV, Parquet or Feather files
+
+    :param save: csv, parquet or feather
+    :param output_path: folder to save the files in
+    :param output_name: prefix of the file names
+    :param papers: year, refereed papers, unrefereed papers
+    :param totals: year, refereed citations, unrefereed citations, refereed
+        reads, unrefereed reads
+    :param ranks: (rank, citations), (rank, reads), where the reads can be
+        None if they were left out (see latency.allows)
+    :param bounds: citation bounds, read bounds (see get_rank_bounds), in
+        the approximate mode
+    :param compression: compression of parquet or feather files
+    """
+    x_year, ref_pap, unref_pap = papers
+    x_total, ref_cit, unref_cit, ref_read, unref_read = totals
+    approximate = bounds is not None
+    if approximate:
+        citation_bounds, read_bounds = bounds
+    else:
+        (x_cc, y_cc), (x_rc, y_rc) = ranks
+
+    if save == 'csv':
+        with profiling.stage('csv'):
+            fname = '{}/{}_paper_year.csv'.format(output_path, output_name)
+            with open(fname, 'w') as f:
+                    f.write('#year,unrefereed_number,refereed_number\n')
+                    for i in range(len(x_year)):
+                        f.write('{year},{unref},{ref}\n'.format(
+                            year=x_year[i].year,
+                            unref=unref_pap[i],
+                            ref=ref_pap[i]
+                        ))
+            print("Output paper histogram: {}".format(fname))
+
+            fname = '{}/{}_citation_year.csv'.format(output_path, output_name)
+            with open(fname, 'w') as f:
+                f.write('#year,unrefereed_citations,refereed_citations\n')
+                for i in range(len(x_total)):
+                    f.write('{year},{unref},{ref}\n'.format(
+                        year=x_total[i].year,
+                        unref=unref_cit[i],
+                        ref=ref_cit[i]
+                    ))
+            print("Output citations per year: {}".format(fname))
+
+            fname = '{}/{}_read_year.csv'.format(output_path, output_name)
+            with open(fname, 'w') as f:
+                f.write('#year,unrefereed_reads,refereed_reads\n')
+                for i in range(len(x_total)):
+                    f.write('{year},{unref},{ref}\n'.format(
+                        year=x_total[i].year,
+                        unref=unref_read[i],
+                        ref=ref_read[i]
+                    ))
+            print("Output reads per year: {}".format(fname))
+
+            if approximate:
+                for name, bounds in [('citation', citation_bounds), ('read', read_bounds)]:
+                    fname = '{}/{}_{}_rank_bounds.csv'.format(output_path, output_name, name)
+                    with open(fname, 'w') as f:
+                        f.write('#index,lower_bound,upper_bound\n')
+                        for i in range(len(bounds['x'])):
+                            f.write('{index},{lower},{upper}\n'.format(
+                                index=bounds['x'][i],
+                                lower=bounds['lower'][i],
+                                upper=bounds['upper'][i]
+                            ))
+                    print("Output {} rank bounds: {}".format(name, fname))
+            else:
+                fname = '{}/{}_citation_rank.csv'.format(output_path, output_name)
+                with open(fname, 'w') as f:
+                    f.write('#index,citation_count\n')
+                    for i in range(len(y_cc)):
+                        f.write('{index},{cit}\n'.format(
+                            index=i,
+                            cit=y_cc[i],
+                        ))
+                print("Output citation rank: {}".format(fname))
+
+                if y_rc is not None:
+                    fname = '{}/{}_read_rank.csv'.format(output_path, output_name)
+                    with open(fname, 'w') as f:
+                        f.write('#index,read_count\n')
+                        for i in range(len(y_rc)):
+                            f.write('{index},{read}\n'.format(
+                                index=i,
+                                read=y_rc[i],
+                            ))
+                    print("Output read histogram: {}".format(fname))
+
+    elif save in ['parquet', 'feather']:
+        with profiling.stage(save):
+            import pyarrow
+
+            tables = OrderedDict([
+                ('paper_year', [
+                    ('year', numpy.array([i.year for i in x_year]), pyarrow.int16()),
+                    ('unrefereed_number', unref_pap, pyarrow.int64()),
+                    ('refereed_number', ref_pap, pyarrow.int64()),
+                ]),
+                ('citation_year', [
+                    ('year', numpy.array([i.year for i in x_total]), pyarrow.int16()),
+                    ('unrefereed_citations', unref_cit, pyarrow.int64()),
+                    ('refereed_citations', ref_cit, pyarrow.int64()),
+                ]),
+                ('read_year', [
+                    ('year', numpy.array([i.year for i in x_total]), pyarrow.int16()),
+                    ('unrefereed_reads', unref_read, pyarrow.int64()),
+                    ('refereed_reads', ref_read, pyarrow.int64()),
+                ]),
+            ])
+            if approximate:
+                for name, bounds in [('citation', citation_bounds), ('read', read_bounds)]:
+                    tables['{}_rank_bounds'.format(name)] = [
+                        ('index', bounds['x'], pyarrow.int64()),
+                        ('lower_bound', bounds['lower'], pyarrow.int64()),
+                        ('upper_bound', bounds['upper'], pyarrow.int64()),
+                    ]
+            else:
+                tables['citation_rank'] = [
+                    ('index', x_cc, pyarrow.int64()),
+                    ('citation_count', y_cc, pyarrow.int64()),
+                ]
+                if y_rc is not None:
+                    tables['read_rank'] = [
+                        ('index', x_rc, pyarrow.int64()),
+                        ('read_count', y_rc, pyarrow.int64()),
+                    ]
+            for fname in save_columnar(tables, output_path, output_name, save, compression):
+                print("Output table: {}".format(fname))
+
+
 def main(
         output_path,
         figure_format,
@@ -95,7 +856,12 @@ def main(
         save=False,
         plot=False,
         log=False,
-        token=None
+        token=None,
+        compression=None,
+        facet_page_size=FACET_PAGE_SIZE,
+        facet_workers=FACET_WORKERS,
+        approximate=False,
+        bibcodes=None
 ):
 
     if token is None:
@@ -104,7 +870,12 @@ def main(
         TOKEN = token
 
     # See what the user has given to generate the metrics plot
-    if query:
+    if bibcodes is not None:
+        print('You gave {} bibcodes: {}'.format(len(bibcodes), bibcodes[0:4]))
+        q = '*:*'
+        if not output_name:
+            output_name = 'bibcodes'
+    elif query:
         print('You gave a query: {}'.format(query))
         q = query
     elif orcid:
@@ -117,8 +888,9 @@ def main(
     if not output_name:
         output_name = re.sub('\W', '', q)
 
+    session = http.get_session()
     headers = {'Authorization': 'Bearer:{}'.format(TOKEN)}
-    url = 'https://api.adsabs.harvard.edu/v1/search/query'
+    url = http.api_url('search/query')
 
     params_year_facet = {
         'facet': 'true',
@@ -143,254 +915,296 @@ def main(
     }
 
     # Get the number of papers facet
-    r_facet = requests.get(
-            url,
-            params=params_year_facet,
-            headers=headers
-        )
-    if not r_facet:
-        raise BadApiResponseException("An API error occurred, status: {}".format(r_facet.status_code))
-    data_year_facet = \
-        r_facet.json()['facet_counts']['facet_pivot']['property,year']
+    data_year_facet = get_facet(
+        session, url, headers, params_year_facet, page_size=facet_page_size, workers=facet_workers,
+        bibcodes=bibcodes
+    )
 
-    # Get the citation facets
-    r_facet = requests.get(
-            url,
-            params=params_citation_rank_facet,
-            headers=headers
+    if approximate:
+        # Get the number of papers in bins of citations and reads
+        edges = get_bin_edges()
+        params_bounds_facet = {
+            'q': q,
+            'rows': 0,
+            'json.facet': json.dumps(get_bounds_facet(['citation_count', 'read_count'], edges)),
+        }
+        data_bounds = get_json_facet(session, url, headers, params_bounds_facet, bibcodes=bibcodes)
+    else:
+        # Get the citation facets
+        start = time.time()
+        data_citation_facet = get_facet(
+            session, url, headers, params_citation_rank_facet, page_size=facet_page_size, workers=facet_workers,
+            bibcodes=bibcodes
         )
-    if not r_facet:
-        raise BadApiResponseException("An API error occurred, status: {}".format(r_facet.status_code))
-    data_citation_facet = \
-        r_facet.json()['facet_counts']['facet_pivot']['property,citation_count']
 
-    # Get the read facets
-    r_facet = requests.get(
-            url,
-            params=params_read_rank_facet,
-            headers=headers
-        )
-    if not r_facet:
-        raise BadApiResponseException("An API error occurred, status: {}".format(r_facet.status_code))
-    data_read_facet = \
-        r_facet.json()['facet_counts']['facet_pivot']['property,read_count']
+        # Get the read facets, unless the report is over its budget: they are
+        # expected to take as long as the citation facets did
+        data_read_facet = None
+        if latency.allows('read rank', cost=time.time() - start):
+            data_read_facet = get_facet(
+                session, url, headers, params_read_rank_facet, page_size=facet_page_size, workers=facet_workers,
+                bibcodes=bibcodes
+            )
 
-    # Number of Papers
-    # ----------------
-    # Lets re-organise into year: ref/unref
-    years = {}
-    for p in data_year_facet:
-        property = p['value']
-
-        for entry in p['pivot']:
-
-            y = datetime.strptime(entry['value'], '%Y')
-            years.setdefault(y, {})
-
-            years[y].setdefault('refereed', 0)
-            years[y].setdefault('unrefereed', 0)
-
-            if property == 'refereed':
-                years[y]['refereed'] += entry['count']
-            elif property == 'notrefereed':
-                years[y]['unrefereed'] += entry['count']
-
-    # Ensure ordering, probably a smarter way to do it
-    yy = sorted(years)
-    x_year = numpy.array(yy)
-
-    ref_pap = numpy.array([years[x_year[i]]['refereed'] for i in range(len(x_year))])
-    unref_pap = numpy.array([years[x_year[i]]['unrefereed'] for i in range(len(x_year))])
-
-    # Number of Citations
-    # -------------------
-    # Lets re-organise the citations and determine the h-index
-    y_cc = []
-    for p in data_citation_facet:
-        property = p['value']
-        for entry in p['pivot']:
-            if property in ['refereed', 'notrefereed']:
-                for _ in range(entry['count']):
-                    y_cc.append(entry['value'])
-    y_cc.sort(reverse=True)
-    y_cc = numpy.array(y_cc)
-    x_cc = numpy.array([i for i in range(len(y_cc))])
-
-    # Number of Reads
-    # ---------------
-    # Lets re-organise the citations and determine the h-index
-    y_rc = []
-    for p in data_read_facet:
-        property = p['value']
-        for entry in p['pivot']:
-            if property in ['refereed', 'notrefereed']:
-                for _ in range(entry['count']):
-                    y_rc.append(entry['value'])
-    y_rc.sort(reverse=True)
-    y_rc = numpy.array(y_rc)
-    x_rc = numpy.array([i for i in range(len(y_rc))])
+    # Get the citations and reads per year, only needed for the tables
+    if save:
+        params_year_totals = {
+            'q': q,
+            'rows': 0,
+            'json.facet': json.dumps(YEAR_TOTALS_FACET),
+        }
+        data_year_totals = get_json_facet(session, url, headers, params_year_totals, bibcodes=bibcodes)
+
+    with profiling.stage('parse'):
+        x_year, ref_pap, unref_pap = get_numbers_of_papers(data_year_facet)
+        if approximate:
+            citation_bounds = get_rank_bounds(data_bounds, 'citation_count', edges)
+            read_bounds = get_rank_bounds(data_bounds, 'read_count', edges)
+            print('H-index between {h_lower} and {h_upper} (citations)'.format(**citation_bounds))
+            print('H-index between {h_lower} and {h_upper} (reads)'.format(**read_bounds))
+        else:
+            x_cc, y_cc = get_rank(data_citation_facet)
+            x_rc, y_rc = (None, None) if data_read_facet is None else get_rank(data_read_facet)
+        if save:
+            x_total, ref_cit, unref_cit, ref_read, unref_read = get_totals_per_year(data_year_totals)
 
     # Collect the metrics from the API
     if plot:
-        # Define the figure and the axes
-        fig = plt.figure(0, figsize=(8.5, 11.))
-        ax1 = fig.add_subplot(311)
-        ax2 = fig.add_subplot(312)
-        ax3 = fig.add_subplot(313)
-
-        # Number of papers
-        step(
-            ax1,
-            x_year,
-            unref_pap,
-            label='Not refereed: {}'.format(unref_pap.sum()),
-            color='green'
-        )
-        step(
-            ax1,
-            x_year,
-            ref_pap,
-            label='Refereed: {}'.format(ref_pap.sum()),
-            color='blue'
-        )
+        with profiling.stage('plot'):
+            plt = get_pyplot()
 
-        y_max = max((unref_pap).max(), ref_pap.max()) + 1
-        ax1.set_ylim([0, y_max])
-        ax1.set_ylabel('Numer of papers')
-        ax1.set_xlabel('Year')
-        leg1 = ax1.legend(loc=0)
-        leg1.draw_frame(False)
-
-        # Plot number of citations
-        # ------------------------
-        h = h_index(y_cc)
-        ax2.errorbar(
-            x_cc,
-            y_cc,
-            label='Total citations: {}'.format(y_cc.sum()),
-            ls='-',
-            color='blue',
-            lw=3,
-            alpha=0.5
-        )
-        h_x = numpy.arange(0, h+1, 1)
-        h_y = numpy.array([h for i in h_x])
-        ax2.errorbar(
-            h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h)
-        )
-        ax2.errorbar(
-            h_y, h_x, lw=3, color='black', alpha=0.5
-        )
+            # Define the figure and the axes
+            fig = plt.figure(0, figsize=(8.5, 11.))
+            ax1 = fig.add_subplot(311)
+            ax2 = fig.add_subplot(312)
+            ax3 = fig.add_subplot(313)
 
-        # Labels, legends, and scaling
-        ax2.set_ylabel('Total numer of citations per paper')
-        leg2 = ax2.legend(loc=0)
-        leg2.draw_frame(False)
-        y_max = y_cc.max() + 1
-        y_min = 0
-        if log:
-            ax2.set_yscale('log')
-        ax2.set_ylim([y_min, y_max])
-        x_max = y_cc.size + 1
-        ax2.set_xlim([0, x_max])
-
-        # Plot number of reads
-        # ---------------------
-        h = h_index(y_rc)
-        ax3.errorbar(
-            x_rc,
-            y_rc,
-            label='Total reads: {}'.format(int(y_rc.sum())),
-            ls='-',
-            color='blue',
-            lw=3,
-            alpha=0.5
-        )
+            # Number of papers
+            step(
+                ax1,
+                x_year,
+                unref_pap,
+                label='Not refereed: {}'.format(unref_pap.sum()),
+                color='green'
+            )
+            step(
+                ax1,
+                x_year,
+                ref_pap,
+                label='Refereed: {}'.format(ref_pap.sum()),
+                color='blue'
+            )
 
-        h_x = numpy.arange(0, h+1, 1)
-        h_y = numpy.array([h for i in h_x])
-        ax3.errorbar(
-            h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h)
-        )
-        ax3.errorbar(
-            h_y, h_x, lw=3, color='black', alpha=0.5
-        )
+            y_max = max((unref_pap).max(), ref_pap.max()) + 1
+            ax1.set_ylim([0, y_max])
+            ax1.set_ylabel('Numer of papers')
+            ax1.set_xlabel('Year')
+            leg1 = ax1.legend(loc=0)
+            leg1.draw_frame(False)
+
+            # Plot number of citations
+            # ------------------------
+            if approximate:
+                plot_rank_bounds(ax2, citation_bounds, 'citations', log=log)
+            else:
+                h = h_index(y_cc)
+                ax2.errorbar(
+                    x_cc,
+                    y_cc,
+                    label='Total citations: {}'.format(y_cc.sum()),
+                    ls='-',
+                    color='blue',
+                    lw=3,
+                    alpha=0.5
+                )
+                h_x = numpy.arange(0, h+1, 1)
+                h_y = numpy.array([h for i in h_x])
+                ax2.errorbar(
+                    h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h)
+                )
+                ax2.errorbar(
+                    h_y, h_x, lw=3, color='black', alpha=0.5
+                )
+
+                # Labels, legends, and scaling
+                ax2.set_ylabel('Total numer of citations per paper')
+                leg2 = ax2.legend(loc=0)
+                leg2.draw_frame(False)
+                y_max = y_cc.max() + 1
+                y_min = 0
+                if log:
+                    ax2.set_yscale('log')
+                ax2.set_ylim([y_min, y_max])
+                x_max = y_cc.size + 1
+                ax2.set_xlim([0, x_max])
 
-        ax3.set_ylabel('Total numer of reads per paper')
-        leg3 = ax3.legend(loc=0)
-        leg3.draw_frame(False)
-        if log:
-            ax3.set_yscale('log')
+            # Plot number of reads
+            # ---------------------
+            if approximate:
+                plot_rank_bounds(ax3, read_bounds, 'reads', log=log)
+            elif y_rc is None:
+                ax3.text(
+                    0.5, 0.5, 'Reads left out to keep within the time budget',
+                    ha='center', va='center', transform=ax3.transAxes
+                )
+                ax3.set_axis_off()
+            else:
+                h = h_index(y_rc)
+                ax3.errorbar(
+                    x_rc,
+                    y_rc,
+                    label='Total reads: {}'.format(int(y_rc.sum())),
+                    ls='-',
+                    color='blue',
+                    lw=3,
+                    alpha=0.5
+                )
 
-        ax3.set_ylim([0, y_rc.max()+1])
+                h_x = numpy.arange(0, h+1, 1)
+                h_y = numpy.array([h for i in h_x])
+                ax3.errorbar(
+                    h_x, h_y, lw=3, color='black', alpha=0.5, label='H-index: {}'.format(h)
+                )
+                ax3.errorbar(
+                    h_y, h_x, lw=3, color='black', alpha=0.5
+                )
 
-        im = plt.imread('ads_logo.jpg')
-        newax = fig.add_axes([0.1, 0.9, 0.8, 0.1], anchor='NW', aspect='equal')
-        newax.imshow(im)
-        newax.axis('off')
-        ### XXX - add title
-        #ax1.set_title('Query: {}',format(q))
+                ax3.set_ylabel('Total numer of reads per paper')
+                leg3 = ax3.legend(loc=0)
+                leg3.draw_frame(False)
+                if log:
+                    ax3.set_yscale('log')
 
+                ax3.set_ylim([0, y_rc.max()+1])
 
-        figure_path = '{}/{}_search_metrics.{}'.format(output_path, output_name, figure_format)
-        plt.savefig(figure_path)
+            im = plt.imread(os.path.join(HERE, 'ads_logo.jpg'))
+            newax = fig.add_axes([0.1, 0.9, 0.8, 0.1], anchor='NW', aspect='equal')
+            newax.imshow(im)
+            newax.axis('off')
+            ### XXX - add title
+            #ax1.set_title('Query: {}',format(q))
+
+
+        with profiling.stage('savefig'):
+            figure_path = '{}/{}_search_metrics.{}'.format(output_path, output_name, figure_format)
+            plt.savefig(figure_path)
+            plt.close(fig)
         print("Output plot: {}".format(figure_path))
 
     # Save to disk if requested
+    if save:
+        save_tables(
+            save,
+            output_path,
+            output_name,
+            (x_year, ref_pap, unref_pap),
+            (x_total, ref_cit, unref_cit, ref_read, unref_read),
+            ranks=None if approximate else ((x_cc, y_cc), (x_rc, y_rc)),
+            bounds=(citation_bounds, read_bounds) if approximate else None,
+            compression=compression
+        )
+
+
+def main_batch(
+        output_path,
+        orcids,
+        output_name=None,
+        save=False,
+        token=None,
+        compression=None,
+        batch_size=BATCH_SIZE,
+        workers=FACET_WORKERS
+):
+    """
+    The numbers of papers, citations and reads per year, and the citation and
+    read ranks, of many ORCiD iDs, from a few batched requests (see
+    get_entity_facets). A summary of each is printed, and the tables of each
+    are saved if requested, with the same names as for a single ORCiD iD.
+
+    :param output_path: folder to save the tables in
+    :param orcids: list of ORCiD iDs
+    :param output_name: prefix of the file names, before that of each ORCiD iD
+    :param save: csv, parquet or feather, or False
+    :param batch_size: number of ORCiD iDs in each request
+    :param workers: number of requests made at once
+    """
+    if token is None:
+        TOKEN = os.getenv('ADS_DEV_KEY')
+    else:
+        TOKEN = token
+
+    valid = []
+    for orcid in orcids:
+        if ORCID.match(orcid):
+            valid.append(orcid)
+        else:
+            print('Skipping {}, it is not an ORCiD iD'.format(orcid))
+    if not valid:
+        sys.exit()
+    print('You gave {} ORCiD iDs: {}'.format(len(valid), valid[0:4]))
+
+    session = http.get_session()
+    headers = {'Authorization': 'Bearer:{}'.format(TOKEN)}
+    url = http.api_url('search/query')
+
+    entities = get_entity_facets(
+        session, url, headers, 'orcid', valid, batch_size=batch_size, workers=workers
+    )
+
+    summary = []
+    print('#orcid,papers,refereed,citations,reads,h_index')
+    for orcid, data_facet in entities.items():
+        with profiling.stage('parse'):
+            x_year, ref_pap, unref_pap = get_papers_per_year(data_facet)
+            x_total, ref_cit, unref_cit, ref_read, unref_read = get_totals_per_year(data_facet)
+            x_cc, y_cc = get_rank_of_buckets(data_facet, orcid, 'citation_count')
+            x_rc, y_rc = get_rank_of_buckets(data_facet, orcid, 'read_count')
+
+        row = (orcid, data_facet['count'], ref_pap.sum(), y_cc.sum(), y_rc.sum(), h_index(y_cc))
+        summary.append(row)
+        print('{},{},{},{},{},{}'.format(*row))
+
+        if save:
+            name = re.sub('\W', '', 'orcid:{}'.format(orcid))
+            if output_name:
+                name = '{}_{}'.format(output_name, name)
+            save_tables(
+                save,
+                output_path,
+                name,
+                (x_year, ref_pap, unref_pap),
+                (x_total, ref_cit, unref_cit, ref_read, unref_read),
+                ranks=((x_cc, y_cc), (x_rc, y_rc)),
+                compression=compression
+            )
+
     if save == 'csv':
-        fname = '{}/{}_paper_year.csv'.format(output_path, output_name)
-        with open(fname, 'w') as f:
-                f.write('#year,unrefereed_number,refereed_number\n')
-                for i in range(len(x_year)):
-                    f.write('{year},{unref},{ref}\n'.format(
-                        year=x_year[i].year,
-                        unref=unref_pap[i],
-                        ref=ref_pap[i]
-                    ))
-        print("Output paper histogram: {}".format(fname))
-        """
-        # some day we should implement these
-        with open('{}/{}_citation_year.csv'.format(output_path, output_name), 'w') as f:
-                f.write('#year,unrefereed_citations,refereed_citations\n')
-                for i in range(len(x_year)):
-                    f.write('{year},{unref},{ref}\n'.format(
-                        year=x_year[i].year,
-                        unref=unref_cit[i],
-                        ref=ref_cit[i]
-                    ))
-        with open('{}/{}_read_year.csv'.format(output_path, output_name), 'w') as f:
-                f.write('#year,unrefereed_reads,refereed_reads\n')
-                for i in range(len(x_year)):
-                    f.write('{year},{unref},{ref}\n'.format(
-                        year=x_year[i].year,
-                        unref=unref_read[i],
-                        ref=ref_read[i]
-                    ))
-        """
-        fname = '{}/{}_citation_rank.csv'.format(output_path, output_name)
-        with open(fname, 'w') as f:
-            f.write('#index,citation_count\n')
-            for i in range(len(y_cc)):
-                f.write('{index},{cit}\n'.format(
-                    index=i,
-                    cit=y_cc[i],
-                ))
-        print("Output citation rank: {}".format(fname))
-
-        fname = '{}/{}_read_rank.csv'.format(output_path, output_name)
+        fname = '{}/{}_summary.csv'.format(output_path, output_name or 'orcids')
         with open(fname, 'w') as f:
-            f.write('#index,read_count\n')
-            for i in range(len(y_rc)):
-                f.write('{index},{read}\n'.format(
-                    index=i,
-                    read=y_rc[i],
-                ))
-        print("Output read histogram: {}".format(fname))
+            f.write('#orcid,papers,refereed,citations,reads,h_index\n')
+            for row in summary:
+                f.write('{},{},{},{},{},{}\n'.format(*row))
+        print("Output summary: {}".format(fname))
+    elif save in ['parquet', 'feather']:
+        import pyarrow
 
+        columns = list(zip(*summary))
+        tables = {'summary': [
+            ('orcid', list(columns[0]), pyarrow.string()),
+            ('papers', numpy.array(columns[1]), pyarrow.int64()),
+            ('refereed', numpy.array(columns[2]), pyarrow.int64()),
+            ('citations', numpy.array(columns[3]), pyarrow.int64()),
+            ('reads', numpy.array(columns[4]), pyarrow.int64()),
+            ('h_index', numpy.array(columns[5]), pyarrow.int64()),
+        ]}
+        for fname in save_columnar(tables, output_path, output_name or 'orcids', save, compression):
+            print("Output summary: {}".format(fname))
 
-if __name__ == '__main__':
 
-    parser = argparse.ArgumentParser()
+def add_arguments(parser):
+    """
+    Add the command line options of this script to an argparse parser
+    """
     parser.add_argument(
         '-o',
         '--output',
@@ -422,14 +1236,42 @@ if __name__ == '__main__':
         default=None,
         type=str
     )
+    parser.add_argument(
+        '--orcids-file',
+        dest='orcids_file',
+        nargs='+',
+        help='Give the numbers of many ORCiD iDs, from files of them (- for '
+             'stdin), one or more a line, a batch of them in each request '
+             '[default: None]',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--batch-size',
+        dest='batch_size',
+        help='Number of ORCiD iDs in each request with --orcids-file '
+             '[default: {}]'.format(BATCH_SIZE),
+        default=BATCH_SIZE,
+        type=int
+    )
+    bigquery.add_arguments(parser)
     parser.add_argument(
         '--save-to-file',
         dest='save',
         help='Save plots to a given format [default: False]',
-        choices=['csv'],
+        choices=['csv', 'parquet', 'feather'],
         default=False,
         type=str
     )
+    parser.add_argument(
+        '--compression',
+        dest='compression',
+        help='Compression of parquet or feather files [default: snappy for '
+             'parquet, lz4 for feather]',
+        choices=['none', 'snappy', 'gzip', 'brotli', 'lz4', 'zstd'],
+        default=None,
+        type=str
+    )
     parser.add_argument(
         '--plot',
         dest='plot',
@@ -458,21 +1300,90 @@ if __name__ == '__main__':
         default=None,
         type=str
     )
+    parser.add_argument(
+        '--approximate',
+        dest='approximate',
+        help='Count the papers in bins of citations and reads, rather than '
+             'every value, and give bounds on the ranks and h-index',
+        action='store_true',
+        default=False
+    )
+    parser.add_argument(
+        '--facet-page-size',
+        dest='facet_page_size',
+        help='Number of facet values requested at a time [default: {}]'.format(FACET_PAGE_SIZE),
+        default=FACET_PAGE_SIZE,
+        type=int
+    )
+    parser.add_argument(
+        '--facet-workers',
+        dest='facet_workers',
+        help='Number of facet pages requested at once [default: {}]'.format(FACET_WORKERS),
+        default=FACET_WORKERS,
+        type=int
+    )
+    profiling.add_arguments(parser)
+    latency.add_arguments(parser)
+    http_cache.add_arguments(parser)
+    archive.add_arguments(parser)
 
-    args = parser.parse_args()
 
-    if args.orcid is None and args.query is None and args.bibcodes is None:
+def run(args, parser):
+    """
+    Run the script for the command line options that were parsed
+    """
+    if args.orcid is None and args.query is None and args.bibcodes_file is None and args.orcids_file is None:
         parser.print_help()
         sys.exit()
 
-    main(
-        output_path=args.output,
-        output_name=args.output_name,
-        figure_format=args.format,
-        orcid=args.orcid,
-        query=args.query,
-        save=args.save,
-        plot=args.plot,
-        log=args.log,
-        token=args.token
-    )
+    if args.save == 'feather' and args.compression not in [None, 'none', 'lz4', 'zstd']:
+        parser.error('feather files can only be compressed with lz4 or zstd')
+
+
+    if args.orcids_file:
+        if args.orcid or args.query or args.bibcodes_file:
+            parser.error('--orcids-file cannot be used with --orcid, --query or --bibcodes-file')
+        if args.plot or args.approximate:
+            parser.error('--orcids-file cannot be used with --plot or --approximate')
+        if args.batch_size < 1:
+            parser.error('--batch-size must be at least 1')
+
+        with profiling.profile_to(args.profile, args.profile_dir), latency.from_args(args), \
+                archive.from_args(args), http_cache.from_args(args):
+            main_batch(
+                output_path=args.output,
+                orcids=bigquery.read_list(args.orcids_file),
+                output_name=args.output_name,
+                save=args.save,
+                token=args.token,
+                compression=args.compression,
+                batch_size=args.batch_size,
+                workers=args.facet_workers
+            )
+        return
+
+    with profiling.profile_to(args.profile, args.profile_dir), latency.from_args(args), \
+            archive.from_args(args), http_cache.from_args(args):
+        main(
+            output_path=args.output,
+            output_name=args.output_name,
+            figure_format=args.format,
+            orcid=args.orcid,
+            query=args.query,
+            save=args.save,
+            plot=args.plot,
+            log=args.log,
+            token=args.token,
+            compression=args.compression,
+            facet_page_size=args.facet_page_size,
+            facet_workers=args.facet_workers,
+            approximate=args.approximate,
+            bibcodes=bigquery.from_args(args)
+        )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    run(parser.parse_args(), parser)